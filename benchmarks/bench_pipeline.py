@@ -0,0 +1,284 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import CNN_img_to_text as detection
+from synthetic import synthetic_page
+
+# Baseline đo trên từng máy, không commit (xem .gitignore)
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+# Tham số ảnh hưởng tới thời gian đo: phải giống baseline thì mới so được
+PARAM_NAMES = ('model', 'threads', 'boxes', 'batch', 'rpc_latency', 'seed')
+
+# name -> hàm setup(ctx) trả về hàm không tham số được đo thời gian
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class Context:
+    """Dữ liệu dùng chung giữa các benchmark, chỉ được tạo khi có benchmark cần tới"""
+
+    def __init__(self, args, work_dir):
+        self.args = args
+        self.work_dir = work_dir
+        self._cache = {}
+
+    def _get(self, key, factory):
+        if key not in self._cache:
+            self._cache[key] = factory()
+        return self._cache[key]
+
+    @property
+    def model_path(self):
+        def create():
+            if self.args.model:
+                return self.args.model
+            # Không có trọng số riêng: YOLO12n khởi tạo ngẫu nhiên từ cấu hình, chạy offline
+            from ultralytics import YOLO
+            path = os.path.join(self.work_dir, "yolo12n_random.pt")
+            YOLO("yolo12n.yaml").save(path)
+            return path
+        return self._get('model_path', create)
+
+    @property
+    def model(self):
+        return self._get('model', lambda: detection.load_model(self.model_path, num_threads=self.args.threads))
+
+    @property
+    def page(self):
+        """(ảnh trang, danh sách box) với args.boxes ô chữ"""
+        return self._get('page', lambda: synthetic_page(self.args.boxes, seed=self.args.seed))
+
+    @property
+    def pages(self):
+        return self._get('pages', lambda: [synthetic_page(self.args.boxes, seed=self.args.seed + i)[0]
+                                           for i in range(self.args.batch)])
+
+    @property
+    def sorted_objects(self):
+        def create():
+            img, boxes = self.page
+            detections = [{'class_id': 0, 'class_name': 'text', 'confidence': 0.9, 'coords': tuple(box)}
+                          for box in boxes]
+            return detection.sort_reading_order(detection.build_objects(detections, img.shape))
+        return self._get('sorted_objects', create)
+
+    @property
+    def crops(self):
+        return self._get('crops', lambda: detection.crop_objects(self.page[0], self.sorted_objects))
+
+    @property
+    def ocr_results(self):
+        def create():
+            from fake_vision import FakeVisionClient
+            from OCR_img_ggvision import OCRProcessor
+            from recognition_engine import RecognitionEngine
+            processor = OCRProcessor(client=FakeVisionClient(), engine=RecognitionEngine(qps=None))
+            return processor.process_crops(self.crops)
+        return self._get('ocr_results', create)
+
+
+@benchmark('model_load')
+def bench_model_load(ctx):
+    path = ctx.model_path
+    return lambda: detection.load_model(path, num_threads=ctx.args.threads)
+
+
+@benchmark('detect_single')
+def bench_detect_single(ctx):
+    model, img = ctx.model, ctx.page[0]
+    return lambda: detection.detect_batch(model, [img])
+
+
+@benchmark('detect_batch')
+def bench_detect_batch(ctx):
+    model, pages = ctx.model, ctx.pages
+    return lambda: detection.detect_batch(model, pages)
+
+
+@benchmark('reading_order')
+def bench_reading_order(ctx):
+    img, boxes = ctx.page
+    detections = [{'class_id': 0, 'class_name': 'text', 'confidence': 0.9, 'coords': tuple(box)}
+                  for box in boxes]
+    objects = detection.build_objects(detections, img.shape)
+    shuffled = [objects[i] for i in np.random.default_rng(ctx.args.seed).permutation(len(objects))]
+    return lambda: detection.sort_reading_order(shuffled)
+
+
+@benchmark('crop_encode')
+def bench_crop_encode(ctx):
+    img, sorted_objects = ctx.page[0], ctx.sorted_objects
+    return lambda: detection.crop_objects(img, sorted_objects)
+
+
+@benchmark('ocr_fake_vision')
+def bench_ocr_fake_vision(ctx):
+    from fake_vision import FakeVisionClient
+    from OCR_img_ggvision import OCRProcessor
+    from recognition_engine import RecognitionEngine
+
+    crops = ctx.crops
+    # Mỗi lần đo một processor mới, không cache: đo đúng chi phí gửi nhận + dựng kết quả
+    return lambda: OCRProcessor(client=FakeVisionClient(latency=ctx.args.rpc_latency),
+                                engine=RecognitionEngine(qps=None)).process_crops(crops, batch_size=16)
+
+
+@benchmark('excel_report')
+def bench_excel_report(ctx):
+    from excel_report import write_ocr_report
+
+    results = ctx.ocr_results
+    crop_images = {crop['name']: crop['content'] for crop in ctx.crops}
+    output_path = os.path.join(ctx.work_dir, "ocr_summary.xlsx")
+    # Cache thumbnail riêng cho mỗi lần đo để không đo nhầm trường hợp đã cache
+    counter = iter(range(1 << 30))
+    return lambda: write_ocr_report(results, output_path, ctx.work_dir, crop_images=crop_images,
+                                    cache_dir=os.path.join(ctx.work_dir, f"thumbs_{next(counter)}"))
+
+
+@benchmark('render_overlay')
+def bench_render_overlay(ctx):
+    from overlay_renderer import render_overlay
+
+    img, results = ctx.page[0], ctx.ocr_results
+    return lambda: render_overlay(img, results)
+
+
+def timed(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run(names, args):
+    report = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        ctx = Context(args, work_dir)
+        for name in names:
+            try:
+                # Bỏ output tiến trình của các hàm được đo
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    fn = BENCHMARKS[name](ctx)
+                    times = timed(fn, args.repeat, warmup=0 if name == 'model_load' else 1)
+            except ImportError as e:
+                print(f"{name:<18} bỏ qua: {str(e)}")
+                continue
+            report[name] = {'best_ms': min(times) * 1000, 'median_ms': statistics.median(times) * 1000}
+            print(f"{name:<18} {report[name]['best_ms']:10.2f} ms  (median {report[name]['median_ms']:.2f} ms)")
+    return report
+
+
+def bench_params(args):
+    return {name: getattr(args, name) for name in PARAM_NAMES}
+
+
+def machine_info():
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'cpu_count': os.cpu_count()}
+
+
+def check_baseline(args, baseline):
+    """
+    Trả về danh sách tham số khác baseline (không so được). Khác máy (số core, OS, Python)
+    chỉ cảnh báo vì vẫn có thể cố ý so giữa hai máy.
+    """
+    params = bench_params(args)
+    saved = baseline.get('params', {})
+    mismatched = [f"{name}: baseline {saved.get(name)!r}, hiện tại {params[name]!r}"
+                  for name in PARAM_NAMES if saved.get(name) != params[name]]
+    machine = machine_info()
+    for key, value in baseline.get('machine', {}).items():
+        if machine.get(key) != value:
+            print(f"Cảnh báo: baseline đo trên máy khác ({key}: {value!r}, máy này {machine.get(key)!r})")
+    return mismatched
+
+
+def compare(report, baseline, tolerance):
+    """In tỉ lệ so với baseline, trả về danh sách benchmark chậm hơn quá tolerance"""
+    regressions = []
+    print(f"\n{'benchmark':<18} {'baseline':>10} {'hiện tại':>10} {'tỉ lệ':>7}")
+    for name, current in report.items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['best_ms']
+        ratio = current['best_ms'] / before if before else float('inf')
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  <-- chậm hơn"
+        print(f"{name:<18} {before:10.2f} {current['best_ms']:10.2f} {ratio:7.2f}{flag}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark các bước detection -> OCR -> báo cáo trên trang giả lập")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help="Chỉ chạy các benchmark này")
+    parser.add_argument('--model', help="Trọng số YOLO (mặc định YOLO12n khởi tạo ngẫu nhiên)")
+    parser.add_argument('--threads', type=int, default=6, help="Số luồng torch")
+    parser.add_argument('--boxes', type=int, default=200, help="Số ô chữ trên mỗi trang giả lập")
+    parser.add_argument('--batch', type=int, default=4, help="Số trang cho detect_batch")
+    parser.add_argument('--rpc-latency', type=float, default=0.0, help="Độ trễ giả lập mỗi RPC Vision (giây)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='NAME', help="Lưu kết quả làm baseline benchmarks/baselines/NAME.json (riêng máy này)")
+    parser.add_argument('--compare', metavar='NAME', help="So với baseline NAME, exit code 1 nếu chậm hơn")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Cho phép chậm hơn baseline bao nhiêu (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    names = args.only or list(BENCHMARKS)
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json"), 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        # Kiểm tra trước khi đo để không mất thời gian chạy benchmark vô ích
+        mismatched = check_baseline(args, baseline)
+        if mismatched:
+            print(f"Không so với baseline {args.compare}: tham số khác ({'; '.join(mismatched)})")
+            sys.exit(2)
+
+    print(f"Trang giả lập: {args.boxes} box, repeat {args.repeat}")
+    report = run(names, args)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save}.json")
+        params = dict(bench_params(args), repeat=args.repeat)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'machine': machine_info(),
+                       'params': params, 'results': report}, f, ensure_ascii=False, indent=2)
+        print(f"\nĐã lưu baseline: {path}")
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nChậm hơn baseline quá {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from reading_order import reading_order
+from synthetic import synthetic_boxes
+
+
+def legacy_order(boxes, y_threshold=30):
+    """Thuật toán cũ của CNN_img_to_text: ngưỡng cố định so với box đầu tiên của dòng"""
+    objects = [{'i': i, 'cx': (b[0] + b[2]) / 2, 'cy': (b[1] + b[3]) / 2} for i, b in enumerate(boxes)]
+    objects.sort(key=lambda o: o['cy'])
+    order, line, current_y = [], [], objects[0]['cy']
+    for obj in objects:
+        if abs(obj['cy'] - current_y) <= y_threshold:
+            line.append(obj)
+        else:
+            order.extend(o['i'] for o in sorted(line, key=lambda o: o['cx']))
+            line, current_y = [obj], obj['cy']
+    order.extend(o['i'] for o in sorted(line, key=lambda o: o['cx']))
+    return np.array(order)
+
+
+def accuracy(order, truth):
+    """Tỉ lệ box nằm đúng vị trí trong thứ tự đọc"""
+    return float(np.mean(np.asarray(order) == truth))
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark thứ tự đọc trên trang giả lập")
+    parser.add_argument('--boxes', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [
+        ("1 cột", dict(columns=1), {}),
+        ("1 cột, nghiêng 2%", dict(columns=1, skew=0.02), dict(deskew=True)),
+        ("2 cột", dict(columns=2), dict(columns=True)),
+    ]
+    for name, page_kwargs, order_kwargs in cases:
+        boxes, truth = synthetic_boxes(args.boxes, **page_kwargs)
+        new_time, new_order = timed(lambda: reading_order(boxes, **order_kwargs), args.repeat)
+        old_time, old_order = timed(lambda: legacy_order(boxes), args.repeat)
+        print(f"{name} ({len(boxes)} box):")
+        print(f"  reading_order: {new_time*1000:8.2f} ms  đúng thứ tự: {accuracy(new_order, truth)*100:5.1f}%")
+        print(f"  legacy:        {old_time*1000:8.2f} ms  đúng thứ tự: {accuracy(old_order, truth)*100:5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import numpy as np
+
+
+def synthetic_boxes(n_boxes=10000, columns=1, skew=0.0, boxes_per_line=8, seed=0):
+    """
+    Sinh box [x1, y1, x2, y2] cho một trang giả lập theo thứ tự đọc chuẩn
+    (hết cột trái rồi sang cột phải, trong cột từ trên xuống, trong dòng từ trái sang phải).
+    skew là độ nghiêng dy/dx của trang. Trả về (boxes đã xáo trộn, thứ tự đọc đúng).
+    """
+    rng = np.random.default_rng(seed)
+    column_width = boxes_per_line * 220
+    column_gap = 200
+    line_height = 60
+
+    boxes = []
+    per_column = int(np.ceil(n_boxes / columns))
+    for col in range(columns):
+        count = min(per_column, n_boxes - len(boxes))
+        lines = int(np.ceil(count / boxes_per_line))
+        x_offset = col * (column_width + column_gap)
+        for line in range(lines):
+            in_line = min(boxes_per_line, count - line * boxes_per_line)
+            x = x_offset + rng.uniform(0, 20)
+            for _ in range(in_line):
+                w = rng.uniform(60, 180)
+                h = rng.uniform(22, 38)
+                y = line * line_height + rng.uniform(-4, 4)
+                boxes.append([x, y, x + w, y + h])
+                x += w + rng.uniform(15, 40)
+
+    boxes = np.array(boxes)
+    if skew:
+        cx = (boxes[:, 0] + boxes[:, 2]) / 2
+        boxes[:, [1, 3]] += (skew * cx)[:, None]
+
+    shuffle = rng.permutation(len(boxes))
+    truth = np.argsort(shuffle)
+    return boxes[shuffle], truth
+
+
+def synthetic_page(n_boxes=200, width=2480, height=3508, seed=0):
+    """Sinh ảnh trang trắng (BGR) có n_boxes ô chữ viết tay giả và danh sách box tương ứng"""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    boxes = []
+    cols = 6
+    cell_w, cell_h = width // cols, 60
+    for i in range(n_boxes):
+        row, col = divmod(i, cols)
+        x1 = col * cell_w + 20
+        y1 = 100 + row * (cell_h + 10)
+        if y1 + cell_h > height:
+            break
+        x2, y2 = x1 + cell_w - 40, y1 + cell_h
+        cv2.rectangle(page, (x1, y1), (x2, y2), (0, 0, 0), 1)
+        for _ in range(int(rng.integers(2, 6))):
+            px = int(rng.integers(x1 + 5, x2 - 40))
+            cv2.putText(page, "ab", (px, y2 - 15), cv2.FONT_HERSHEY_SCRIPT_SIMPLEX, 1.0, (40, 40, 40), 2)
+        boxes.append([x1, y1, x2, y2])
+    return page, boxes
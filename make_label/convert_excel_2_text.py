@@ -1,75 +1,148 @@
-import pandas as pd
-import openpyxl
+import argparse
+import concurrent.futures
 import os
+import posixpath
 import shutil
-from openpyxl_image_loader import SheetImageLoader
-
-def prepare_training_data(excel_path, output_dir):
-    # Load workbook for image extraction
-    wb = openpyxl.load_workbook(excel_path)
-    sheet = wb.active
-    image_loader = SheetImageLoader(sheet)
-    
-    # Read text data with pandas
-    df = pd.read_excel(excel_path)
-    
-    # Sort DataFrame by STT to ensure correct order and remove any NaN rows
-    df = df.dropna(subset=['STT'])
-    df['STT'] = df['STT'].astype(int)
-    df = df.sort_values(by='STT')
-    
-    print(f"Total valid rows in Excel: {len(df)}")
-    print("First few rows after sorting:")
-    print(df.head())
-    
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from xlsx_reader import XlsxReader
+
+# Tên cột trong dòng tiêu đề (file gộp của take_all_excel.py, hoặc file của make_label_RNN.py không có STT)
+STT_HEADER = "STT"
+IMAGE_HEADER = "Image"
+TEXT_HEADER = "Extracted Text"
+CROP_ID_HEADER = "Crop ID"
+
+def convert_workbook(excel_path, images_dir, crops_dir=None, index=0):
+    """
+    Lấy ảnh + text của một workbook bằng cách đọc thẳng gói xlsx một lượt: ảnh được ghép với dòng
+    theo anchor trong drawing, ghi nguyên bytes (crop gốc trong crops_dir theo Crop ID, nếu không có
+    thì ảnh trong xl/media), không mã hóa lại. Ảnh tên image_<index>_<STT>.<đuôi>.
+    Trả về (các dòng labels.txt theo thứ tự STT, số dòng bỏ qua).
+    """
+    # Ảnh gốc do make_label_RNN.py lưu theo Crop ID; ảnh trong Excel chỉ là thumbnail
+    if crops_dir is None:
+        crops_dir = os.path.join(os.path.dirname(os.path.abspath(excel_path)), 'crops')
+
+    entries = []
+    skipped_count = 0
+    with XlsxReader(excel_path) as reader:
+        images = reader.image_anchors()
+        rows = reader.rows()
+        header_row, header = next(rows, (1, {}))
+        columns = {str(value).strip(): column for column, value in header.items()}
+        if TEXT_HEADER not in columns:
+            raise ValueError(f"Không có cột '{TEXT_HEADER}' trong {excel_path}")
+        image_column = columns.get(IMAGE_HEADER, 'B')
+
+        for row_number, values in rows:
+            stt = values.get(columns[STT_HEADER]) if STT_HEADER in columns else row_number - header_row
+            if stt is None:
+                continue
+            try:
+                stt = int(stt)
+                text_value = values.get(columns[TEXT_HEADER])
+                text_content = str(text_value).strip() if text_value is not None else ""
+                crop_id = values.get(columns[CROP_ID_HEADER]) if CROP_ID_HEADER in columns else None
+                original_path = os.path.join(crops_dir, f'{crop_id}.png') if crop_id is not None else None
+
+                if original_path and os.path.exists(original_path):
+                    # Copy original-resolution crop
+                    image_filename = f'image_{index}_{stt}.png'
+                    shutil.copyfile(original_path, os.path.join(images_dir, image_filename))
+                elif (row_number, image_column) in images:
+                    # Workbook cũ không có Crop ID: ghi nguyên bytes ảnh trong xl/media
+                    part = images[(row_number, image_column)]
+                    image_filename = f'image_{index}_{stt}{posixpath.splitext(part)[1].lower() or ".png"}'
+                    with open(os.path.join(images_dir, image_filename), 'wb') as f:
+                        f.write(reader.read(part))
+                else:
+                    print(f"Warning: No image found in cell {image_column}{row_number} for STT {stt} ({excel_path})")
+                    skipped_count += 1
+                    continue
+                entries.append((stt, f"images/{image_filename}\t{text_content}\n"))
+
+            except Exception as e:
+                print(f"Error processing row {row_number} of {excel_path}: {str(e)}")
+                skipped_count += 1
+
+    entries.sort(key=lambda entry: entry[0])
+    return [line for _, line in entries], skipped_count
+
+def find_workbooks(paths):
+    """File .xlsx được truyền vào hoặc nằm trong các thư mục được truyền vào (theo tên)"""
+    workbooks = []
+    for path in paths:
+        if os.path.isdir(path):
+            workbooks.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                             if name.endswith('.xlsx') and not name.startswith('~$'))
+        else:
+            workbooks.append(path)
+    return workbooks
+
+def prepare_training_data(excel_paths, output_dir, crops_dir=None, workers=None):
+    """
+    Tạo output_dir/images + output_dir/labels.txt (dòng "images/<file>\\t<text>") từ một hoặc
+    nhiều workbook; các workbook được xử lý song song (mỗi process một workbook), labels.txt
+    giữ thứ tự workbook rồi STT.
+    """
+    if isinstance(excel_paths, str):
+        excel_paths = [excel_paths]
+
     # Create output directories
     images_dir = os.path.join(output_dir, 'images')
     os.makedirs(images_dir, exist_ok=True)
-    
+
     # Create labels.txt file
     labels_path = os.path.join(output_dir, 'labels.txt')
-    
+
     processed_count = 0
     skipped_count = 0
-    
-    with open(labels_path, 'w', encoding='utf-8') as f:
-        for _, row in df.iterrows():
+    workers = max(1, min(workers or os.cpu_count() or 1, len(excel_paths)))
+
+    # Một workbook thì không cần khởi động process con
+    executor_class = concurrent.futures.ThreadPoolExecutor if workers == 1 else concurrent.futures.ProcessPoolExecutor
+    with open(labels_path, 'w', encoding='utf-8') as f, executor_class(max_workers=workers) as executor:
+        futures = [executor.submit(convert_workbook, path, images_dir, crops_dir, index)
+                   for index, path in enumerate(excel_paths)]
+        # Ghi theo thứ tự workbook, không theo thứ tự xong
+        for path, future in zip(excel_paths, futures):
             try:
-                stt = int(row['STT'])
-                cell = f'B{stt+1}'  # Image is in column B
-                text_content = str(row['Extracted Text']).strip()
-                
-                if image_loader.image_in(cell):
-                    image = image_loader.get(cell)
-                    image_filename = f'image_0_{stt}.png'
-                    image_path = os.path.join(images_dir, image_filename)
-                    
-                    # Save image
-                    image.save(image_path)
-                    
-                    # Write to labels file using actual STT
-                    f.write(f"images/{image_filename}\t{text_content}\n")
-                    processed_count += 1
-                    print(f"Processed STT {stt}: {text_content}")
-                else:
-                    print(f"Warning: No image found in cell {cell} for STT {stt}")
-                    skipped_count += 1
-                    
+                lines, skipped = future.result()
             except Exception as e:
-                print(f"Error processing STT {stt}: {str(e)}")
-                skipped_count += 1
+                print(f"Error processing {path}: {str(e)}")
+                continue
+            f.writelines(lines)
+            processed_count += len(lines)
+            skipped_count += skipped
+            print(f"Processed {path}: {len(lines)} images, {skipped} skipped")
 
     print(f"\nProcessing Summary:")
     print(f"Successfully processed: {processed_count}")
     print(f"Skipped rows: {skipped_count}")
     print(f"Output directory: {output_dir}")
+    return processed_count
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tạo dữ liệu huấn luyện (images/ + labels.txt) từ các file Excel đã gán nhãn")
+    parser.add_argument('inputs', nargs='*',
+                        default=[r"E:\WORK\project\OCR\Recognition_OCR\make_label\output_excel_RNN\0.xlsx"],
+                        help="File .xlsx hoặc thư mục chứa các file .xlsx")
+    parser.add_argument('--output-dir', default=r"E:\WORK\project\OCR\Recognition_OCR\make_label\training_data")
+    parser.add_argument('--crops-dir', default=r"E:\WORK\project\OCR\Recognition_OCR\make_label\output_excel_RNN\crops",
+                        help="Thư mục crop gốc theo Crop ID (rỗng = thư mục crops cạnh từng file Excel)")
+    parser.add_argument('--workers', type=int, help="Số process xử lý song song (mặc định số core)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
 
-if __name__ == "__main__":
-    excel_path = r"E:\WORK\project\OCR\Recognition_OCR\make_label\output_excel_RNN\0.xlsx"
-    output_dir = r"E:\WORK\project\OCR\Recognition_OCR\make_label\training_data"
-    
     # Clear output directory first
-    if os.path.exists(output_dir):
-        shutil.rmtree(output_dir)
-    
-    prepare_training_data(excel_path, output_dir)
\ No newline at end of file
+    if os.path.exists(args.output_dir):
+        shutil.rmtree(args.output_dir)
+
+    prepare_training_data(find_workbooks(args.inputs), args.output_dir, args.crops_dir or None, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
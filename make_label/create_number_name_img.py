@@ -1,33 +1,49 @@
+import argparse
 import os
 import shutil
 from pathlib import Path
 
 # Source and destination directories
-src_dir = r"C:\Users\nguye\Downloads\CamScanner 2025-05-29 14.56"
-dest_dir = r"E:\WORK\project\OCR\Recognition_OCR\data\a"
-
-# Create destination directory if it doesn't exist
-os.makedirs(dest_dir, exist_ok=True)
-
-# Get all files from source directory
-files = os.listdir(src_dir)
-
-# Process each file
-for file in files:
-    # Check if the file is an image (you can add more extensions if needed)
-    if file.lower().endswith(('.png', '.jpg', '.jpeg', '.tiff', '.bmp')):
-        # Get file name without extension
-        name, ext = os.path.splitext(file)
-        
-        # Create new filename with 'a' suffix
-        new_filename = f"{name}a{ext}"
-        
-        # Full paths for source and destination
-        src_path = os.path.join(src_dir, file)
-        dest_path = os.path.join(dest_dir, new_filename)
-        
-        # Copy file with new name to destination
-        shutil.copy2(src_path, dest_path)
-        print(f"Copied {file} to {new_filename}")
-
-print("Processing completed!")
\ No newline at end of file
+SRC_DIR = r"C:\Users\nguye\Downloads\CamScanner 2025-05-29 14.56"
+DEST_DIR = r"E:\WORK\project\OCR\Recognition_OCR\data\a"
+
+def copy_with_suffix(src_dir: str, dest_dir: str, suffix: str = "a"):
+    # Create destination directory if it doesn't exist
+    os.makedirs(dest_dir, exist_ok=True)
+
+    # Get all files from source directory
+    files = os.listdir(src_dir)
+
+    # Process each file
+    for file in files:
+        # Check if the file is an image (you can add more extensions if needed)
+        if file.lower().endswith(('.png', '.jpg', '.jpeg', '.tiff', '.bmp')):
+            # Get file name without extension
+            name, ext = os.path.splitext(file)
+            
+            # Create new filename with 'a' suffix
+            new_filename = f"{name}{suffix}{ext}"
+            
+            # Full paths for source and destination
+            src_path = os.path.join(src_dir, file)
+            dest_path = os.path.join(dest_dir, new_filename)
+            
+            # Copy file with new name to destination
+            shutil.copy2(src_path, dest_path)
+            print(f"Copied {file} to {new_filename}")
+
+    print("Processing completed!")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chép ảnh sang thư mục dữ liệu, thêm hậu tố vào tên file")
+    parser.add_argument('--src-dir', default=SRC_DIR)
+    parser.add_argument('--dest-dir', default=DEST_DIR)
+    parser.add_argument('--suffix', default="a")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    copy_with_suffix(args.src_dir, args.dest_dir, args.suffix)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
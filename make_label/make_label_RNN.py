@@ -1,64 +1,108 @@
+import argparse
+import hashlib
 import os
+import sys
 from pathlib import Path
-from typing import List, Dict
-from openpyxl import Workbook
-from openpyxl.drawing.image import Image as XLImage
-from PIL import Image
+from typing import List, Dict, Optional
 import cv2
-from ultralytics import YOLO
-from google.cloud import vision
-from google.oauth2 import service_account
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from ocr_cache import OCRCache
+from recognition_engine import RecognitionEngine, RetryableError, RETRYABLE_STATUS_CODES
+from reading_order import reading_order
+from detection_client import DetectionClient
+from excel_report import ThumbnailCache, THUMBNAIL_DIR_NAME
+import instrumentation as metrics
+from lazy_import import lazy_module
+
+# Chỉ import google-cloud-vision khi khởi tạo client / gọi OCR
+vision = lazy_module("google.cloud.vision")
+service_account = lazy_module("google.oauth2.service_account")
+
+LANGUAGE_HINTS = ["vi"]
+# Ảnh crop gốc cho huấn luyện nằm trong thư mục này cạnh file Excel, tên file là <Crop ID>.png
+CROPS_DIR_NAME = "crops"
+THUMBNAIL_HEIGHT = 100
 
 class ImageTextExtractor:
-    def __init__(self, yolo_model_path: str, google_credentials_path: str):
-        # Khởi tạo YOLO model
-        self.yolo_model = YOLO(yolo_model_path)
-        self.yolo_model.to('cpu')
+    def __init__(self, yolo_model_path: str, google_credentials_path: str, cache: Optional[OCRCache] = None,
+                 engine: Optional[RecognitionEngine] = None, detection_server: Optional[str] = None):
+        # Dùng detection server đang chạy sẵn nếu có, tránh tải lại mô hình YOLO mỗi lần chạy
+        self.detector = DetectionClient(detection_server) if detection_server else None
+        if self.detector is None:
+            from ultralytics import YOLO
+            with metrics.span('load'):
+                self.yolo_model = YOLO(yolo_model_path)
+                self.yolo_model.to('cpu')
         
         # Khởi tạo Google Vision client
         credentials = service_account.Credentials.from_service_account_file(google_credentials_path)
         self.vision_client = vision.ImageAnnotatorClient(credentials=credentials)
+        self.cache = cache
+        self.engine = engine or RecognitionEngine()
         self.temp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp")
         os.makedirs(self.temp_dir, exist_ok=True)
 
     def process_image(self, image_path: str) -> List[Dict]:
         try:
             # Đọc ảnh
-            img = cv2.imread(image_path)
+            with metrics.span('decode'):
+                img = cv2.imread(image_path)
             if img is None:
                 raise ValueError(f"Không thể đọc ảnh: {image_path}")
 
             # Phát hiện vùng text bằng YOLO
-            results = self.yolo_model(img, conf=0.3, iou=0.45, device='cpu')
-            if not results or len(results) == 0:
-                return []
-
-            detected_texts = []
-            boxes = results[0].boxes
+            with metrics.span('infer'):
+                if self.detector is not None:
+                    detections = self.detector.detect(img, conf=0.3, iou=0.45)
+                    xyxy = np.array([det['coords'] for det in detections], dtype=np.float64).reshape(-1, 4)
+                else:
+                    results = self.yolo_model(img, conf=0.3, iou=0.45, device='cpu')
+                    if not results or len(results) == 0:
+                        return []
+                    xyxy = results[0].boxes.xyxy.cpu().numpy()
+            if self.detector is None:
+                metrics.observe('nms', results[0].speed.get('postprocess', 0.0) / 1000)
+            crop_paths = []
+            contents = []
 
-            # Xử lý từng vùng text
-            for i, box in enumerate(boxes):
-                x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
+            # Cắt và mã hóa từng vùng text theo thứ tự đọc (dòng trên xuống, trái sang phải)
+            for i, box_idx in enumerate(reading_order(xyxy)):
+                x1, y1, x2, y2 = map(int, xyxy[box_idx].tolist())
                 
                 # Cắt vùng ảnh
                 cropped_img = img[y1:y2, x1:x2]
                 temp_path = os.path.join(self.temp_dir, f"temp_crop_{i}.png")
-                cv2.imwrite(temp_path, cropped_img)
+                with metrics.span('encode'):
+                    ok, buffer = cv2.imencode('.png', cropped_img)
+                if not ok:
+                    print(f"Warning: Không thể mã hóa crop {i}")
+                    continue
+                content = buffer.tobytes()
+                with open(temp_path, 'wb') as f:
+                    f.write(content)
+                crop_paths.append(temp_path)
+                contents.append(content)
+            metrics.count('crops', len(contents))
 
-                # OCR bằng Google Vision
-                with open(temp_path, 'rb') as image_file:
-                    content = image_file.read()
-                
-                vision_image = vision.Image(content=content)
-                response = self.vision_client.text_detection(
-                    image=vision_image,
-                    image_context={"language_hints": ["vi"]}
-                )
+            # OCR bằng Google Vision qua engine (giới hạn QPS, retry khi lỗi tạm thời)
+            outcomes = self.engine.run(self._text_detection, contents)
 
-                text = response.text_annotations[0].description if response.text_annotations else ""
+            detected_texts = []
+            for temp_path, content, outcome in zip(crop_paths, contents, outcomes):
+                response = outcome['value']
+                text = ""
+                if outcome['ok'] and response.text_annotations:
+                    text = response.text_annotations[0].description
+                if not outcome['ok']:
+                    # Giữ lại vùng bị lỗi để không mất dòng trong file Excel
+                    print(f"Warning: OCR lỗi cho {os.path.basename(temp_path)}: {outcome['error']}")
                 detected_texts.append({
                     'crop_image': temp_path,
-                    'text': text
+                    'content': content,
+                    'text': text,
+                    'error': outcome['error']
                 })
 
             return detected_texts
@@ -67,6 +111,31 @@ class ImageTextExtractor:
             print(f"Error in process_image: {str(e)}")
             return []
 
+    def _text_detection(self, content: bytes):
+        # Dùng lại kết quả đã OCR nếu crop này đã có trong cache
+        cache_key = None
+        if self.cache is not None:
+            cache_key = OCRCache.make_key(content, LANGUAGE_HINTS)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return vision.AnnotateImageResponse.deserialize(cached)
+
+        vision_image = vision.Image(content=content)
+        metrics.count('api_calls')
+        with metrics.span('rpc'):
+            response = self.vision_client.text_detection(
+                image=vision_image,
+                image_context={"language_hints": LANGUAGE_HINTS},
+                **self.engine.call_options()
+            )
+        if response.error.message:
+            if response.error.code in RETRYABLE_STATUS_CODES:
+                raise RetryableError(response.error.message)
+            raise ValueError(response.error.message)
+        if cache_key is not None and not response.error.message:
+            self.cache.put(cache_key, vision.AnnotateImageResponse.serialize(response))
+        return response
+
     def __del__(self):
         # Cleanup temp files when object is destroyed
         if hasattr(self, 'temp_dir') and os.path.exists(self.temp_dir):
@@ -80,7 +149,21 @@ class ImageTextExtractor:
             except Exception as e:
                 print(f"Error removing temp directory: {str(e)}")
 
-    def create_excel_report(self, results: List[Dict], output_path: str):
+    def create_excel_report(self, results: List[Dict], output_path: str, crops_dir: Optional[str] = None):
+        """
+        Báo cáo Excel cho việc gán nhãn: cột Image chỉ chứa thumbnail cao 100px (workbook nhỏ, mở và
+        gộp nhanh), ảnh crop gốc được lưu nguyên bytes vào crops_dir (mặc định <thư mục output>/crops)
+        với tên <Crop ID>.png để convert_excel_2_text.py lấy làm dữ liệu huấn luyện.
+        """
+        from openpyxl import Workbook
+        from openpyxl.drawing.image import Image as XLImage
+
+        output_dir = os.path.dirname(os.path.abspath(output_path))
+        crops_dir = crops_dir or os.path.join(output_dir, CROPS_DIR_NAME)
+        os.makedirs(crops_dir, exist_ok=True)
+        thumbnails = ThumbnailCache(os.path.join(output_dir, THUMBNAIL_DIR_NAME),
+                                    size=(0, THUMBNAIL_HEIGHT), keep_aspect=True)
+
         wb = Workbook()
         ws = wb.active
         ws.title = "OCR Results"
@@ -88,49 +171,74 @@ class ImageTextExtractor:
         # Set cột headers
         ws['A1'] = "Image"
         ws['B1'] = "Extracted Text"
+        ws['C1'] = "Crop ID"
 
         # Set độ rộng cột
         ws.column_dimensions['A'].width = 30
         ws.column_dimensions['B'].width = 50
+        ws.column_dimensions['C'].width = 20
 
         # Thêm dữ liệu
         for idx, result in enumerate(results, 2):
-            # Thêm ảnh
-            img = Image.open(result['crop_image'])
-            # Resize ảnh để vừa với cell Excel
-            max_height = 100
-            width, height = img.size
-            new_width = int((max_height/height) * width)
-            img = img.resize((new_width, max_height))
-            
-            xl_image = XLImage(result['crop_image'])
-            xl_image.width = new_width
-            xl_image.height = max_height
-            
-            ws.row_dimensions[idx].height = max_height
+            content = result.get('content')
+            if content is None:
+                with open(result['crop_image'], 'rb') as f:
+                    content = f.read()
+
+            # Lưu crop gốc (không mã hóa lại) vào sidecar, tên theo nội dung nên chạy lại không bị trùng
+            crop_id = hashlib.sha256(content).hexdigest()[:16]
+            crop_path = os.path.join(crops_dir, f"{crop_id}.png")
+            if not os.path.exists(crop_path):
+                with open(crop_path, 'wb') as f:
+                    f.write(content)
+
+            # Thêm thumbnail để vừa với cell Excel
+            xl_image = XLImage(thumbnails.get(content))
+            xl_image.width = int(xl_image.width * THUMBNAIL_HEIGHT / xl_image.height)
+            xl_image.height = THUMBNAIL_HEIGHT
+            ws.row_dimensions[idx].height = THUMBNAIL_HEIGHT
             ws.add_image(xl_image, f'A{idx}')
 
             # Thêm text
             ws[f'B{idx}'] = result['text']
+            ws[f'C{idx}'] = crop_id
+
+        with metrics.span('write', kind='excel'):
+            wb.save(output_path)
 
-        wb.save(output_path)
+def parse_args():
+    # Đường dẫn mới
+    base_dir = r"E:\WORK\project\OCR\Recognition_OCR\make_label"
+    parser = argparse.ArgumentParser(description="Detection + OCR một ảnh trang, ghi file Excel để gán nhãn text")
+    parser.add_argument('--input-image', default=os.path.join(base_dir, "input_RNN", "19.png"))
+    parser.add_argument('--output-excel', default=os.path.join(base_dir, "output_excel_RNN", "19.xlsx"))
+    parser.add_argument('--model', default=os.path.join(base_dir, "..", "model", "best_yolo12n_v2_5_6_314img.pt"))
+    parser.add_argument('--credentials', default=os.path.join(base_dir, "..", "data_results", "credentials.json"))
+    parser.add_argument('--cache', default=os.path.join(base_dir, "..", "data_results", "ocr_cache.sqlite"))
+    # URL của src/detection_server.py nếu đang chạy (vd: "http://127.0.0.1:8765"), mặc định tải mô hình
+    parser.add_argument('--server', help="URL detection server thay vì tải mô hình")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     try:
-        # Đường dẫn mới
-        base_dir = r"E:\WORK\project\OCR\Recognition_OCR\make_label"
-        model_path = os.path.join(base_dir, "..", "model", "best_yolo12n_v2_5_6_314img.pt")
-        credentials_path = os.path.join(base_dir, "..", "data_results", "credentials.json")
+        model_path = args.model
+        credentials_path = args.credentials
         
         # Tạo thư mục output nếu chưa tồn tại
-        output_dir = os.path.join(base_dir, "output_excel_RNN")
-        os.makedirs(output_dir, exist_ok=True)
-        
-        input_image = os.path.join(base_dir, "input_RNN", "19.png")  
-        output_excel = os.path.join(output_dir, "19.xlsx")
+        input_image = args.input_image
+        output_excel = args.output_excel
+        os.makedirs(os.path.dirname(os.path.abspath(output_excel)), exist_ok=True)
+
+        cache_path = args.cache
+        detection_server = args.server
+        metrics.enable_from_args(args)
 
         print("Initializing extractor...")
-        extractor = ImageTextExtractor(model_path, credentials_path)
+        cache = OCRCache(cache_path)
+        extractor = ImageTextExtractor(model_path, credentials_path, cache=cache,
+                                       detection_server=detection_server)
 
         print(f"Processing image: {input_image}")
         results = extractor.process_image(input_image)
@@ -138,7 +246,10 @@ def main():
         print("Creating Excel report...")
         extractor.create_excel_report(results, output_excel)
 
+        stats = cache.stats()
+        print(f"Cache: {stats['hits']} hit / {stats['misses']} miss")
         print(f"Done! Results saved to: {output_excel}")
+        metrics.finish(args, 'label_rnn')
 
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -1,11 +1,21 @@
-import torch
-from PIL import Image
+import argparse
+import collections
+import concurrent.futures
 import cv2
 import os
-from ultralytics import YOLO
+import shutil
+import sys
 
-# Load YOLO model
-model = YOLO('E:/WORK/project/OCR/Recognition_OCR/model/best_yolo12nv1_26_5.pt')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from detection_client import DetectionClient
+from ocr_journal import OCRJournal, file_digest
+import instrumentation as metrics
+
+model_path = 'E:/WORK/project/OCR/Recognition_OCR/model/best_yolo12nv1_26_5.pt'
+# URL của src/detection_server.py nếu đang chạy (vd: "http://127.0.0.1:8765"), None = tải mô hình
+detection_server = None
+
+model = None
 
 # Add class names dictionary
 class_names = {
@@ -13,81 +23,215 @@ class_names = {
     1: 'special_character'
 }
 
-def process_image(image_path, output_dir, output_label_dir):
-    # Read image
-    img = cv2.imread(image_path)
-    if img is None:
-        print(f"Error loading image: {image_path}")
-        return
-    
-    # Make a copy for labeling
-    labeled_img = img.copy()
-    
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Manifest trong output_dir: mỗi dòng {"name", "hash" của ảnh gốc, "status", "model"}, dòng sau ghi đè dòng trước
+MANIFEST_NAME = "label_manifest.jsonl"
+
+def load_detector():
+    """Tải mô hình khi cần (không tải lúc import), hoặc dùng detection server đang chạy sẵn"""
+    global model
+    if model is None:
+        if detection_server:
+            model = DetectionClient(detection_server, model=os.path.splitext(os.path.basename(model_path))[0])
+        else:
+            from ultralytics import YOLO
+            with metrics.span('load'):
+                model = YOLO(model_path)
+    return model
+
+def model_version():
+    """
+    Phiên bản mô hình ghi vào manifest: hash file trọng số. Với detection server là hash do /health
+    báo (thêm backend nếu không phải torch), server cũ không báo hash thì dùng tên mô hình.
+    """
+    if detection_server:
+        client = load_detector()
+        health = client.health()
+        name = client.model or health['default_model']
+        weights = health.get('weights', {}).get(name)
+        if not weights:
+            return f"server:{name}"
+        version = weights['sha256'][:16]
+        if weights.get('backend', 'torch') != 'torch':
+            version += f"-{weights['backend']}" + ("-int8" if weights.get('int8') else "")
+        return version
+    return file_digest(model_path)[:16]
+
+
+def detect_batch(imgs):
+    """Mỗi ảnh một danh sách (x1, y1, x2, y2, cls, conf) với ngưỡng mặc định của YOLO, cả batch một lần gọi"""
+    detector = load_detector()
+    if isinstance(detector, DetectionClient):
+        with metrics.span('infer', remote=True, batch=len(imgs)):
+            return [[(*det['coords'], det['class_id'], det['confidence']) for det in dets]
+                    for dets in detector.detect_batch(imgs, conf=0.25, iou=0.7)]
+
+    with metrics.span('infer', batch=len(imgs)):
+        results = detector(imgs, verbose=False)
+    batch_detections = []
+    for result in results:
+        metrics.observe('nms', result.speed.get('postprocess', 0.0) / 1000)
+        detections = []
+        for box in result.boxes:
+            x1, y1, x2, y2 = map(float, box.xyxy[0])
+            detections.append((x1, y1, x2, y2, int(box.cls[0]), float(box.conf[0])))
+        batch_detections.append(detections)
+    return batch_detections
+
+
+def detect(img):
+    """Trả về danh sách (x1, y1, x2, y2, cls, conf) với ngưỡng mặc định của YOLO"""
+    return detect_batch([img])[0]
+
+def write_outputs(image_path, img, detections, output_dir, output_label_dir):
+    """Ghi file nhãn YOLO, bản sao ảnh gốc và ảnh chỉ có box; chạy được trong thread của writer pool"""
     # Get image dimensions
     height, width = img.shape[:2]
-    
+
     # Create output paths
     base_name = os.path.splitext(os.path.basename(image_path))[0]
     label_path = os.path.join(output_dir, f"{base_name}.txt")
     orig_img_path = os.path.join(output_dir, f"{base_name}.png")
     bbox_only_path = os.path.join(output_label_dir, f"{base_name}.png")
-    
+
     # Create a separate copy for bbox-only image
     bbox_only_img = img.copy()
-    
+
+    lines = []
+    for x1, y1, x2, y2, cls, conf in detections:
+        # Convert to YOLO format
+        x_center = ((x1 + x2) / 2) / width
+        y_center = ((y1 + y2) / 2) / height
+        w = (x2 - x1) / width
+        h = (y2 - y1) / height
+        lines.append(f"{cls} {x_center:.6f} {y_center:.6f} {w:.6f} {h:.6f}\n")
+
+        # Draw only bounding box without class name on bbox_only_img
+        cv2.rectangle(bbox_only_img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+
+    with metrics.span('write'):
+        # Ảnh gốc đã là PNG thì chép nguyên byte, không giải mã/mã hóa lại
+        if image_path.lower().endswith('.png'):
+            shutil.copyfile(image_path, orig_img_path)
+        else:
+            cv2.imwrite(orig_img_path, img)
+        cv2.imwrite(bbox_only_path, bbox_only_img)
+        # Ghi file nhãn sau cùng: có file .txt nghĩa là ảnh đã gán nhãn xong
+        with open(label_path, 'w') as f:
+            f.writelines(lines)
+    return label_path
+
+def process_image(image_path, output_dir, output_label_dir):
+    # Read image
+    with metrics.span('decode'):
+        img = cv2.imread(image_path)
+    if img is None:
+        print(f"Error loading image: {image_path}")
+        return
+
     # Run inference
-    results = model(img)
-    
-    # Open label file
-    with open(label_path, 'w') as f:
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                # Get box coordinates
-                x1, y1, x2, y2 = map(float, box.xyxy[0])
-                
-                # Convert to YOLO format
-                x_center = ((x1 + x2) / 2) / width
-                y_center = ((y1 + y2) / 2) / height
-                w = (x2 - x1) / width
-                h = (y2 - y1) / height
-                
-                cls = int(box.cls[0])
-                cls_name = class_names[cls]
-                
-                # Write to label file
-                f.write(f"{cls} {x_center:.6f} {y_center:.6f} {w:.6f} {h:.6f}\n")
-                
-                # Draw on the labeled image copy
-                cv2.rectangle(labeled_img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-                label = f"{cls_name}: {float(box.conf[0]):.2f}"
-                cv2.putText(labeled_img, label, (int(x1), int(y1)-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                
-                # Draw only bounding box without class name on bbox_only_img
-                cv2.rectangle(bbox_only_img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-    # Save both original and labeled images
-    cv2.imwrite(orig_img_path, img)  
-    cv2.imwrite(bbox_only_path, bbox_only_img)
-    print(f"Saved original image, labeled image, and label file for: {base_name}")
+    detections = detect(img)
+    write_outputs(image_path, img, detections, output_dir, output_label_dir)
+    metrics.count('pages')
+    metrics.count('crops', len(detections))
+    print(f"Saved original image, labeled image, and label file for: {os.path.splitext(os.path.basename(image_path))[0]}")
 
-def main():
-    # Define input and output directories
-    input_dir = r"E:/WORK/project/OCR/Recognition_OCR/data/a"
-    output_dir = r"E:/WORK/project/OCR/Recognition_OCR/make_label/output/a"
-    output_label_dir = r"E:/WORK/project/OCR/Recognition_OCR/make_label/output_label/a"
-    
-    # Create output directory if it doesn't exist
+def label_directory(input_dir, output_dir, output_label_dir, batch_size=8, writers=4, force=False):
+    """
+    Gán nhãn tăng dần: chỉ chạy mô hình cho ảnh mới, ảnh đã đổi nội dung, hoặc ảnh được gán bởi
+    mô hình khác (theo manifest). Detection chạy theo batch, ghi nhãn/ảnh chạy trong writer pool
+    song song với batch tiếp theo. force=True gán nhãn lại tất cả.
+    Trả về {'labeled', 'skipped', 'failed'}.
+    """
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(output_label_dir, exist_ok=True)
+    names = sorted(name for name in os.listdir(input_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+    version = model_version()
+    manifest = OCRJournal(os.path.join(output_dir, MANIFEST_NAME), resume=not force)
 
-    # Process all images in directory
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            input_path = os.path.join(input_dir, filename)
-            process_image(input_path, output_dir, output_label_dir)  # Added output_label_dir parameter
-            print(f"Processing: {filename}")
-        else:
-            continue
+    digests = {}
+    pending = []
+    for name in names:
+        digests[name] = file_digest(os.path.join(input_dir, name))
+        label_path = os.path.join(output_dir, f"{os.path.splitext(name)[0]}.txt")
+        if not (manifest.is_done(name, digests[name], model=version) and os.path.exists(label_path)):
+            pending.append(name)
+    stats = {'labeled': 0, 'skipped': len(names) - len(pending), 'failed': 0}
+    print(f"Mô hình {version}: {stats['skipped']} ảnh không đổi, cần gán nhãn {len(pending)}/{len(names)} ảnh")
+
+    def finish(name, future):
+        try:
+            future.result()
+            manifest.record(name, digests[name], 'done', model=version)
+            stats['labeled'] += 1
+            print(f"Saved original image, labeled image, and label file for: {os.path.splitext(name)[0]}")
+        except Exception as e:
+            manifest.record(name, digests[name], 'failed', error=str(e), model=version)
+            stats['failed'] += 1
+            metrics.count('errors')
+            print(f"Error writing labels for {name}: {str(e)}")
+
+    # Giới hạn số ảnh đang chờ ghi để bộ nhớ không tăng theo số ảnh
+    in_flight = collections.deque()
+    max_in_flight = max(batch_size, 2 * writers)
+    with manifest, concurrent.futures.ThreadPoolExecutor(max_workers=max(1, writers)) as pool:
+        for start in range(0, len(pending), batch_size):
+            batch, imgs = [], []
+            for name in pending[start:start + batch_size]:
+                with metrics.span('decode'):
+                    img = cv2.imread(os.path.join(input_dir, name))
+                if img is None:
+                    print(f"Error loading image: {name}")
+                    manifest.record(name, digests[name], 'failed', error="không đọc được ảnh", model=version)
+                    stats['failed'] += 1
+                    metrics.count('errors')
+                    continue
+                batch.append(name)
+                imgs.append(img)
+            if not batch:
+                continue
+
+            print(f"Processing: {', '.join(batch)}")
+            for name, img, detections in zip(batch, imgs, detect_batch(imgs)):
+                metrics.count('pages')
+                metrics.count('crops', len(detections))
+                in_flight.append((name, pool.submit(write_outputs, os.path.join(input_dir, name), img, detections,
+                                                    output_dir, output_label_dir)))
+            del imgs
+            while len(in_flight) > max_in_flight:
+                finish(*in_flight.popleft())
+
+        while in_flight:
+            finish(*in_flight.popleft())
+        # Bỏ dòng cũ và ảnh đã xóa khỏi input_dir
+        manifest.compact(names)
+    return stats
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tự gán nhãn YOLO (txt + ảnh có box) cho thư mục ảnh trang")
+    parser.add_argument('--input-dir', default=r"E:/WORK/project/OCR/Recognition_OCR/data/a")
+    parser.add_argument('--output-dir', default=r"E:/WORK/project/OCR/Recognition_OCR/make_label/output/a")
+    parser.add_argument('--output-label-dir',
+                        default=r"E:/WORK/project/OCR/Recognition_OCR/make_label/output_label/a")
+    parser.add_argument('--model', default=model_path)
+    parser.add_argument('--server', default=detection_server, help="URL detection server thay vì tải mô hình")
+    parser.add_argument('--batch-size', type=int, default=8, help="Số ảnh mỗi lần chạy mô hình")
+    parser.add_argument('--writers', type=int, default=4, help="Số thread ghi file nhãn + ảnh")
+    parser.add_argument('--force', action='store_true', help="Gán nhãn lại mọi ảnh, bỏ qua manifest")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    global model_path, detection_server
+    args = parse_args()
+    model_path, detection_server = args.model, args.server
+    metrics.enable_from_args(args)
+
+    stats = label_directory(args.input_dir, args.output_dir, args.output_label_dir,
+                            batch_size=max(1, args.batch_size), writers=args.writers, force=args.force)
+    print(f"Đã gán nhãn {stats['labeled']} ảnh, bỏ qua {stats['skipped']} ảnh không đổi, {stats['failed']} lỗi")
+
+    metrics.finish(args, 'label_cnn')
 
 if __name__ == "__main__":
     main()
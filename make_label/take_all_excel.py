@@ -1,82 +1,139 @@
+import argparse
+import hashlib
 import os
-from openpyxl import load_workbook, Workbook
+import posixpath
+import sys
+import tempfile
 from pathlib import Path
 
-def merge_excel_files(input_dir: str, output_file: str):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from xlsx_reader import XlsxReader
+
+BASE_DIR = r"E:\WORK\project\OCR\Recognition_OCR\make_label"
+ROW_HEIGHT = 100  # Fixed height for consistency
+# Cột mặc định của file do make_label_RNN.py tạo, dùng khi không tìm thấy tiêu đề
+SOURCE_COLUMNS = {'Image': 'A', 'Extracted Text': 'B', 'Crop ID': 'C'}
+
+def read_source_rows(input_path, spool_dir, spool_prefix):
+    """
+    Đọc một file nguồn ở dạng stream (XlsxReader, không dựng workbook): mỗi dòng dữ liệu trả về
+    (text, crop_id, đường dẫn ảnh, hash ảnh). Ảnh được ghép với dòng theo anchor nên dòng không có
+    ảnh không làm lệch các dòng sau; bytes ảnh được ghi ra spool_dir thay vì giữ trong bộ nhớ.
+    """
+    rows = []
+    with XlsxReader(input_path) as reader:
+        images = reader.image_anchors()
+        sheet_rows = reader.rows()
+        header_row, header = next(sheet_rows, (1, {}))
+        columns = dict(SOURCE_COLUMNS)
+        columns.update({str(value).strip(): column for column, value in header.items()
+                        if str(value).strip() in SOURCE_COLUMNS})
+
+        for row_number, values in sheet_rows:
+            part = images.get((row_number, columns['Image']))
+            if not values and part is None:
+                continue
+            image_path = image_hash = None
+            if part is not None:
+                data = reader.read(part)
+                image_hash = hashlib.sha256(data).hexdigest()
+                image_path = os.path.join(spool_dir, f"{spool_prefix}_{row_number}{posixpath.splitext(part)[1]}")
+                with open(image_path, 'wb') as f:
+                    f.write(data)
+            rows.append((values.get(columns['Extracted Text']), values.get(columns['Crop ID']), image_path, image_hash))
+    return rows
+
+def merge_excel_files(input_dir: str, output_file: str, dedupe: bool = False):
+    """
+    Gộp các file Excel của make_label_RNN.py (Image | Extracted Text | Crop ID) thành một sheet
+    STT | Image | Extracted Text | Crop ID. File nguồn được đọc stream, file đích ghi ở chế độ
+    write-only nên bộ nhớ không tăng theo số file. dedupe=True bỏ các dòng có ảnh trùng
+    (cùng Crop ID, hoặc cùng hash ảnh nếu không có Crop ID), giữ dòng đầu tiên.
+    """
+    from openpyxl import Workbook
+    from openpyxl.drawing.image import Image as XLImage
+
     print(f"Reading Excel files from: {input_dir}")
-    
+
     # Create new workbook
-    merged_wb = Workbook()
-    merged_sheet = merged_wb.active
-    merged_sheet.title = "Merged Results"
-    
-    # Set headers
-    merged_sheet['A1'] = "STT"
-    merged_sheet['B1'] = "Image"
-    merged_sheet['C1'] = "Extracted Text"
-    
-    # Set column widths
+    merged_wb = Workbook(write_only=True)
+    merged_sheet = merged_wb.create_sheet("Merged Results")
+
+    # Set column widths (write-only: phải đặt trước khi ghi dòng)
     merged_sheet.column_dimensions['A'].width = 10
     merged_sheet.column_dimensions['B'].width = 30
     merged_sheet.column_dimensions['C'].width = 50
-    
+    merged_sheet.column_dimensions['D'].width = 20
+
+    # Set headers
+    merged_sheet.append(["STT", "Image", "Extracted Text", "Crop ID"])
+
     current_row = 2  # Start from row 2 (after header)
-    
+    seen = set()
+    stats = {'files': 0, 'rows': 0, 'images': 0, 'duplicates': 0}
+
     # Get and sort Excel files
-    excel_files = [f for f in os.listdir(input_dir) if f.endswith('.xlsx')]
+    excel_files = [f for f in os.listdir(input_dir) if f.endswith('.xlsx') and not f.startswith('~$')]
     excel_files.sort(key=lambda x: int(Path(x).stem) if Path(x).stem.isdigit() else float('inf'))
-    
+
     print(f"Found {len(excel_files)} Excel files")
-    
-    for excel_file in excel_files:
-        input_path = os.path.join(input_dir, excel_file)
-        print(f"Processing: {excel_file}")
-        
-        try:
-            wb = load_workbook(input_path)
-            sheet = wb.active
-            
-            # Copy data from each row (skip header)
-            for row_idx in range(2, sheet.max_row + 1):
-                # Add sequence number
-                merged_sheet[f'A{current_row}'] = current_row - 1
-                
-                # Copy images safely
-                try:
-                    if sheet._images:
-                        img_index = row_idx - 2  # Adjust index for images
-                        if img_index < len(sheet._images):
-                            img = sheet._images[img_index]
-                            # Calculate new anchor position
-                            img.anchor._from.row = current_row - 1
-                            img.anchor._from.col = 1  # Column B
-                            merged_sheet.add_image(img)
-                except Exception as img_err:
-                    print(f"Warning: Could not copy image in row {row_idx}: {str(img_err)}")
-                
-                # Copy text
-                text_value = sheet[f'B{row_idx}'].value
-                merged_sheet[f'C{current_row}'] = text_value
-                
+
+    # Ảnh nằm trên đĩa tới khi lưu: openpyxl chỉ đọc lại bytes lúc ghi file đích
+    with tempfile.TemporaryDirectory(prefix="merge_images_") as spool_dir:
+        for file_index, excel_file in enumerate(excel_files):
+            input_path = os.path.join(input_dir, excel_file)
+            print(f"Processing: {excel_file}")
+
+            try:
+                rows = read_source_rows(input_path, spool_dir, file_index)
+            except Exception as e:
+                print(f"Error processing {excel_file}: {str(e)}")
+                continue
+            stats['files'] += 1
+
+            for text_value, crop_id, image_path, image_hash in rows:
+                key = crop_id or image_hash
+                if dedupe and key is not None:
+                    if key in seen:
+                        stats['duplicates'] += 1
+                        if image_path:
+                            os.remove(image_path)
+                        continue
+                    seen.add(key)
+
                 # Set row height
-                merged_sheet.row_dimensions[current_row].height = 100  # Fixed height for consistency
-                
+                merged_sheet.row_dimensions[current_row].height = ROW_HEIGHT
+                if image_path:
+                    img = XLImage(image_path)
+                    # Thu ảnh về chiều cao dòng, giữ tỉ lệ như make_label_RNN.py
+                    if img.height:
+                        img.width = int(img.width * ROW_HEIGHT / img.height)
+                        img.height = ROW_HEIGHT
+                    merged_sheet.add_image(img, f'B{current_row}')  # Column B
+                    stats['images'] += 1
+
+                # Crop ID trỏ tới ảnh gốc trong thư mục crops/ (xem make_label_RNN.py)
+                merged_sheet.append([current_row - 1, None, text_value, crop_id])
+                stats['rows'] += 1
                 current_row += 1
-                
-        except Exception as e:
-            print(f"Error processing {excel_file}: {str(e)}")
-            continue
-    
-    print(f"Saving merged file to: {output_file}")
-    merged_wb.save(output_file)
-    print("Merge completed successfully!")
+
+        print(f"Saving merged file to: {output_file}")
+        merged_wb.save(output_file)
+
+    print(f"Merge completed successfully! {stats['rows']} rows, {stats['images']} images"
+          + (f", {stats['duplicates']} duplicates skipped" if dedupe else ""))
+    return stats
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Gộp các file Excel của make_label_RNN thành một file")
+    parser.add_argument('--input-dir', default=os.path.join(BASE_DIR, "output_excel_RNN"))
+    parser.add_argument('--output-file', default=os.path.join(BASE_DIR, "merged_results.xlsx"))
+    parser.add_argument('--dedupe', action='store_true', help="Bỏ dòng có ảnh trùng (theo Crop ID / hash ảnh)")
+    return parser.parse_args()
 
 def main():
-    base_dir = r"E:\WORK\project\OCR\Recognition_OCR\make_label"
-    input_dir = os.path.join(base_dir, "output_excel_RNN")
-    output_file = os.path.join(base_dir, "merged_results.xlsx")
-    
-    merge_excel_files(input_dir, output_file)
+    args = parse_args()
+    merge_excel_files(args.input_dir, args.output_file, dedupe=args.dedupe)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,250 +1,497 @@
-from ultralytics import YOLO
 import cv2
 import time
-import torch
 import os
+import glob
 import json
+import argparse
 import concurrent.futures
 from pathlib import Path
 import logging
 
-# Đường dẫn đến mô hình và hình ảnh
+import instrumentation as metrics
+import reading_order
+import tiling
+from detection_client import DetectionClient
+from detector_backends import BACKENDS, prepare_model
+
+# Đường dẫn mặc định đến mô hình và hình ảnh
 model_path = r"E:\WORK\project\OCR\Recognition_OCR\model\best_yolo12n_v2_5_6_314img.pt"
 image_path = r"E:\WORK\project\OCR\Recognition_OCR\data\test\19.png"
 output_dir = r"E:\WORK\project\OCR\Recognition_OCR\data_results\imgs"
 result_dir = r"E:\WORK\project\OCR\Recognition_OCR\data_results\result_images"
 
-# Tạo thư mục kết quả và thư mục cho result images
-for dir_path in [output_dir, result_dir]:
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tiff', '.bmp')
+
+
+def load_model(model_path, num_threads=6):
+    """Tải mô hình YOLO một lần và chuyển sang CPU"""
+    # Import tại đây để client dùng detection server không phải trả giá khởi động torch/ultralytics
+    import torch
+    from ultralytics import YOLO
 
-# Tối ưu hóa cho CPU - sử dụng tất cả các luồng có sẵn
-torch.set_num_threads(6)  # Sử dụng tất cả 8 luồng của CPU i5-8265U
+    # Tối ưu hóa cho CPU - mặc định 6 luồng cho CPU i5-8265U
+    torch.set_num_threads(num_threads)
 
-# Tải mô hình
-print(f"Đang tải mô hình từ {model_path}...")
-try:
-    model = YOLO(model_path)
+    print(f"Đang tải mô hình từ {model_path}...")
+    with metrics.span('load'):
+        if str(model_path).endswith('.pt'):
+            model = YOLO(model_path)
+            model.to('cpu')
+        else:
+            # Mô hình đã export (.onnx hoặc thư mục OpenVINO, xem detector_backends.py), chạy trên CPU
+            model = YOLO(model_path, task='detect')
     print("Đã tải mô hình thành công!")
-except Exception as e:
-    print(f"Lỗi khi tải mô hình: {e}")
-    exit(1)
+    return model
 
-# Chuyển mô hình sang CPU
-model.to('cpu')
 
-# Đọc hình ảnh
-print(f"Đang đọc hình ảnh từ {image_path}...")
-try:
-    img = cv2.imread(image_path)
+def collect_image_paths(input_path):
+    """Trả về danh sách ảnh (đã sắp xếp) từ một file, một thư mục hoặc một glob pattern"""
+    if os.path.isdir(input_path):
+        paths = [os.path.join(input_path, f) for f in os.listdir(input_path)]
+    elif os.path.isfile(input_path):
+        return [input_path]
+    else:
+        paths = glob.glob(input_path)
+    return sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def read_image(path):
+    """Đọc ảnh, trả về None nếu không đọc được"""
+    with metrics.span('decode'):
+        img = cv2.imread(path)
     if img is None:
-        print(f"Không thể đọc hình ảnh từ {image_path}")
-        exit(1)
-    print(f"Đã đọc hình ảnh thành công! Kích thước: {img.shape}")
-except Exception as e:
-    print(f"Lỗi khi đọc hình ảnh: {e}")
-    exit(1)
-
-# Thực hiện dự đoán
-print("Đang xử lý hình ảnh...")
-start_time = time.time()
-
-# Thực hiện dự đoán với ngưỡng tin cậy 0.25 (có thể điều chỉnh)
-results = model(img, conf=0.3, iou=0.45, device='cpu')
-if results is None or len(results) == 0:
-    print("Không phát hiện được đối tượng nào trong hình ảnh.")
-    exit(1)
-
-end_time = time.time()
-processing_time = (end_time - start_time) * 1000  
-
-# Vẽ và lưu ảnh với bounding boxes
-result_img = results[0].plot()  # Ảnh với labels và boxes
-result_img_boxes_only = img.copy()  # Tạo bản copy cho ảnh chỉ có boxes
-
-# Vẽ chỉ boxes không có labels
-boxes = results[0].boxes
-for box in boxes:
-    x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-    cv2.rectangle(result_img_boxes_only, (x1, y1), (x2, y2), (0, 255, 0), 2)
-
-# Lưu cả 2 loại ảnh
-cv2.imwrite(os.path.join(result_dir, "result_with_labels.png"), result_img)
-cv2.imwrite(os.path.join(result_dir, "result_boxes_only.png"), result_img_boxes_only)
-
-boxes = results[0].boxes
-detected_objects = []
+        metrics.count('errors')
+        print(f"Không thể đọc hình ảnh từ {path}")
+    return img
+
+
+def _read_batch(paths):
+    return [(path, read_image(path)) for path in paths]
+
+
+def result_to_detections(result, names):
+    """Chuyển kết quả YOLO của một ảnh sang danh sách dict thuần Python"""
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return []
+
+    xyxy = boxes.xyxy.cpu().numpy()
+    classes = boxes.cls.cpu().numpy().astype(int)
+    confidences = boxes.conf.cpu().numpy()
+
+    detections = []
+    for box, class_id, confidence in zip(xyxy, classes, confidences):
+        x1, y1, x2, y2 = map(int, box.tolist())
+        detections.append({
+            'class_id': int(class_id),
+            'class_name': names[int(class_id)],
+            'confidence': float(confidence),
+            'coords': (x1, y1, x2, y2)
+        })
+    return detections
+
+
+def detect_batch(model, images, conf=0.3, iou=0.45, imgsz=None):
+    """
+    Chạy YOLO trên một mini-batch ảnh, trả về danh sách detection cho từng ảnh.
+    model có thể là DetectionClient: khi đó ảnh được gửi sang detection server đang chạy sẵn.
+    imgsz: kích thước đầu vào mô hình (None = mặc định của mô hình).
+    """
+    if isinstance(model, DetectionClient):
+        with metrics.span('infer', images=len(images), remote=True):
+            return model.detect_batch(images, conf=conf, iou=iou, imgsz=imgsz)
+    kwargs = {'imgsz': imgsz} if imgsz else {}
+    with metrics.span('infer', images=len(images)):
+        results = model(images, conf=conf, iou=iou, device='cpu', verbose=False, **kwargs)
+    if metrics.is_enabled():
+        # NMS nằm trong bước postprocess của ultralytics, lấy thời gian nó tự đo (ms mỗi ảnh)
+        for result in results:
+            metrics.observe('nms', result.speed.get('postprocess', 0.0) / 1000)
+    return [result_to_detections(result, model.names) for result in results]
+
+
+def detect_tiled(model, images, tile_size=640, overlap=128, conf=0.3, iou=0.45, batch_size=8,
+                 merge='nms', merge_threshold=0.5):
+    """
+    Detection theo tile cho scan độ phân giải cao: mỗi trang được cắt thành các tile chồng nhau,
+    chạy YOLO ở đúng kích thước tile (không thu nhỏ cả trang nên ô chữ nhỏ không bị mất),
+    tile của mọi trang được gom thành mini-batch, rồi box trùng ở đường nối tile được gộp lại.
+    Trả về danh sách detection trên toàn trang như detect_batch.
+    """
+    grids, tiles = tiling.page_tiles(images, tile_size, overlap)
+    tile_detections = []
+    for start in range(0, len(tiles), max(1, batch_size)):
+        tile_detections.extend(detect_batch(model, tiles[start:start + batch_size], conf=conf, iou=iou,
+                                            imgsz=tile_size))
+
+    page_detections = []
+    offset = 0
+    for img, grid in zip(images, grids):
+        height, width = img.shape[:2]
+        with metrics.span('nms', tiles=len(grid)):
+            page_detections.append(tiling.merge_tile_detections(
+                tile_detections[offset:offset + len(grid)], grid, width, height,
+                method=merge, threshold=merge_threshold))
+        offset += len(grid)
+    return page_detections
+
 
 # Hàm kiểm tra tính hợp lệ của bounding box
 def validate_box(box, img_shape):
     x1, y1, x2, y2 = box
     height, width = img_shape[:2]
-    
+
     # Kiểm tra tọa độ có hợp lệ không
     if x1 >= x2 or y1 >= y2:
         return False
-    
+
     # Kiểm tra box có nằm trong ảnh không
     if x1 < 0 or y1 < 0 or x2 > width or y2 > height:
         return False
-    
+
     # Kiểm tra kích thước tối thiểu
     if (x2 - x1) < 5 or (y2 - y1) < 5:
         return False
-        
+
     return True
 
-# Tạo danh sách các đối tượng với thông tin vị trí
-for i, box in enumerate(boxes):
-    class_id = int(box.cls[0].item())
-    class_name = model.names[class_id]
-    confidence = box.conf[0].item()
-    x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-    
-    # Kiểm tra tính hợp lệ của box
-    if not validate_box((x1, y1, x2, y2), img.shape):
-        print(f"Bỏ qua box không hợp lệ: {(x1, y1, x2, y2)}")
-        continue
-    
-    # Thêm vào danh sách với tọa độ center để sắp xếp
-    center_y = (y1 + y2) // 2
-    center_x = (x1 + x2) // 2
-    detected_objects.append({
-        'index': i,
-        'class_name': class_name,
-        'confidence': confidence,
-        'coords': (x1, y1, x2, y2),
-        'center_y': center_y,
-        'center_x': center_x
-    })
-
-# Sắp xếp đối tượng theo dòng (row-first)
-# Định nghĩa ngưỡng y để xác định cùng dòng
-y_threshold = 30  # Có thể điều chỉnh giá trị này
-
-# Sắp xếp theo y trước
-detected_objects.sort(key=lambda x: x['center_y'])
-
-# Gom nhóm các đối tượng cùng dòng và sắp xếp từ trái sang phải
-current_y = detected_objects[0]['center_y']
-current_line = []
-final_sorted_objects = []
-
-for obj in detected_objects:
-    if abs(obj['center_y'] - current_y) <= y_threshold:
-        current_line.append(obj)
-    else:
-        # Sắp xếp đối tượng trong dòng hiện tại từ trái sang phải
-        current_line.sort(key=lambda x: x['center_x'])
-        final_sorted_objects.extend(current_line)
-        current_line = [obj]
-        current_y = obj['center_y']
-
-# Xử lý dòng cuối cùng
-if current_line:
-    current_line.sort(key=lambda x: x['center_x'])
-    final_sorted_objects.extend(current_line)
-
-# In kết quả và lưu ảnh theo thứ tự mới
-print(f"\nKết quả phân tích OCR (đã sắp xếp theo thứ tự đọc):")
-print(f"- Thời gian xử lý: {processing_time:.2f}ms")
-print(f"- Số đối tượng phát hiện được: {len(final_sorted_objects)}")
-
-if len(final_sorted_objects) > 0:
-    print("\nChi tiết các đối tượng:")
-    for i, obj in enumerate(final_sorted_objects):
+
+def build_objects(detections, img_shape):
+    """Lọc box không hợp lệ và thêm tọa độ center để sắp xếp"""
+    detected_objects = []
+    for i, det in enumerate(detections):
+        x1, y1, x2, y2 = det['coords']
+
+        # Kiểm tra tính hợp lệ của box
+        if not validate_box((x1, y1, x2, y2), img_shape):
+            print(f"Bỏ qua box không hợp lệ: {(x1, y1, x2, y2)}")
+            continue
+
+        detected_objects.append({
+            'index': i,
+            'class_name': det['class_name'],
+            'confidence': det['confidence'],
+            'coords': (x1, y1, x2, y2),
+            'center_y': (y1 + y2) // 2,
+            'center_x': (x1 + x2) // 2
+        })
+    return detected_objects
+
+
+def sort_reading_order(detected_objects, columns=False, deskew=False):
+    """Sắp xếp đối tượng theo thứ tự đọc (xem reading_order.reading_order)"""
+    return reading_order.sort_objects(detected_objects, columns=columns, deskew=deskew)
+
+
+def crop_filename(index, class_name):
+    """Tên file crop theo số thứ tự (bắt đầu từ 1) và tên lớp"""
+    return f"crop_{index:03d}_{class_name}.png"
+
+
+def build_processed_results(sorted_objects):
+    """Chuẩn bị nội dung processed_results.json từ danh sách đã sắp xếp"""
+    processed_results = []
+    for i, obj in enumerate(sorted_objects):
         x1, y1, x2, y2 = obj['coords']
-        
-        # Cắt vùng ảnh từ ảnh gốc
-        cropped_img = img[y1:y2, x1:x2]
-        
-        # Lưu ảnh đã cắt
-        crop_filename = os.path.join(output_dir, f"crop_{i+1:03d}_{obj['class_name']}.png")
-        cv2.imwrite(crop_filename, cropped_img)
-        
-        print(f"  {i+1}. {obj['class_name']}: {obj['confidence']*100:.1f}% - Vị trí: [{x1}, {y1}, {x2}, {y2}]")
-        print(f"     Đã lưu ảnh cắt tại: {crop_filename}")
-
-# Lưu thông tin các đối tượng đã sắp xếp vào file JSON
-processed_results = []
-for i, obj in enumerate(final_sorted_objects):
-    x1, y1, x2, y2 = obj['coords']
-    
-    processed_results.append({
-        'index': i + 1,  # Đánh số từ 1
-        'class_name': obj['class_name'],
-        'confidence': float(obj['confidence']),  # Chuyển đổi numpy float sang Python float
-        'coords': [int(x1), int(y1), int(x2), int(y2)],  # Chuyển đổi sang list để có thể serialize
-        'center_y': int(obj['center_y']),
-        'center_x': int(obj['center_x'])
-    })
-
-# Lưu kết quả vào file JSON
-json_output_path = os.path.join(output_dir, "processed_results.json")
-try:
-    with open(json_output_path, 'w', encoding='utf-8') as f:
-        json.dump(processed_results, f, ensure_ascii=False, indent=2)
-    print(f"\nĐã lưu thông tin đối tượng vào: {json_output_path}")
-except Exception as e:
-    print(f"Lỗi khi lưu file JSON: {str(e)}")
-
-print("\nQuá trình xử lý hoàn tất!")
+        processed_results.append({
+            'index': i + 1,  # Đánh số từ 1
+            'filename': crop_filename(i + 1, obj['class_name']),
+            'class_name': obj['class_name'],
+            'confidence': float(obj['confidence']),  # Chuyển đổi numpy float sang Python float
+            'coords': [int(x1), int(y1), int(x2), int(y2)],  # Chuyển đổi sang list để có thể serialize
+            'center_y': int(obj['center_y']),
+            'center_x': int(obj['center_x'])
+        })
+    return processed_results
+
+
+def draw_detections(img, detections, with_labels=True):
+    """Vẽ bounding boxes (và nhãn nếu cần) lên bản copy của ảnh"""
+    drawn = img.copy()
+    for det in detections:
+        x1, y1, x2, y2 = det['coords']
+        cv2.rectangle(drawn, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        if with_labels:
+            label = f"{det['class_name']}: {det['confidence']:.2f}"
+            cv2.putText(drawn, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    return drawn
+
+
+def encode_crop(cropped_img, ext='.png'):
+    """Mã hóa ảnh crop một lần duy nhất vào bộ nhớ"""
+    with metrics.span('encode'):
+        ok, buffer = cv2.imencode(ext, cropped_img)
+    if not ok:
+        raise ValueError("Không thể mã hóa ảnh crop")
+    return buffer.tobytes()
+
+
+def crop_objects(img, sorted_objects):
+    """
+    Tạo danh sách crop trong bộ nhớ theo thứ tự đọc.
+    'image' là view NumPy trên ảnh gốc (không copy), 'content' là PNG đã mã hóa sẵn
+    để gửi thẳng sang OCRProcessor.process_crops mà không cần ghi ra đĩa.
+    """
+    crops = []
+    with metrics.span('crop', objects=len(sorted_objects)):
+        for i, obj in enumerate(sorted_objects):
+            x1, y1, x2, y2 = obj['coords']
+            cropped_img = img[y1:y2, x1:x2]
+            crops.append({
+                'index': i + 1,
+                'name': crop_filename(i + 1, obj['class_name']),
+                'class_name': obj['class_name'],
+                'confidence': float(obj['confidence']),
+                'coords': [int(x1), int(y1), int(x2), int(y2)],
+                'center_y': int(obj['center_y']),
+                'center_x': int(obj['center_x']),
+                'image': cropped_img,
+                'content': encode_crop(cropped_img)
+            })
+    metrics.count('crops', len(crops))
+    return crops
+
+
+def write_crops(crops, crop_dir):
+    """Ghi các crop đã mã hóa ra đĩa (không mã hóa lại), dùng cho debug hoặc OCR chạy riêng"""
+    os.makedirs(crop_dir, exist_ok=True)
+    crop_files = []
+    for crop in crops:
+        crop_filename = os.path.join(crop_dir, crop['name'])
+        with open(crop_filename, 'wb') as f:
+            f.write(crop['content'])
+        crop_files.append(crop_filename)
+    return crop_files
+
+
+def page_dirs(path, output_dir, result_dir, per_page_dirs=True):
+    """Thư mục output/result của một trang: mỗi trang một thư mục con theo tên file nếu per_page_dirs"""
+    if not per_page_dirs:
+        return output_dir, result_dir
+    page_name = Path(path).stem
+    return os.path.join(output_dir, page_name), os.path.join(result_dir, page_name)
+
+
+def save_page_outputs(img, detections, sorted_objects, page_output_dir, page_result_dir,
+                      save_crops=True, processor=None, crops=None, ocr_results=None):
+    """
+    Lưu ảnh kết quả và processed_results.json của một trang.
+    Nếu có processor, các crop được OCR trực tiếp từ bộ nhớ; ghi crop ra đĩa là tùy chọn.
+    crops: danh sách crop đã mã hóa sẵn (vd: từ worker process), None = tạo từ sorted_objects.
+    ocr_results: kết quả OCR đã có sẵn (vd: từ stage recognize của pipeline_runner), None = OCR tại đây.
+    """
+    os.makedirs(page_output_dir, exist_ok=True)
+    os.makedirs(page_result_dir, exist_ok=True)
+
+    # Lưu ảnh với labels + boxes và ảnh chỉ có boxes
+    with metrics.span('write', kind='result_images'):
+        cv2.imwrite(os.path.join(page_result_dir, "result_with_labels.png"), draw_detections(img, detections))
+        cv2.imwrite(os.path.join(page_result_dir, "result_boxes_only.png"),
+                    draw_detections(img, detections, with_labels=False))
+
+    if crops is None:
+        crops = crop_objects(img, sorted_objects)
+    with metrics.span('write', kind='crops'):
+        if save_crops:
+            write_crops(crops, page_output_dir)
+
+        json_output_path = os.path.join(page_output_dir, "processed_results.json")
+        with open(json_output_path, 'w', encoding='utf-8') as f:
+            json.dump(build_processed_results(sorted_objects), f, ensure_ascii=False, indent=2)
+    metrics.count('pages')
+
+    if processor is not None:
+        if ocr_results is None:
+            ocr_results = processor.process_crops(crops)
+        crop_images = {crop['name']: crop['content'] for crop in crops}
+        processor._save_results(ocr_results, Path(page_output_dir), Path(page_output_dir),
+                                crop_images=crop_images)
+    return crops
+
+
+def detect_and_recognize(model, img, processor, conf=0.3, iou=0.45, debug_crop_dir=None):
+    """
+    API đầu-cuối cho một ảnh: detection -> sắp xếp -> crop trong bộ nhớ -> OCR.
+    Crop chỉ được ghi ra đĩa khi truyền debug_crop_dir.
+    """
+    detections = detect_batch(model, [img], conf=conf, iou=iou)[0]
+    crops = crop_objects(img, sort_reading_order(build_objects(detections, img.shape)))
+    if debug_crop_dir:
+        write_crops(crops, debug_crop_dir)
+    return processor.process_crops(crops)
+
+
+def process_pages(model, image_paths, output_dir, result_dir, batch_size=4, conf=0.3, iou=0.45,
+                  per_page_dirs=True, max_writers=4, save_crops=True, processor=None, columns=False,
+                  tile_size=None, tile_overlap=128, tile_merge='nms'):
+    """
+    Chạy detection cho nhiều trang với mô hình đã tải sẵn.
+    Ảnh được đọc trước (prefetch) và đưa qua YOLO theo mini-batch, việc ghi kết quả
+    được đẩy sang thread pool để không chặn vòng lặp suy luận.
+    tile_size: nếu có, detection theo tile (xem detect_tiled) thay vì resize cả trang.
+    """
+    batch_size = max(1, batch_size)
+    batches = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+    stats = {'pages': 0, 'failed': 0, 'objects': 0, 'detect_time': 0.0, 'total_time': 0.0}
+    if not batches:
+        return stats
+
+    start_time = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as reader, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max_writers) as writer:
+        pending = reader.submit(_read_batch, batches[0])
+        write_futures = {}
+
+        for batch_idx in range(len(batches)):
+            loaded = pending.result()
+            if batch_idx + 1 < len(batches):
+                # Đọc batch tiếp theo trong khi mô hình đang xử lý batch hiện tại
+                pending = reader.submit(_read_batch, batches[batch_idx + 1])
+
+            valid = [(path, img) for path, img in loaded if img is not None]
+            stats['failed'] += len(loaded) - len(valid)
+            if not valid:
+                continue
+
+            detect_start = time.perf_counter()
+            images = [img for _, img in valid]
+            if tile_size:
+                batch_detections = detect_tiled(model, images, tile_size=tile_size, overlap=tile_overlap,
+                                                conf=conf, iou=iou, merge=tile_merge)
+            else:
+                batch_detections = detect_batch(model, images, conf=conf, iou=iou)
+            stats['detect_time'] += time.perf_counter() - detect_start
+
+            for (path, img), detections in zip(valid, batch_detections):
+                sorted_objects = sort_reading_order(build_objects(detections, img.shape), columns=columns)
+                page_output_dir, page_result_dir = page_dirs(path, output_dir, result_dir, per_page_dirs)
+
+                future = writer.submit(save_page_outputs, img, detections, sorted_objects,
+                                       page_output_dir, page_result_dir,
+                                       save_crops=save_crops, processor=processor)
+                write_futures[future] = path
+                stats['pages'] += 1
+                stats['objects'] += len(sorted_objects)
+
+            done = stats['pages'] + stats['failed']
+            print(f"\rĐã xử lý: {done}/{len(image_paths)} trang", end="", flush=True)
+
+        for future in concurrent.futures.as_completed(write_futures):
+            try:
+                future.result()
+            except Exception as e:
+                stats['failed'] += 1
+                logging.error(f"Lỗi khi lưu kết quả cho {write_futures[future]}: {str(e)}")
+
+    stats['total_time'] = time.perf_counter() - start_time
+    return stats
+
+
+def print_throughput(stats):
+    pages = stats['pages']
+    print(f"\n\nKết quả xử lý:")
+    print(f"- Số trang: {pages} (lỗi: {stats['failed']})")
+    print(f"- Số đối tượng phát hiện được: {stats['objects']}")
+    if pages and stats['detect_time'] > 0:
+        print(f"- Thời gian detection: {stats['detect_time']:.2f}s "
+              f"({pages / stats['detect_time']:.2f} trang/giây)")
+    if pages and stats['total_time'] > 0:
+        print(f"- Tổng thời gian: {stats['total_time']:.2f}s "
+              f"({pages / stats['total_time']:.2f} trang/giây)")
+
 
 # Thêm hàm validation paths
-def validate_paths():
-    paths = {
-        'model': Path(model_path),
-        'image': Path(image_path),
-        'output': Path(output_dir)
-    }
-    
-    for name, path in paths.items():
-        if name in ['model', 'image']:
-            if not path.exists():
-                raise FileNotFoundError(f"{name} path không tồn tại: {path}")
-        if name == 'output':
-            path.mkdir(parents=True, exist_ok=True)
-
-# Hàm xử lý và lưu ảnh đã cắt
-def process_and_save_crop(args):
-    i, obj, img, total = args
-    x1, y1, x2, y2 = obj['coords']
-    cropped_img = img[y1:y2, x1:x2]
-    crop_filename = os.path.join(output_dir, f"crop_{i+1:03d}_{obj['class_name']}.png")
-    cv2.imwrite(crop_filename, cropped_img)
-    
-    # Hiển thị tiến trình xử lý
-    progress = ((i + 1) / total) * 100
-    print(f"\rXử lý ảnh crop: {progress:.1f}% ({i + 1}/{total})", end="", flush=True)
-    
-    return crop_filename
+def validate_paths(model_path, image_paths, output_dir):
+    if model_path is not None and not Path(model_path).exists():
+        raise FileNotFoundError(f"model path không tồn tại: {model_path}")
+    if not image_paths:
+        raise FileNotFoundError("Không tìm thấy ảnh đầu vào")
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Phát hiện vùng chữ viết tay bằng YOLO")
+    parser.add_argument('input', nargs='?', default=image_path,
+                        help="Ảnh, thư mục hoặc glob pattern (vd: 'data/test/*.png')")
+    parser.add_argument('--model', default=model_path)
+    parser.add_argument('--output-dir', default=output_dir)
+    parser.add_argument('--result-dir', default=result_dir)
+    parser.add_argument('--batch-size', type=int, default=4, help="Số trang mỗi lần chạy YOLO")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help="Backend suy luận trên CPU")
+    parser.add_argument('--int8', action='store_true', help="Dùng mô hình lượng tử hóa INT8 (onnx/openvino)")
+    parser.add_argument('--calibration', help="Thư mục ảnh scan để calibrate INT8 khi chưa có bản lượng tử hóa")
+    parser.add_argument('--threads', type=int,
+                        help="Số luồng torch mỗi process (mặc định 6, hoặc số core / số worker khi --workers > 1)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Số process detection, mỗi process một mô hình (0 = tự chọn theo số core)")
+    parser.add_argument('--conf', type=float, default=0.3)
+    parser.add_argument('--iou', type=float, default=0.45)
+    parser.add_argument('--server', help="URL detection server (vd: http://127.0.0.1:8765) thay vì tải mô hình")
+    parser.add_argument('--columns', action='store_true', help="Trang nhiều cột: đọc hết từng cột")
+    parser.add_argument('--tile-size', type=int,
+                        help="Detection theo tile kích thước này (px) cho scan lớn, vd: 640")
+    parser.add_argument('--tile-overlap', type=int, default=128,
+                        help="Phần chồng giữa các tile (px), nên lớn hơn ô chữ lớn nhất")
+    parser.add_argument('--tile-merge', choices=tiling.MERGE_METHODS, default='nms',
+                        help="Cách gộp box trùng ở đường nối tile")
+    parser.add_argument('--credentials', help="File credentials Google Vision; nếu có sẽ OCR crop trực tiếp từ bộ nhớ")
+    parser.add_argument('--save-crops', action='store_true',
+                        help="Vẫn ghi ảnh crop ra đĩa khi OCR trực tiếp (debug)")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
 
 def main():
+    args = parse_args()
+    metrics.enable_from_args(args)
     try:
-        validate_paths()
-        
-        total_objects = len(final_sorted_objects)
-        print(f"\nBắt đầu xử lý {total_objects} đối tượng...")
-        
-        # Thêm total vào tham số
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            crop_tasks = [(i, obj, img, total_objects) for i, obj in enumerate(final_sorted_objects)]
-            results = list(executor.map(process_and_save_crop, crop_tasks))
-        
-        print("\nHoàn thành cắt và lưu ảnh!")
-        print(f"\nKết quả xử lý:")
-        print(f"- Ảnh với nhãn và boxes: {os.path.join(result_dir, 'result_with_labels.png')}")
-        print(f"- Ảnh chỉ có boxes: {os.path.join(result_dir, 'result_boxes_only.png')}")
-        
-        for i, filename in enumerate(results):
-            obj = final_sorted_objects[i]
-            print(f"  {i+1}. {obj['class_name']}: {obj['confidence']*100:.1f}%")
-            
+        image_paths = collect_image_paths(args.input)
+        validate_paths(None if args.server else args.model, image_paths, args.output_dir)
+
+        model = model_file = None
+        if args.server:
+            model = DetectionClient(args.server)
+        else:
+            model_file = prepare_model(args.model, args.backend, int8=args.int8, calibration_dir=args.calibration)
+            if args.workers == 1:
+                model = load_model(model_file, num_threads=args.threads or 6)
+
+        processor = None
+        if args.credentials:
+            from OCR_img_ggvision import OCRProcessor
+            processor = OCRProcessor(args.credentials)
+
+        # Một ảnh đơn giữ nguyên cấu trúc thư mục cũ, nhiều ảnh thì mỗi trang một thư mục con
+        per_page_dirs = not os.path.isfile(args.input)
+        save_crops = processor is None or args.save_crops
+        if model is None:
+            # Nhiều process detection, trang và crop trao đổi qua shared memory
+            from page_pool import process_pages_parallel
+            print(f"Bắt đầu xử lý {len(image_paths)} trang...")
+            stats = process_pages_parallel(model_file, image_paths, args.output_dir, args.result_dir,
+                                           workers=args.workers or None, threads_per_worker=args.threads,
+                                           conf=args.conf, iou=args.iou, per_page_dirs=per_page_dirs,
+                                           save_crops=save_crops, processor=processor, columns=args.columns,
+                                           tile_size=args.tile_size, tile_overlap=args.tile_overlap,
+                                           tile_merge=args.tile_merge)
+        else:
+            print(f"Bắt đầu xử lý {len(image_paths)} trang (batch size: {args.batch_size})...")
+            stats = process_pages(model, image_paths, args.output_dir, args.result_dir,
+                                  batch_size=args.batch_size, conf=args.conf, iou=args.iou,
+                                  per_page_dirs=per_page_dirs, save_crops=save_crops, processor=processor,
+                                  columns=args.columns, tile_size=args.tile_size,
+                                  tile_overlap=args.tile_overlap, tile_merge=args.tile_merge)
+        if args.server:
+            model.close()
+        print_throughput(stats)
+        metrics.finish(args, 'detect')
+        print("\nQuá trình xử lý hoàn tất!")
+
     except Exception as e:
         logging.error(f"Lỗi: {str(e)}")
         raise
 
+
 if __name__ == "__main__":
     main()
 
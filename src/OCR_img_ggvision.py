@@ -1,23 +1,63 @@
-from google.cloud import vision
-from google.oauth2 import service_account
 import os
 from datetime import datetime
 import json
-import pandas as pd
-from openpyxl import Workbook
-from openpyxl.drawing.image import Image as XLImage
 from PIL import Image
 import io
-import concurrent.futures
 from pathlib import Path
 import logging
-from typing import List, Dict
+import argparse
+from typing import List, Dict, Optional
+from ocr_cache import OCRCache
+from recognition_engine import RecognitionEngine, RetryableError, RETRYABLE_STATUS_CODES
+import crop_mosaic
+import instrumentation as metrics
+from excel_report import write_ocr_report
+from results_store import ResultsWriter, convert_results, merge_results, read_results, results_path
+from ocr_journal import JOURNAL_NAME, JournaledSink, OCRJournal, file_digest
+from lazy_import import lazy_module
+
+# google-cloud-vision mất gần nửa giây để import: chỉ nạp khi thực sự gọi tới (không nạp khi --help)
+vision = lazy_module("google.cloud.vision")
+service_account = lazy_module("google.oauth2.service_account")
+
+MANIFEST_NAME = "processed_results.json"
+LANGUAGE_HINTS = ["vi", "vi-VN"]
+# Giới hạn số ảnh trong một request batch_annotate_images của Vision API
+MAX_BATCH_IMAGES = 16
+
+def load_crop_manifest(manifest_dir) -> Dict[int, Dict]:
+    """Đọc processed_results.json một lần, trả về dict {index: thông tin crop}"""
+    json_path = os.path.join(manifest_dir, MANIFEST_NAME)
+    if not os.path.exists(json_path):
+        return {}
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return {crop['index']: crop for crop in json.load(f)}
+
+def find_crop_info(image_name: str, manifest: Dict[int, Dict],
+                   by_filename: Optional[Dict[str, Dict]] = None) -> Optional[Dict]:
+    """Tìm thông tin crop theo tên file (manifest mới) hoặc theo số thứ tự trong tên crop_XXX_className.png"""
+    if by_filename and image_name in by_filename:
+        return by_filename[image_name]
+    if not image_name.startswith('crop_'):
+        return None
+    try:
+        return manifest.get(int(image_name.split('_')[1]))
+    except (IndexError, ValueError) as e:
+        print(f"Warning: Could not parse crop info from filename: {e}")
+        return None
 
 class OCRProcessor:
-    def __init__(self, credentials_path):
-        self._validate_paths(credentials_path)
-        self.credentials = self._load_credentials(credentials_path)
-        self.client = vision.ImageAnnotatorClient(credentials=self.credentials)
+    def __init__(self, credentials_path=None, cache: Optional[OCRCache] = None, client=None,
+                 engine: Optional[RecognitionEngine] = None):
+        # client có thể truyền vào trực tiếp (vd: fake_vision.FakeVisionClient khi không có mạng)
+        if client is None:
+            self._validate_paths(credentials_path)
+            self.credentials = self._load_credentials(credentials_path)
+            client = vision.ImageAnnotatorClient(credentials=self.credentials)
+        self.client = client
+        self.cache = cache
+        # Engine điều phối request: số request đồng thời, QPS, retry/backoff, deadline
+        self.engine = engine or RecognitionEngine()
 
     def _validate_paths(self, credentials_path: str) -> None:
         cred_path = Path(credentials_path)
@@ -34,177 +74,414 @@ class OCRProcessor:
         except Exception as e:
             raise Exception(f"Lỗi khi đọc credentials: {str(e)}")
 
-    def process_single_image(self, image_path):
-        """Process single image and return result"""
+    def _recognize(self, content: bytes):
+        """Gọi Google Vision text_detection cho một ảnh đã mã hóa, dùng cache nếu có"""
+        cache_key = None
+        if self.cache is not None:
+            cache_key = OCRCache.make_key(content, LANGUAGE_HINTS)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return vision.AnnotateImageResponse.deserialize(cached)
+
+        image = vision.Image(content=content)
+        metrics.count('api_calls')
+        with metrics.span('rpc'):
+            response = self.client.text_detection(
+                image=image,
+                image_context={"language_hints": LANGUAGE_HINTS},
+                **self.engine.call_options()
+            )
+
+        # Chỉ cache response thành công
+        if cache_key is not None and not response.error.message:
+            self.cache.put(cache_key, vision.AnnotateImageResponse.serialize(response))
+        return response
+
+    def _recognize_batch(self, contents: List[bytes]) -> List:
+        """
+        OCR nhiều ảnh bằng một RPC batch_annotate_images (tối đa MAX_BATCH_IMAGES ảnh).
+        Response trả về đúng thứ tự đầu vào; ảnh đã có trong cache không được gửi lại.
+        """
+        if len(contents) > MAX_BATCH_IMAGES:
+            raise ValueError(f"Tối đa {MAX_BATCH_IMAGES} ảnh cho một batch, nhận {len(contents)}")
+
+        responses = [None] * len(contents)
+        cache_keys = [None] * len(contents)
+        if self.cache is not None:
+            for i, content in enumerate(contents):
+                cache_keys[i] = OCRCache.make_key(content, LANGUAGE_HINTS)
+                cached = self.cache.get(cache_keys[i])
+                if cached is not None:
+                    responses[i] = vision.AnnotateImageResponse.deserialize(cached)
+
+        pending = [i for i, response in enumerate(responses) if response is None]
+        if pending:
+            feature = vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)
+            image_context = vision.ImageContext(language_hints=LANGUAGE_HINTS)
+            requests = [
+                vision.AnnotateImageRequest(image=vision.Image(content=contents[i]),
+                                            features=[feature], image_context=image_context)
+                for i in pending
+            ]
+            metrics.count('api_calls')
+            with metrics.span('rpc', images=len(requests)):
+                batch_response = self.client.batch_annotate_images(requests=requests, **self.engine.call_options())
+            for i, response in zip(pending, batch_response.responses):
+                responses[i] = response
+                if cache_keys[i] is not None and not response.error.message:
+                    self.cache.put(cache_keys[i], vision.AnnotateImageResponse.serialize(response))
+        return responses
+
+    def _build_result(self, image_name, width, height, crop_info, response):
+        """Chuyển response của Vision thành dict kết quả, đổi tọa độ về ảnh gốc nếu có crop_info"""
+        result = {
+            "image_name": image_name,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "image_size": {"width": width, "height": height},
+            "original_crop_coords": list(crop_info['coords']) if crop_info else None,
+            "full_text": "",
+            "text_blocks": []
+        }
+
+        if response.error.message:
+            print(f"Warning - API error: {response.error.message}")
+            return result
+
+        if response.text_annotations:
+            result["full_text"] = response.text_annotations[0].description
+            for text in response.text_annotations[1:]:
+                # Lấy 4 đỉnh của bounding box
+                vertices = [(vertex.x, vertex.y) for vertex in text.bounding_poly.vertices]
+
+                # Tính điểm trung tâm của box
+                center_x = sum(v[0] for v in vertices) / 4
+                center_y = sum(v[1] for v in vertices) / 4
+
+                # Thêm thông tin tọa độ gốc nếu có
+                if crop_info:
+                    original_x1, original_y1, _, _ = crop_info['coords']
+                    # Điều chỉnh tọa độ tương đối về tọa độ tuyệt đối
+                    adjusted_vertices = [
+                        (x + original_x1, y + original_y1) for x, y in vertices
+                    ]
+                    adjusted_center = {
+                        "x": center_x + original_x1,
+                        "y": center_y + original_y1
+                    }
+                else:
+                    adjusted_vertices = vertices
+                    adjusted_center = {"x": center_x, "y": center_y}
+
+                result["text_blocks"].append({
+                    "text": text.description,
+                    "position": {
+                        "vertices": adjusted_vertices,
+                        "center": adjusted_center,
+                        "relative_vertices": vertices  # Giữ lại tọa độ tương đối
+                    }
+                })
+
+        return result
+
+    def process_single_image(self, image_path, crop_info=None, manifest=None):
+        """
+        Process single image and return result.
+        crop_info/manifest được truyền từ manifest đã nạp sẵn (process_directory); nếu gọi
+        riêng lẻ thì tự đọc processed_results.json cạnh ảnh.
+        """
         try:
-            # Phân tích tên file để lấy thông tin crop
             image_name = os.path.basename(image_path)
-            crop_info = None
-            if image_name.startswith('crop_'):
+            if crop_info is None and manifest is None and image_name.startswith('crop_'):
                 try:
-                    # Giả sử tên file có format: crop_XXX_className.png
-                    crop_number = int(image_name.split('_')[1])
-                    # Đọc file JSON chứa thông tin crop gốc
-                    json_path = os.path.join(os.path.dirname(image_path), "processed_results.json")
-                    if os.path.exists(json_path):
-                        with open(json_path, 'r', encoding='utf-8') as f:
-                            all_crops = json.load(f)
-                            # Tìm thông tin crop tương ứng
-                            crop_info = next((crop for crop in all_crops if crop['index'] == crop_number), None)
+                    manifest = load_crop_manifest(os.path.dirname(image_path))
+                    crop_info = find_crop_info(image_name, manifest)
                 except Exception as e:
-                    print(f"Warning: Could not parse crop info from filename: {e}")
+                    print(f"Warning: Could not load crop manifest: {e}")
 
             with open(image_path, 'rb') as image_file:
                 content = image_file.read()
-            
-            image = vision.Image(content=content)
-            response = self.client.text_detection(
-                image=image,
-                image_context={"language_hints": ["vi", "vi-VN"]}
-            )
 
-            # Lấy kích thước ảnh
-            img = Image.open(image_path)
-            width, height = img.size
-
-            # Chuẩn bị kết quả với thông tin crop
-            result = {
-                "image_name": image_name,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "image_size": {"width": width, "height": height},
-                "original_crop_coords": crop_info['coords'] if crop_info else None,
-                "full_text": "",
-                "text_blocks": []
-            }
-
-            if response.error.message:
-                print(f"Warning - API error: {response.error.message}")
-                return result
-
-            if response.text_annotations:
-                result["full_text"] = response.text_annotations[0].description
-                for text in response.text_annotations[1:]:
-                    # Lấy 4 đỉnh của bounding box
-                    vertices = [(vertex.x, vertex.y) for vertex in text.bounding_poly.vertices]
-                    
-                    # Tính điểm trung tâm của box
-                    center_x = sum(v[0] for v in vertices) / 4
-                    center_y = sum(v[1] for v in vertices) / 4
-                    
-                    # Thêm thông tin tọa độ gốc nếu có
-                    if crop_info:
-                        original_x1, original_y1, _, _ = crop_info['coords']
-                        # Điều chỉnh tọa độ tương đối về tọa độ tuyệt đối
-                        adjusted_vertices = [
-                            (x + original_x1, y + original_y1) for x, y in vertices
-                        ]
-                        adjusted_center = {
-                            "x": center_x + original_x1,
-                            "y": center_y + original_y1
-                        }
-                    else:
-                        adjusted_vertices = vertices
-                        adjusted_center = {"x": center_x, "y": center_y}
-                    
-                    result["text_blocks"].append({
-                        "text": text.description,
-                        "position": {
-                            "vertices": adjusted_vertices,
-                            "center": adjusted_center,
-                            "relative_vertices": vertices  # Giữ lại tọa độ tương đối
-                        }
-                    })
+            response = self._recognize(content)
 
-            return result
+            # Lấy kích thước ảnh từ header (không đọc lại file)
+            width, height = Image.open(io.BytesIO(content)).size
+
+            return self._build_result(image_name, width, height, crop_info, response)
 
         except Exception as e:
             print(f"Error processing {os.path.basename(image_path)}: {str(e)}")
             return None
 
-    def create_excel_report(self, results, output_excel_path, images_dir):
+    def process_crop(self, crop: Dict):
+        """
+        OCR một crop trong bộ nhớ (do CNN_img_to_text.crop_objects tạo ra).
+        Dùng trực tiếp PNG đã mã hóa trong crop['content'] và kích thước từ view NumPy.
+        """
         try:
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "OCR Results"
-
-            headers = ["Image", "Image Name", "Text Content", "Coordinates"]
-            for col, header in enumerate(headers, 1):
-                ws.cell(row=1, column=col, value=header)
-
-            for idx, result in enumerate(results, 2):
-                image_path = os.path.join(images_dir, result["image_name"])
-                
-                # Xử lý hình ảnh - với nhiều lần thử
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        if os.path.exists(image_path):
-                            img = Image.open(image_path)
-                            img = img.convert('RGB')
-                            
-                            # Resize với tỷ lệ cố định
-                            target_size = (75, 75)
-                            img = img.resize(target_size, Image.Resampling.LANCZOS)
-                            
-                            img_byte_arr = io.BytesIO()
-                            img.save(img_byte_arr, format='PNG', optimize=True)
-                            img_byte_arr.seek(0)
-                            
-                            xl_image = XLImage(img_byte_arr)
-                            xl_image.width = 75
-                            xl_image.height = 75
-                            
-                            ws.row_dimensions[idx].height = 60
-                            cell = ws.cell(row=idx, column=1)
-                            ws.add_image(xl_image, cell.coordinate)
-                            break
-                    except Exception as e:
-                        if attempt == max_retries - 1:
-                            print(f"Failed to add image after {max_retries} attempts: {result['image_name']}")
-                        continue
-
-                # Add text data
-                ws.cell(row=idx, column=2, value=result["image_name"])
-                ws.cell(row=idx, column=3, value=result.get("full_text", ""))
-
-                # Format coordinates
-                if result["text_blocks"]:
-                    block = result["text_blocks"][0]
-                    vertices = block["position"]["vertices"]
-                    center = block["position"]["center"]
-                    coordinates = (
-                        f"Top-left: ({vertices[0][0]}, {vertices[0][1]})\n"
-                        f"Top-right: ({vertices[1][0]}, {vertices[1][1]})\n"
-                        f"Bottom-right: ({vertices[2][0]}, {vertices[2][1]})\n"
-                        f"Bottom-left: ({vertices[3][0]}, {vertices[3][1]})\n"
-                        f"Center: ({center['x']:.1f}, {center['y']:.1f})"
-                    )
-                else:
-                    # Nếu không có text, lấy tọa độ từ kích thước ảnh
-                    w = result["image_size"]["width"]
-                    h = result["image_size"]["height"]
-                    coordinates = (
-                        f"Top-left: (0, 0)\n"
-                        f"Top-right: ({w}, 0)\n"
-                        f"Bottom-right: ({w}, {h})\n"
-                        f"Bottom-left: (0, {h})\n"
-                        f"Center: ({w/2:.1f}, {h/2:.1f})"
-                    )
-                ws.cell(row=idx, column=4, value=coordinates)
-
-            # Adjust column widths
-            ws.column_dimensions['A'].width = 12
-            ws.column_dimensions['B'].width = 20
-            ws.column_dimensions['C'].width = 40
-            ws.column_dimensions['D'].width = 35
-
-            wb.save(output_excel_path)
+            height, width = crop['image'].shape[:2]
+            response = self._recognize(crop['content'])
+            return self._build_result(crop['name'], width, height, crop, response)
+        except Exception as e:
+            print(f"Error processing {crop.get('name')}: {str(e)}")
+            return None
+
+    def process_crops(self, crops: List[Dict], max_workers: Optional[int] = None,
+                      batch_size: Optional[int] = None, pack: bool = False) -> List[Dict]:
+        """OCR danh sách crop trong bộ nhớ, kết quả giữ nguyên thứ tự đọc"""
+        items = [{
+            'name': crop['name'],
+            'content': crop['content'],
+            'image': crop['image'],
+            'size': (crop['image'].shape[1], crop['image'].shape[0]),
+            'crop_info': crop
+        } for crop in crops]
+        if pack:
+            results, _ = self.process_packed(items, max_workers=max_workers)
+        elif batch_size:
+            results, _ = self.process_batched(items, batch_size=batch_size, max_workers=max_workers)
+        else:
+            results, _ = self.process_items(items, max_workers=max_workers)
+        return results
+
+    @staticmethod
+    def _load_item(item: Dict) -> None:
+        """Đọc nội dung ảnh của item (nếu item chỉ có 'path') và kích thước từ header"""
+        if 'content' not in item:
+            with open(item['path'], 'rb') as image_file:
+                item['content'] = image_file.read()
+            item['size'] = Image.open(io.BytesIO(item['content'])).size
+
+    @staticmethod
+    def _raise_for_error(response) -> None:
+        """Lỗi của từng ảnh: lỗi tạm thời được engine thử lại, lỗi khác ghi vào danh sách lỗi"""
+        if response.error.message:
+            if response.error.code in RETRYABLE_STATUS_CODES:
+                raise RetryableError(response.error.message)
+            raise ValueError(response.error.message)
+
+    def _process_item(self, item: Dict) -> Dict:
+        """OCR một item, ném lỗi để RecognitionEngine quyết định có thử lại hay không"""
+        self._load_item(item)
+        response = self._recognize(item['content'])
+        self._raise_for_error(response)
+        width, height = item['size']
+        result = self._build_result(item['name'], width, height, item['crop_info'], response)
+        if 'path' in item:
+            # Không giữ bytes ảnh trong bộ nhớ sau khi đã có kết quả
+            item.pop('content', None)
+        return result
+
+    @staticmethod
+    def _needs_retry(response) -> bool:
+        """Ảnh chưa có response (RPC lỗi) hoặc response lỗi tạm thời"""
+        return response is None or (bool(response.error.message) and response.error.code in RETRYABLE_STATUS_CODES)
+
+    def _run_batch(self, batch: Dict):
+        """
+        Chạy một batch {'items', 'responses'}, trả về (results, errors) theo thứ tự của batch.
+        Response thành công (hoặc lỗi không thử lại được) được giữ trong batch['responses'], nên khi
+        engine thử lại chỉ các ảnh lỗi tạm thời được gửi lại trong RPC sau.
+        """
+        items, responses = batch['items'], batch['responses']
+        pending = [i for i, response in enumerate(responses) if self._needs_retry(response)]
+        for i in pending:
+            self._load_item(items[i])
+        # Lỗi ở mức RPC được ném ra để engine thử lại các ảnh còn thiếu
+        for i, response in zip(pending, self._recognize_batch([items[i]['content'] for i in pending])):
+            responses[i] = response
+        retryable = [responses[i].error.message for i in pending if self._needs_retry(responses[i])]
+        if retryable:
+            raise RetryableError(retryable[0])
+        return self._split_batch(batch)
+
+    def _split_batch(self, batch: Dict, outcome: Optional[Dict] = None):
+        """
+        (results, errors) của batch từ các response đã có. outcome: kết quả thất bại của engine sau khi
+        hết số lần thử, dùng cho ảnh vẫn chưa có response thành công.
+        """
+        results, errors = [], []
+        for item, response in zip(batch['items'], batch['responses']):
+            if response is not None and not response.error.message:
+                width, height = item['size']
+                results.append(self._build_result(item['name'], width, height, item['crop_info'], response))
+                if 'path' in item:
+                    item.pop('content', None)
+            elif outcome is not None and self._needs_retry(response):
+                errors.append({'image_name': item['name'],
+                               'error': response.error.message if response is not None else outcome['error'],
+                               'attempts': outcome['attempts']})
+            else:
+                errors.append({'image_name': item['name'], 'error': response.error.message})
+        return results, errors
+
+    @staticmethod
+    def _print_progress(total: int, unit: str = "", sink: Optional[ResultsWriter] = None):
+        """on_complete cho engine: in tiến trình và ghi ngay kết quả thành công vào sink (nếu có)"""
+        def on_complete(done, outcome):
+            if sink is not None and outcome['ok']:
+                value = outcome['value']
+                # process_batched: value là (results, errors) của cả batch
+                sink.write_many(value[0] if isinstance(value, tuple) else [value])
+            print(f"\rProgress: {(done/total)*100:.1f}% ({done}/{total}{unit})", end="")
+        return on_complete
+
+    def process_items(self, items: List[Dict], max_workers: Optional[int] = None,
+                      sink: Optional[ResultsWriter] = None):
+        """
+        OCR từng ảnh một RPC qua RecognitionEngine (giới hạn QPS, retry, deadline).
+        Mỗi item là dict gồm 'name', 'crop_info' và 'content' + 'size' (hoặc 'path').
+        sink: ResultsWriter nhận từng kết quả ngay khi xong (theo thứ tự hoàn thành).
+        Trả về (results, errors); không item nào bị bỏ qua âm thầm.
+        """
+        outcomes = self.engine.run(self._process_item, items, max_in_flight=max_workers,
+                                   on_complete=self._print_progress(len(items), sink=sink))
+        results, errors = [], []
+        for item, outcome in zip(items, outcomes):
+            if outcome['ok']:
+                results.append(outcome['value'])
+            else:
+                errors.append({'image_name': item['name'], 'error': outcome['error'],
+                               'attempts': outcome['attempts']})
+
+        for error in errors:
+            logging.error(f"Error processing {error['image_name']}: {error['error']}")
+        return results, errors
+
+    def process_batched(self, items: List[Dict], batch_size: int = MAX_BATCH_IMAGES,
+                        max_workers: Optional[int] = None, sink: Optional[ResultsWriter] = None):
+        """
+        OCR theo batch: mỗi RPC batch_annotate_images chứa tối đa batch_size ảnh, engine chạy
+        đồng thời tối đa max_workers RPC. Item và sink giống process_items (sink nhận cả batch một lần).
+        Trả về (results, errors), results theo thứ tự items.
+        """
+        batch_size = max(1, min(batch_size, MAX_BATCH_IMAGES))
+        batches = [{'items': items[i:i + batch_size], 'responses': [None] * len(items[i:i + batch_size])}
+                   for i in range(0, len(items), batch_size)]
+        outcomes = self.engine.run(self._run_batch, batches, max_in_flight=max_workers,
+                                   on_complete=self._print_progress(len(batches), " batch", sink=sink))
+
+        all_results, all_errors = [], []
+        for batch, outcome in zip(batches, outcomes):
+            if outcome['ok']:
+                results, errors = outcome['value']
+            else:
+                # Hết số lần thử: ảnh đã thành công vẫn giữ kết quả, chỉ ảnh còn lỗi vào danh sách lỗi
+                results, errors = self._split_batch(batch, outcome)
+                if sink is not None:
+                    sink.write_many(results)
+            all_results.extend(results)
+            all_errors.extend(errors)
+            batch['responses'] = None
+
+        for error in all_errors:
+            logging.error(f"Error processing {error['image_name']}: {error['error']}")
+        return all_results, all_errors
+
+    def _recognize_canvas(self, content: bytes):
+        response = self._recognize(content)
+        self._raise_for_error(response)
+        return response
+
+    def process_packed(self, items: List[Dict], max_width: int = 2048, max_height: int = 2048,
+                       gutter: int = 32, max_workers: Optional[int] = None,
+                       sink: Optional[ResultsWriter] = None):
+        """
+        OCR nhiều crop nhỏ bằng ít RPC: xếp các crop lên canvas (crop_mosaic.pack_crops), chạy
+        text_detection một lần mỗi canvas rồi gán word box về crop nguồn theo hình học.
+        Kết quả mỗi crop có cùng schema với process_single_image. Crop quá lớn được OCR riêng.
+        Item giống process_items, có thêm 'image' (ảnh BGR) nếu đã có sẵn trong bộ nhớ.
+        sink nhận kết quả theo thứ tự items khi đã gán xong word box cho mọi crop.
+        Trả về (results, errors), results theo thứ tự items.
+        """
+        for item in items:
+            if 'image' not in item:
+                self._load_item(item)
+                item['image'] = crop_mosaic.decode_image(item['content'])
+
+        canvases, oversized = crop_mosaic.pack_crops([item['image'] for item in items], max_width=max_width,
+                                                     max_height=max_height, gutter=gutter)
+        contents = [crop_mosaic.encode_png(canvas['image']) for canvas in canvases]
+        outcomes = self.engine.run(self._recognize_canvas, contents, max_in_flight=max_workers,
+                                   on_complete=self._print_progress(len(contents), " canvas"))
+
+        results_by_index, errors = {}, []
+        for canvas, outcome in zip(canvases, outcomes):
+            if not outcome['ok']:
+                errors.extend({'image_name': items[p['crop_index']]['name'], 'error': outcome['error'],
+                               'attempts': outcome['attempts']} for p in canvas['placements'])
+                continue
+
+            annotations = outcome['value'].text_annotations
+            words = [(a.description, [(v.x, v.y) for v in a.bounding_poly.vertices]) for a in annotations[1:]]
+            for crop_index, crop_words in crop_mosaic.assign_words(words, canvas['placements']).items():
+                # Dựng lại response cho riêng crop để dùng chung _build_result
+                response = vision.AnnotateImageResponse()
+                if crop_words:
+                    response.text_annotations.append(
+                        vision.EntityAnnotation(description=crop_mosaic.words_to_text(crop_words)))
+                for text, vertices in crop_words:
+                    poly = vision.BoundingPoly(vertices=[vision.Vertex(x=x, y=y) for x, y in vertices])
+                    response.text_annotations.append(vision.EntityAnnotation(description=text, bounding_poly=poly))
+
+                item = items[crop_index]
+                height, width = item['image'].shape[:2]
+                results_by_index[crop_index] = self._build_result(item['name'], width, height,
+                                                                  item['crop_info'], response)
+
+        if oversized:
+            oversized_items = [items[i] for i in oversized]
+            for item in oversized_items:
+                if 'content' not in item:
+                    item['content'] = crop_mosaic.encode_png(item['image'])
+                    item['size'] = (item['image'].shape[1], item['image'].shape[0])
+            single_results, single_errors = self.process_items(oversized_items, max_workers=max_workers)
+            errors.extend(single_errors)
+            by_name = {result['image_name']: result for result in single_results}
+            for i in oversized:
+                if items[i]['name'] in by_name:
+                    results_by_index[i] = by_name[items[i]['name']]
+
+        for error in errors:
+            logging.error(f"Error processing {error['image_name']}: {error['error']}")
+        results = [results_by_index[i] for i in sorted(results_by_index)]
+        if sink is not None:
+            sink.write_many(results)
+        return results, errors
+
+    def create_excel_report(self, results, output_excel_path, images_dir, crop_images=None,
+                            thumbnail_dir=None, max_workers=4):
+        """
+        Ghi ocr_summary.xlsx ở chế độ write-only (xem excel_report.write_ocr_report).
+        Thumbnail được tạo song song và cache theo nội dung crop (mặc định <thư mục report>/.thumbnails).
+        """
+        try:
+            with metrics.span('write', kind='excel'):
+                write_ocr_report(results, output_excel_path, images_dir, crop_images=crop_images,
+                                 cache_dir=thumbnail_dir, max_workers=max_workers)
             print(f"Excel report created successfully: {output_excel_path}")
 
         except Exception as e:
             raise Exception(f"Error creating Excel report: {str(e)}")
 
-    def process_directory(self, input_dir: str, output_dir: str) -> int:
+    def process_directory(self, input_dir: str, output_dir: str, batch_size: Optional[int] = None,
+                          max_workers: Optional[int] = None, pack: bool = False,
+                          results_format: str = 'jsonl', chunk_size: int = 1024, resume: bool = False) -> int:
+        """
+        OCR toàn bộ crop_*.png trong input_dir.
+        batch_size=None: mỗi ảnh một RPC text_detection; batch_size=N: gom N ảnh mỗi RPC
+        batch_annotate_images. max_workers là số RPC chạy đồng thời (mặc định theo engine).
+        pack=True: ghép nhiều crop nhỏ vào một canvas cho mỗi RPC (xem process_packed).
+        Kết quả được ghi dần vào results.jsonl ngay khi xong; ảnh được xử lý theo từng nhóm chunk_size
+        nên bộ nhớ không tăng theo số ảnh. Trạng thái từng crop (pending/done/failed + sha256 nội dung)
+        được ghi vào ocr_journal.jsonl.
+        resume=True: chỉ OCR crop chưa xong, bị lỗi hoặc đã thay đổi nội dung so với lần chạy trước,
+        kết quả mới được gộp với kết quả cũ.
+        Cuối cùng results.jsonl được gộp lại theo thứ tự tên crop (results_format='parquet' thì chuyển
+        thêm sang results.parquet) và ocr_summary.xlsx được tạo lại từ đó, nên chạy lại bao nhiêu lần
+        cũng cho cùng một báo cáo. Ảnh lỗi sau khi đã thử lại được ghi vào ocr_errors.json.
+        Trả về số crop có kết quả.
+        """
+
         try:
             # Validate directories
             input_path = Path(input_dir)
@@ -220,64 +497,125 @@ class OCRProcessor:
             if not image_files:
                 raise ValueError(f"Không tìm thấy ảnh trong {input_dir}")
 
-            # Process images in parallel
-            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-                future_to_image = {
-                    executor.submit(self.process_single_image, str(img_path)): img_path
-                    for img_path in image_files
-                }
-                
-                all_results = []
-                total = len(future_to_image)
-                
-                for idx, future in enumerate(concurrent.futures.as_completed(future_to_image), 1):
-                    img_path = future_to_image[future]
-                    try:
-                        result = future.result()
-                        if result:
-                            all_results.append(result)
-                        print(f"\rProgress: {(idx/total)*100:.1f}% ({idx}/{total})", end="")
-                    except Exception as e:
-                        logging.error(f"Error processing {img_path}: {str(e)}")
-
-            # Save results
-            if all_results:
-                self._save_results(all_results, output_path, input_path)
+            # Nạp manifest một lần, dùng chung cho tất cả các luồng
+            manifest = load_crop_manifest(input_dir)
+            by_filename = {crop['filename']: crop for crop in manifest.values() if crop.get('filename')}
+
+            items = [{
+                'name': img_path.name,
+                'path': str(img_path),
+                'crop_info': find_crop_info(img_path.name, manifest, by_filename)
+            } for img_path in sorted(image_files)]
+
+            names = [item['name'] for item in items]
+            digests = {item['name']: file_digest(item['path']) for item in items}
+            store_path = results_path(str(output_path), 'jsonl')
+            errors = []
+            with OCRJournal(str(output_path / JOURNAL_NAME), resume=resume) as journal:
+                # Gộp trước để bỏ dòng ghi dở của lần chạy bị dừng rồi mới ghi nối tiếp
+                stored = set(merge_results(store_path)) if resume and os.path.exists(store_path) else set()
+                pending = [item for item in items
+                           if not (item['name'] in stored and journal.is_done(item['name'], digests[item['name']]))]
+                if resume:
+                    print(f"Resume: {len(items) - len(pending)} crop đã xong, còn {len(pending)} crop")
+                for item in pending:
+                    journal.record(item['name'], digests[item['name']], 'pending')
+
+                with ResultsWriter(store_path, append=resume) as writer:
+                    sink = JournaledSink(writer, journal, digests)
+                    for start in range(0, len(pending), chunk_size):
+                        chunk = pending[start:start + chunk_size]
+                        if pack:
+                            _, chunk_errors = self.process_packed(chunk, max_workers=max_workers, sink=sink)
+                        elif batch_size:
+                            _, chunk_errors = self.process_batched(chunk, batch_size=batch_size,
+                                                                   max_workers=max_workers, sink=sink)
+                        else:
+                            _, chunk_errors = self.process_items(chunk, max_workers=max_workers, sink=sink)
+                        journal.record_errors(chunk_errors, digests)
+                        errors.extend(chunk_errors)
+
+                processed = len(merge_results(store_path, order=names))
+                journal.compact(names)
+
+            errors_path = output_path / "ocr_errors.json"
+            if errors:
+                with open(errors_path, 'w', encoding='utf-8') as f:
+                    json.dump(errors, f, ensure_ascii=False, indent=2)
+            elif errors_path.exists():
+                errors_path.unlink()  # lỗi của lần chạy trước đã được xử lý lại thành công
+
+            if results_format == 'parquet':
+                convert_results(store_path, results_path(str(output_path), 'parquet'))
+
+            # Excel report đọc lại từ file kết quả
+            if processed:
+                self.create_excel_report(read_results(store_path), str(output_path / "ocr_summary.xlsx"),
+                                         str(input_path))
             
-            return len(all_results)
+            return processed
 
         except Exception as e:
             logging.error(f"Error in process_directory: {str(e)}")
             raise
 
-    def _save_results(self, results: List[Dict], output_path: Path, input_path: Path) -> None:
-        """Save results to JSON and Excel"""
-        # Save JSON
-        json_path = output_path / "json_results.json"
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+    def _save_results(self, results: List[Dict], output_path: Path, input_path: Path,
+                      crop_images: Dict[str, bytes] = None, results_format: str = 'jsonl') -> None:
+        """Save results to results.jsonl/.parquet and Excel (crop_images: ảnh crop trong bộ nhớ theo image_name)"""
+        with ResultsWriter(results_path(str(output_path), results_format)) as sink:
+            sink.write_many(results)
 
         # Create Excel report
         excel_path = output_path / "ocr_summary.xlsx"
-        self.create_excel_report(results, str(excel_path), str(input_path))
+        self.create_excel_report(results, str(excel_path), str(input_path), crop_images=crop_images)
+
+BASE_DIR = r"E:\WORK\project\OCR\Recognition_OCR\data_results"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="OCR các crop_*.png trong một thư mục bằng Google Vision")
+    parser.add_argument('--input-dir', default=os.path.join(BASE_DIR, "imgs"))
+    parser.add_argument('--output-dir', default=os.path.join(BASE_DIR, "ocr_output"))
+    parser.add_argument('--credentials', default=os.path.join(BASE_DIR, "credentials.json"))
+    parser.add_argument('--cache', default=os.path.join(BASE_DIR, "ocr_cache.sqlite"))
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_IMAGES,
+                        help="Số ảnh mỗi RPC batch_annotate_images (0 = mỗi ảnh một RPC)")
+    parser.add_argument('--pack', action='store_true', help="Ghép nhiều crop nhỏ vào một canvas mỗi RPC")
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl',
+                        help="Định dạng file kết quả (parquet cần pyarrow)")
+    parser.add_argument('--resume', action='store_true',
+                        help="Tiếp tục lần chạy trước: chỉ OCR crop chưa xong, bị lỗi hoặc đã thay đổi")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    metrics.enable_from_args(args)
     try:
-        base_dir = r"E:\WORK\project\OCR\Recognition_OCR\data_results"
-        credentials_path = os.path.join(base_dir, "credentials.json")
-        input_dir = os.path.join(base_dir, "imgs")
-        output_dir = os.path.join(base_dir, "ocr_output")
+        credentials_path = args.credentials
+        input_dir = args.input_dir
+        output_dir = args.output_dir
+
+        cache_path = args.cache
 
         print("=== BẮT ĐẦU QUÁ TRÌNH OCR ===")
         start_time = datetime.now()
 
-        processor = OCRProcessor(credentials_path)
-        processed_count = processor.process_directory(input_dir, output_dir)
+        cache = OCRCache(cache_path)
+        engine = RecognitionEngine(max_in_flight=4, qps=10)
+        processor = OCRProcessor(credentials_path, cache=cache, engine=engine)
+        processed_count = processor.process_directory(input_dir, output_dir, batch_size=args.batch_size or None,
+                                                      pack=args.pack, results_format=args.format,
+                                                      resume=args.resume)
 
         duration = (datetime.now() - start_time).total_seconds()
+        stats = cache.stats()
         print(f"\nĐã xử lý {processed_count} ảnh")
         print(f"Thời gian: {duration:.2f} giây")
+        print(f"Cache: {stats['hits']} hit / {stats['misses']} miss ({stats['hit_rate']*100:.1f}%)")
+        print(f"API: {engine.counters['calls']} lần gọi, {engine.counters['retries']} lần thử lại, "
+              f"{engine.counters['failures']} lỗi")
         print(f"Kết quả được lưu tại: {output_dir}")
+        metrics.finish(args, 'ocr')
 
     except Exception as e:
         print(f"\nLỗi: {str(e)}")
@@ -0,0 +1,64 @@
+"""
+Điểm vào chung cho các script của repo:
+
+    python src/cli.py detect ảnh/ --batch-size 4
+    python src/cli.py ocr --resume
+    python src/cli.py render results/ pages/ rendered/
+    python src/cli.py <lệnh> --help
+
+Mỗi lệnh chỉ import module của nó khi được gọi (torch/ultralytics, google-cloud-vision, openpyxl...),
+nên `cli.py --help` và lỗi sai tham số trả về ngay.
+"""
+import argparse
+import importlib
+import os
+import sys
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+MAKE_LABEL_DIR = os.path.join(SRC_DIR, "..", "make_label")
+
+# lệnh -> (thư mục, module có main(), mô tả)
+COMMANDS = {
+    'detect': (SRC_DIR, "CNN_img_to_text", "Detection YOLO + cắt ô chữ theo thứ tự đọc (+ OCR)"),
+    'ocr': (SRC_DIR, "OCR_img_ggvision", "OCR thư mục ảnh crop bằng Google Vision, có --resume"),
+    'render': (SRC_DIR, "overlay_renderer", "Vẽ box + text OCR lên ảnh trang"),
+    'pipeline': (SRC_DIR, "pipeline_runner", "Chạy pipeline decode -> detect -> crop -> OCR theo stage"),
+    'serve': (SRC_DIR, "detection_server", "Detection server giữ mô hình trong bộ nhớ"),
+    'export': (SRC_DIR, "detector_backends", "Xuất mô hình sang ONNX/OpenVINO và so sánh backend"),
+    'label': (MAKE_LABEL_DIR, "make_lable_CNN", "Tự gán nhãn YOLO cho thư mục ảnh trang"),
+    'label-text': (MAKE_LABEL_DIR, "make_label_RNN", "Detection + OCR một trang ra Excel để gán nhãn text"),
+    'merge': (MAKE_LABEL_DIR, "take_all_excel", "Gộp các file Excel gán nhãn text thành một file"),
+    'prepare': (MAKE_LABEL_DIR, "convert_excel_2_text", "Tạo images/ + labels.txt huấn luyện từ file Excel đã gán nhãn"),
+    'pack': (SRC_DIR, "packed_dataset", "Đóng gói images/ + labels.txt thành shard có index cho huấn luyện"),
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="cli.py", description="Các công cụ nhận dạng chữ viết tay tiếng Việt",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Lệnh:\n" + "\n".join(f"  {name:<12} {description}"
+                                      for name, (_, _, description) in COMMANDS.items()))
+    parser.add_argument('command', choices=list(COMMANDS), metavar='lệnh', help="Một trong các lệnh bên dưới")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="Tham số của lệnh (xem: cli.py <lệnh> --help)")
+    return parser.parse_args(argv)
+
+
+def run(command, args):
+    """Import module của lệnh và gọi main() với sys.argv là tham số của lệnh"""
+    directory, module_name, _ = COMMANDS[command]
+    directory = os.path.abspath(directory)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    sys.argv = [f"{os.path.basename(sys.argv[0])} {command}", *args]
+    module = importlib.import_module(module_name)
+    return module.main()
+
+
+def main():
+    args = parse_args()
+    run(args.command, args.args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+from typing import Dict, List, Sequence, Tuple
+
+
+def _to_bgr(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
+
+
+def pack_crops(images: Sequence[np.ndarray], max_width: int = 2048, max_height: int = 2048,
+               gutter: int = 32, background: int = 255) -> Tuple[List[Dict], List[int]]:
+    """
+    Xếp nhiều crop nhỏ lên các canvas (shelf packing theo chiều cao giảm dần).
+    Giữa các crop có khoảng trắng `gutter` để Vision không nối chữ của hai crop với nhau.
+
+    Trả về (canvases, oversized):
+    - canvases: [{'image': canvas BGR, 'placements': [{'crop_index', 'x', 'y', 'w', 'h'}]}]
+    - oversized: chỉ số các crop quá lớn để xếp, cần OCR riêng
+    """
+    order = sorted(range(len(images)), key=lambda i: images[i].shape[0], reverse=True)
+    oversized = [i for i in order
+                 if images[i].shape[1] + 2 * gutter > max_width or images[i].shape[0] + 2 * gutter > max_height]
+    oversized_set = set(oversized)
+
+    layouts = []
+    placements, x, y, shelf_height, canvas_width = [], gutter, gutter, 0, 0
+    for i in order:
+        if i in oversized_set:
+            continue
+        h, w = images[i].shape[:2]
+        if x + w + gutter > max_width:
+            # Sang kệ mới
+            x, y, shelf_height = gutter, y + shelf_height + gutter, 0
+        if y + h + gutter > max_height:
+            # Sang canvas mới
+            layouts.append((placements, canvas_width, y))
+            placements, x, y, shelf_height, canvas_width = [], gutter, gutter, 0, 0
+        placements.append({'crop_index': i, 'x': x, 'y': y, 'w': w, 'h': h})
+        x += w + gutter
+        shelf_height = max(shelf_height, h)
+        canvas_width = max(canvas_width, x)
+    if placements:
+        layouts.append((placements, canvas_width, y + shelf_height + gutter))
+
+    canvases = []
+    for placements, width, height in layouts:
+        canvas = np.full((height, width, 3), background, dtype=np.uint8)
+        for p in placements:
+            canvas[p['y']:p['y'] + p['h'], p['x']:p['x'] + p['w']] = _to_bgr(images[p['crop_index']])
+        canvases.append({'image': canvas, 'placements': placements})
+    return canvases, oversized
+
+
+def assign_words(words: Sequence[Tuple[str, Sequence[Tuple[int, int]]]],
+                 placements: Sequence[Dict]) -> Dict[int, List[Tuple[str, List[Tuple[int, int]]]]]:
+    """
+    Gán các word box Vision trả về trên canvas cho crop nguồn theo hình học:
+    mỗi từ thuộc về placement có diện tích giao lớn nhất với bounding box của từ.
+    Tọa độ trả về là tọa độ tương đối trong crop. Từ nằm hoàn toàn trong gutter bị bỏ.
+    """
+    assigned = {p['crop_index']: [] for p in placements}
+    if not words or not placements:
+        return assigned
+
+    vertices = np.array([np.asarray(v, dtype=np.float64).reshape(-1, 2)[:4] for _, v in words])  # (W, 4, 2)
+    word_boxes = np.concatenate([vertices.min(axis=1), vertices.max(axis=1)], axis=1)              # (W, 4)
+    rects = np.array([[p['x'], p['y'], p['x'] + p['w'], p['y'] + p['h']] for p in placements],
+                     dtype=np.float64)                                                               # (P, 4)
+
+    inter_w = np.minimum(word_boxes[:, None, 2], rects[None, :, 2]) - np.maximum(word_boxes[:, None, 0], rects[None, :, 0])
+    inter_h = np.minimum(word_boxes[:, None, 3], rects[None, :, 3]) - np.maximum(word_boxes[:, None, 1], rects[None, :, 1])
+    overlap = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)                                 # (W, P)
+
+    best = overlap.argmax(axis=1)
+    has_overlap = overlap[np.arange(len(words)), best] > 0
+    for w_idx in np.flatnonzero(has_overlap):
+        p = placements[best[w_idx]]
+        relative = [(int(vx - p['x']), int(vy - p['y'])) for vx, vy in vertices[w_idx]]
+        assigned[p['crop_index']].append((words[w_idx][0], relative))
+    return assigned
+
+
+def words_to_text(words: Sequence[Tuple[str, Sequence[Tuple[int, int]]]]) -> str:
+    """Ghép các từ của một crop thành full_text: gom dòng theo center_y, trong dòng từ trái sang phải"""
+    if not words:
+        return ""
+    vertices = np.array([np.asarray(v, dtype=np.float64).reshape(-1, 2)[:4] for _, v in words])
+    centers = vertices.mean(axis=1)
+    heights = vertices[:, :, 1].max(axis=1) - vertices[:, :, 1].min(axis=1)
+    threshold = max(1.0, float(np.median(heights)) / 2)
+
+    order = np.argsort(centers[:, 1], kind='stable')
+    line_ids = np.concatenate([[0], np.cumsum(np.diff(centers[order, 1]) > threshold)])
+    lines = {}
+    for line_id, idx in zip(line_ids, order):
+        lines.setdefault(line_id, []).append(idx)
+    return "\n".join(
+        " ".join(words[i][0] for i in sorted(indices, key=lambda i: centers[i, 0]))
+        for _, indices in sorted(lines.items())
+    )
+
+
+def encode_png(image: np.ndarray) -> bytes:
+    ok, buffer = cv2.imencode('.png', image)
+    if not ok:
+        raise ValueError("Không thể mã hóa ảnh PNG")
+    return buffer.tobytes()
+
+
+def decode_image(content: bytes) -> np.ndarray:
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Không thể giải mã ảnh")
+    return image
@@ -0,0 +1,118 @@
+import concurrent.futures
+import http.client
+import json
+import threading
+from typing import Dict, List, Optional, Sequence, Union
+from urllib.parse import urlencode, urlparse
+
+import numpy as np
+
+DEFAULT_SERVER_URL = "http://127.0.0.1:8765"
+
+
+class DetectionClient:
+    """
+    Client mỏng cho detection_server.py: không import torch/ultralytics nên khởi động gần như tức thì.
+    Ảnh NumPy được gửi dạng raw (không mã hóa lại), bytes ảnh (PNG/JPG đọc từ file) được gửi nguyên.
+    Mỗi thread giữ một kết nối keep-alive riêng; detect_batch dùng chung một thread pool cho mọi lần
+    gọi nên các kết nối được giữ qua các batch. Gọi close() (hoặc dùng with) khi xong.
+    """
+
+    def __init__(self, url: str = DEFAULT_SERVER_URL, model: Optional[str] = None, timeout: float = 60.0,
+                 max_parallel: int = 8):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 8765
+        self.model = model
+        self.timeout = timeout
+        self.max_parallel = max_parallel
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self) -> None:
+        """Dừng thread pool của detect_batch và đóng mọi kết nối keep-alive"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            connections, self._connections = self._connections, []
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for conn in connections:
+            conn.close()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_parallel,
+                                                                       thread_name_prefix="detection-client")
+            return self._executor
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None,
+                 headers: Optional[Dict[str, str]] = None) -> Dict:
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                payload = response.read()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                # Kết nối keep-alive có thể đã bị server đóng, thử lại một lần với kết nối mới
+                conn.close()
+                self._local.conn = None
+                with self._lock:
+                    if conn in self._connections:
+                        self._connections.remove(conn)
+                if attempt:
+                    raise
+        data = json.loads(payload.decode('utf-8')) if payload else {}
+        if response.status != 200:
+            raise RuntimeError(f"Detection server lỗi {response.status}: {data.get('error', '')}")
+        return data
+
+    def health(self) -> Dict:
+        return self._request('GET', '/health')
+
+    def detect(self, image: Union[np.ndarray, bytes], conf: float = 0.3, iou: float = 0.45,
+               imgsz: Optional[int] = None) -> List[Dict]:
+        """Phát hiện trên một ảnh, trả về danh sách detection giống CNN_img_to_text.result_to_detections"""
+        params = {'conf': conf, 'iou': iou}
+        if self.model:
+            params['model'] = self.model
+        if imgsz:
+            params['imgsz'] = imgsz
+        if isinstance(image, np.ndarray):
+            image = np.ascontiguousarray(image, dtype=np.uint8)
+            body = image.tobytes()
+            headers = {'Content-Type': 'application/x-ndarray',
+                       'X-Image-Shape': ",".join(str(d) for d in image.shape)}
+        else:
+            body = bytes(image)
+            headers = {'Content-Type': 'application/octet-stream'}
+
+        data = self._request('POST', f"/detect?{urlencode(params)}", body=body, headers=headers)
+        return [dict(det, coords=tuple(det['coords'])) for det in data['detections']]
+
+    def detect_batch(self, images: Sequence[Union[np.ndarray, bytes]], conf: float = 0.3,
+                     iou: float = 0.45, imgsz: Optional[int] = None) -> List[List[Dict]]:
+        """Gửi các ảnh song song để server gom chúng vào cùng một micro-batch"""
+        if len(images) <= 1:
+            return [self.detect(image, conf=conf, iou=iou, imgsz=imgsz) for image in images]
+        return list(self._pool().map(lambda image: self.detect(image, conf=conf, iou=iou, imgsz=imgsz), images))
@@ -0,0 +1,220 @@
+import argparse
+import concurrent.futures
+import json
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from CNN_img_to_text import detect_batch, load_model, model_path as default_model_path
+from detector_backends import BACKENDS, prepare_model
+from ocr_journal import file_digest
+
+
+class MicroBatcher:
+    """
+    Gom các request đồng thời thành mini-batch cho một mô hình: batch được chạy khi đủ
+    max_batch ảnh hoặc khi hết cửa sổ window (giây) kể từ request đầu tiên.
+    Chỉ một thread gọi mô hình, song song hóa nằm ở các luồng intra-op của torch.
+    """
+
+    def __init__(self, model, max_batch: int = 8, window: float = 0.01):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.window = window
+        self.counters = {'requests': 0, 'batches': 0, 'infer_time': 0.0}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, image: np.ndarray, conf: float, iou: float,
+               imgsz: Optional[int] = None) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        self._queue.put((image, conf, iou, imgsz, future))
+        return future
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first) -> List:
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+
+            # Các request có ngưỡng / kích thước đầu vào khác nhau không chạy chung một lần suy luận được
+            groups: Dict = {}
+            for entry in batch:
+                groups.setdefault(entry[1:4], []).append(entry)
+
+            for (conf, iou, imgsz), entries in groups.items():
+                start = time.perf_counter()
+                try:
+                    results = detect_batch(self.model, [entry[0] for entry in entries], conf=conf, iou=iou,
+                                           imgsz=imgsz)
+                except Exception as e:
+                    for entry in entries:
+                        entry[4].set_exception(e)
+                    continue
+                finally:
+                    self.counters['infer_time'] += time.perf_counter() - start
+                self.counters['requests'] += len(entries)
+                self.counters['batches'] += 1
+                for entry, detections in zip(entries, results):
+                    entry[4].set_result(detections)
+
+
+def decode_request_image(body: bytes, content_type: str, shape_header: str) -> np.ndarray:
+    """Ảnh raw (application/x-ndarray + X-Image-Shape) hoặc bytes ảnh đã mã hóa (PNG/JPG...)"""
+    if content_type == 'application/x-ndarray':
+        shape = tuple(int(d) for d in shape_header.split(','))
+        image = np.frombuffer(body, dtype=np.uint8)
+        if image.size != int(np.prod(shape)):
+            raise ValueError(f"Kích thước dữ liệu không khớp với shape {shape}")
+        return image.reshape(shape)
+    image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Không thể giải mã ảnh")
+    return image
+
+
+class DetectionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+    def _send_json(self, status: int, data: Dict) -> None:
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/health':
+            self._send_json(404, {'error': 'not found'})
+            return
+        batchers = self.server.batchers
+        self._send_json(200, {
+            'models': list(batchers),
+            'default_model': self.server.default_model,
+            'weights': self.server.weights,
+            'stats': {name: dict(b.counters) for name, b in batchers.items()}
+        })
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if url.path != '/detect':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        batcher = self.server.batchers.get(params.get('model', self.server.default_model))
+        if batcher is None:
+            self._send_json(404, {'error': f"không có mô hình {params.get('model')}"})
+            return
+
+        try:
+            image = decode_request_image(body, self.headers.get('Content-Type', ''),
+                                         self.headers.get('X-Image-Shape', ''))
+            conf = float(params.get('conf', 0.3))
+            iou = float(params.get('iou', 0.45))
+            imgsz = int(params['imgsz']) if 'imgsz' in params else None
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        try:
+            detections = batcher.submit(image, conf, iou, imgsz).result()
+        except Exception as e:
+            logging.error(f"Lỗi khi phát hiện: {str(e)}")
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'detections': detections})
+
+
+def create_server(model_paths: List[str], host: str = "127.0.0.1", port: int = 8765, max_batch: int = 8,
+                  window: float = 0.01, num_threads: int = 6, backend: str = 'torch',
+                  int8: bool = False, calibration_dir: Optional[str] = None) -> ThreadingHTTPServer:
+    """
+    Tải các mô hình một lần và tạo HTTP server; tên mô hình là tên file .pt không có đuôi.
+    backend/int8: chạy bản export ONNX Runtime / OpenVINO thay cho PyTorch (xem detector_backends.py).
+    /health báo sha256 file .pt của từng mô hình để client biết chính xác trọng số đang chạy.
+    """
+    server = ThreadingHTTPServer((host, port), DetectionHandler)
+    server.daemon_threads = True
+    server.batchers = {}
+    server.weights = {}
+    for path in model_paths:
+        server.weights[Path(path).stem] = {'sha256': file_digest(path), 'backend': backend, 'int8': int8}
+        model_file = prepare_model(path, backend, int8=int8, calibration_dir=calibration_dir)
+        model = load_model(model_file, num_threads=num_threads)
+        server.batchers[Path(path).stem] = MicroBatcher(model, max_batch=max_batch, window=window)
+    server.default_model = Path(model_paths[0]).stem
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Server phát hiện vùng chữ giữ mô hình YOLO luôn sẵn sàng")
+    parser.add_argument('--model', action='append', help="File .pt (có thể lặp lại để phục vụ nhiều mô hình)")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch', type=int, default=8, help="Số ảnh tối đa mỗi lần suy luận")
+    parser.add_argument('--window-ms', type=float, default=10, help="Thời gian chờ gom batch (ms)")
+    parser.add_argument('--threads', type=int, default=6, help="Số luồng torch trên CPU")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help="Backend suy luận trên CPU")
+    parser.add_argument('--int8', action='store_true', help="Dùng mô hình lượng tử hóa INT8 (onnx/openvino)")
+    parser.add_argument('--calibration', help="Thư mục ảnh scan để calibrate INT8 khi chưa có bản lượng tử hóa")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    server = create_server(args.model or [default_model_path], host=args.host, port=args.port,
+                           max_batch=args.max_batch, window=args.window_ms / 1000, num_threads=args.threads,
+                           backend=args.backend, int8=args.int8, calibration_dir=args.calibration)
+    print(f"Detection server đang chạy tại http://{args.host}:{args.port} "
+          f"(mô hình: {', '.join(server.batchers)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for batcher in server.batchers.values():
+            batcher.close()
+
+
+if __name__ == "__main__":
+    main()
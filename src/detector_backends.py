@@ -0,0 +1,310 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tiff', '.bmp')
+
+
+def exported_path(model_path: str, backend: str, int8: bool = False) -> str:
+    """Đường dẫn file/thư mục mô hình đã export, nằm cạnh file .pt (theo quy ước đặt tên của ultralytics)"""
+    stem = Path(model_path).with_suffix('')
+    suffix = "_int8" if int8 else ""
+    if backend == 'onnx':
+        return f"{stem}{suffix}.onnx"
+    if backend == 'openvino':
+        return f"{stem}{suffix}_openvino_model"
+    return model_path
+
+
+def _info_path(path: str) -> str:
+    return f"{path}.export.json"
+
+
+def export_info(path: str) -> Optional[Dict]:
+    """Tham số đã dùng để tạo bản export (imgsz, backend...), None nếu không có ghi chép"""
+    try:
+        with open(_info_path(path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _record_export(path: str, options: Dict) -> None:
+    with open(_info_path(path), 'w', encoding='utf-8') as f:
+        json.dump(options, f, ensure_ascii=False, indent=2)
+
+
+def _is_fresh(path: str, source: str, options: Dict) -> bool:
+    """Bản export dùng lại được nếu mới hơn nguồn và được tạo với đúng các tham số options"""
+    return (os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source)
+            and export_info(path) == options)
+
+
+def export_model(model_path: str, backend: str = 'onnx', imgsz: int = 640, force: bool = False) -> str:
+    """
+    Export mô hình .pt sang ONNX (dynamic batch) hoặc OpenVINO FP32.
+    Bản export được dùng lại cho tới khi file .pt thay đổi hoặc export với tham số khác (vd: imgsz);
+    tham số được ghi vào <bản export>.export.json.
+    """
+    if backend == 'torch':
+        return model_path
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend không hỗ trợ: {backend}")
+
+    target = exported_path(model_path, backend)
+    options = {'backend': backend, 'imgsz': imgsz, 'dynamic': True}
+    if backend == 'onnx':
+        options['simplify'] = True
+    if not force and _is_fresh(target, model_path, options):
+        return target
+
+    from ultralytics import YOLO
+    print(f"Đang export {model_path} sang {backend} (imgsz {imgsz})...")
+    model = YOLO(model_path)
+    exported = str(model.export(format=backend, imgsz=imgsz, dynamic=True,
+                                **({'simplify': True} if backend == 'onnx' else {})))
+    _record_export(exported, options)
+    return exported
+
+
+def collect_calibration_images(calibration_dir: str, max_images: int = 100) -> List[str]:
+    paths = sorted(glob.glob(os.path.join(calibration_dir, '*')))
+    paths = [p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS)]
+    if not paths:
+        raise FileNotFoundError(f"Không có ảnh calibration trong {calibration_dir}")
+    # Lấy mẫu đều trên toàn bộ thư mục thay vì chỉ các ảnh đầu
+    step = max(1, len(paths) // max_images)
+    return paths[::step][:max_images]
+
+
+def preprocess(img: np.ndarray, imgsz: int = 640) -> np.ndarray:
+    """Letterbox giống ultralytics: giữ tỉ lệ, pad màu 114, BGR -> RGB, NCHW float32 [0, 1]"""
+    height, width = img.shape[:2]
+    scale = min(imgsz / height, imgsz / width)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    canvas[top:top + new_h, left:left + new_w] = resized
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+def _calibration_tensors(image_paths: Sequence[str], imgsz: int) -> Iterator[np.ndarray]:
+    for path in image_paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"Bỏ qua ảnh calibration không đọc được: {path}")
+            continue
+        yield preprocess(img, imgsz)
+
+
+def _quantize_options(backend: str, imgsz: int, calibration_dir: str, max_images: int) -> Dict:
+    return {'backend': backend, 'imgsz': imgsz, 'int8': True,
+            'calibration_dir': os.path.abspath(calibration_dir), 'max_images': max_images}
+
+
+def quantize_onnx(model_path: str, calibration_dir: str, imgsz: int = 640, max_images: int = 100,
+                  force: bool = False) -> str:
+    """INT8 static quantization (QDQ, per-channel) cho ONNX Runtime, calibrate trên ảnh scan thật"""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    fp32_path = export_model(model_path, 'onnx', imgsz=imgsz, force=force)
+    target = exported_path(model_path, 'onnx', int8=True)
+    options = _quantize_options('onnx', imgsz, calibration_dir, max_images)
+    if not force and _is_fresh(target, fp32_path, options):
+        return target
+
+    import onnx
+    input_name = onnx.load(fp32_path, load_external_data=False).graph.input[0].name
+    image_paths = collect_calibration_images(calibration_dir, max_images)
+
+    class ScanReader(CalibrationDataReader):
+        def __init__(self):
+            self._tensors = _calibration_tensors(image_paths, imgsz)
+
+        def get_next(self):
+            tensor = next(self._tensors, None)
+            return None if tensor is None else {input_name: tensor}
+
+    print(f"Đang lượng tử hóa INT8 với {len(image_paths)} ảnh calibration...")
+    prepared_path = f"{Path(target).with_suffix('')}_prep.onnx"
+    quant_pre_process(fp32_path, prepared_path, skip_symbolic_shape=True)
+    try:
+        quantize_static(prepared_path, target, ScanReader(), quant_format=QuantFormat.QDQ,
+                        per_channel=True, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    finally:
+        os.remove(prepared_path)
+    _record_export(target, options)
+    return target
+
+
+def quantize_openvino(model_path: str, calibration_dir: str, imgsz: int = 640, max_images: int = 100,
+                      force: bool = False) -> str:
+    """INT8 post-training quantization bằng NNCF cho OpenVINO, calibrate trên ảnh scan thật"""
+    import nncf
+    import openvino as ov
+
+    fp32_dir = export_model(model_path, 'openvino', imgsz=imgsz, force=force)
+    target = exported_path(model_path, 'openvino', int8=True)
+    options = _quantize_options('openvino', imgsz, calibration_dir, max_images)
+    if not force and _is_fresh(target, fp32_dir, options):
+        return target
+
+    image_paths = collect_calibration_images(calibration_dir, max_images)
+    xml_name = Path(model_path).with_suffix('.xml').name
+    ov_model = ov.Core().read_model(os.path.join(fp32_dir, xml_name))
+    dataset = nncf.Dataset(list(_calibration_tensors(image_paths, imgsz)))
+
+    print(f"Đang lượng tử hóa INT8 với {len(image_paths)} ảnh calibration...")
+    quantized = nncf.quantize(ov_model, dataset, preset=nncf.QuantizationPreset.MIXED,
+                              subset_size=len(image_paths))
+    os.makedirs(target, exist_ok=True)
+    ov.save_model(quantized, os.path.join(target, xml_name))
+    # ultralytics cần metadata.yaml (tên lớp, imgsz...) để nạp thư mục OpenVINO
+    shutil.copy(os.path.join(fp32_dir, 'metadata.yaml'), os.path.join(target, 'metadata.yaml'))
+    _record_export(target, options)
+    return target
+
+
+def prepare_model(model_path: str, backend: str = 'torch', int8: bool = False,
+                  calibration_dir: Optional[str] = None, imgsz: int = 640) -> str:
+    """Trả về đường dẫn mô hình để YOLO(...) nạp theo backend đã chọn (export/lượng tử hóa nếu cần)"""
+    if backend == 'torch' or not model_path.endswith('.pt'):
+        # File .onnx / thư mục OpenVINO truyền trực tiếp thì dùng luôn
+        return model_path
+    if not int8:
+        return export_model(model_path, backend, imgsz=imgsz)
+    if calibration_dir is None:
+        target = exported_path(model_path, backend, int8=True)
+        info = export_info(target)
+        if os.path.exists(target) and (info is None or info.get('imgsz') == imgsz):
+            return target
+        if info is not None:
+            raise ValueError(f"Bản INT8 có sẵn được lượng tử hóa với imgsz {info.get('imgsz')}, không phải {imgsz}: "
+                             f"cần --calibration để lượng tử hóa lại")
+        raise ValueError("Cần thư mục ảnh calibration (--calibration) để lượng tử hóa INT8")
+    if backend == 'onnx':
+        return quantize_onnx(model_path, calibration_dir, imgsz=imgsz)
+    return quantize_openvino(model_path, calibration_dir, imgsz=imgsz)
+
+
+def box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Ma trận IoU (A, B) cho box dạng [x1, y1, x2, y2]"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def match_detections(reference: Sequence[Dict], candidate: Sequence[Dict],
+                     iou_threshold: float = 0.5) -> List[tuple]:
+    """Ghép greedy theo IoU giảm dần, trả về [(chỉ số reference, chỉ số candidate, IoU)]"""
+    if not reference or not candidate:
+        return []
+    iou = box_iou([d['coords'] for d in reference], [d['coords'] for d in candidate])
+    pairs = []
+    used_ref, used_cand = set(), set()
+    for flat in np.argsort(-iou, axis=None):
+        i, j = np.unravel_index(flat, iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        if i in used_ref or j in used_cand:
+            continue
+        used_ref.add(i)
+        used_cand.add(j)
+        pairs.append((int(i), int(j), float(iou[i, j])))
+    return pairs
+
+
+def parity_report(reference_pages: Sequence[Sequence[Dict]], candidate_pages: Sequence[Sequence[Dict]],
+                  iou_threshold: float = 0.5) -> Dict[str, float]:
+    """
+    So sánh detection của backend mới với torch trên cùng các trang:
+    - recall / precision: tỉ lệ box được ghép (IoU >= iou_threshold) ở mỗi phía
+    - mean_iou: IoU trung bình của các cặp đã ghép
+    - class_agreement: tỉ lệ cặp đã ghép có cùng lớp
+    """
+    ref_total = cand_total = 0
+    ious, same_class = [], []
+    for reference, candidate in zip(reference_pages, candidate_pages):
+        ref_total += len(reference)
+        cand_total += len(candidate)
+        for i, j, iou in match_detections(reference, candidate, iou_threshold):
+            ious.append(iou)
+            same_class.append(reference[i]['class_id'] == candidate[j]['class_id'])
+    matched = len(ious)
+    return {
+        'reference_boxes': ref_total,
+        'candidate_boxes': cand_total,
+        'matched': matched,
+        'recall': matched / ref_total if ref_total else 1.0,
+        'precision': matched / cand_total if cand_total else 1.0,
+        'mean_iou': float(np.mean(ious)) if ious else 1.0,
+        'class_agreement': float(np.mean(same_class)) if same_class else 1.0,
+    }
+
+
+def check_parity(model_path: str, candidate_path: str, image_paths: Sequence[str], conf: float = 0.3,
+                 iou: float = 0.45, iou_threshold: float = 0.5, num_threads: int = 6) -> Dict[str, float]:
+    """Chạy mô hình torch và mô hình đã export trên cùng ảnh, trả về parity_report kèm thời gian mỗi trang"""
+    from CNN_img_to_text import detect_batch, load_model, read_image
+
+    images = [img for img in (read_image(path) for path in image_paths) if img is not None]
+    pages = {}
+    timings = {}
+    for name, path in (('reference', model_path), ('candidate', candidate_path)):
+        model = load_model(path, num_threads=num_threads)
+        detect_batch(model, images[:1], conf=conf, iou=iou)  # warm-up
+        start = time.perf_counter()
+        pages[name] = [detect_batch(model, [img], conf=conf, iou=iou)[0] for img in images]
+        timings[name] = (time.perf_counter() - start) / max(1, len(images))
+
+    report = parity_report(pages['reference'], pages['candidate'], iou_threshold)
+    report['reference_ms_per_page'] = timings['reference'] * 1000
+    report['candidate_ms_per_page'] = timings['candidate'] * 1000
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export detector sang ONNX Runtime / OpenVINO (tùy chọn INT8)")
+    parser.add_argument('--model', required=True, help="File .pt gốc")
+    parser.add_argument('--backend', choices=BACKENDS[1:], default='onnx')
+    parser.add_argument('--int8', action='store_true', help="Lượng tử hóa INT8 static")
+    parser.add_argument('--calibration', help="Thư mục ảnh scan dùng để calibrate INT8")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--parity', help="Thư mục ảnh để so sánh kết quả với torch")
+    parser.add_argument('--conf', type=float, default=0.3)
+    parser.add_argument('--iou', type=float, default=0.45)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    exported = prepare_model(args.model, args.backend, int8=args.int8, calibration_dir=args.calibration,
+                             imgsz=args.imgsz)
+    print(f"Mô hình {args.backend}{' INT8' if args.int8 else ''}: {exported}")
+
+    if args.parity:
+        image_paths = collect_calibration_images(args.parity, max_images=50)
+        report = check_parity(args.model, exported, image_paths, conf=args.conf, iou=args.iou)
+        print(f"\nParity trên {len(image_paths)} ảnh:")
+        for key, value in report.items():
+            print(f"- {key}: {value:.4f}" if isinstance(value, float) else f"- {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import concurrent.futures
+import hashlib
+import io
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from PIL import Image
+
+THUMBNAIL_DIR_NAME = ".thumbnails"
+
+
+def make_thumbnail(source: Union[bytes, str], size: Tuple[int, int] = (75, 75), keep_aspect: bool = False) -> bytes:
+    """
+    Tạo thumbnail PNG từ bytes ảnh hoặc đường dẫn.
+    keep_aspect=False: resize đúng size (như báo cáo cũ); True: giữ tỉ lệ, thu nhỏ về chiều cao
+    size[1] (ảnh thấp hơn thì giữ nguyên kích thước, Excel tự phóng khi hiển thị).
+    """
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        img = img.convert('RGB')
+        if keep_aspect:
+            width, height = img.size
+            scale = min(1.0, size[1] / height)
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        img = img.resize(size, Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class ThumbnailCache:
+    """
+    Cache thumbnail trên đĩa theo nội dung ảnh gốc + kích thước thumbnail, dùng lại giữa các lần chạy.
+    File thumbnail được openpyxl đọc lúc lưu workbook nên không cần giữ ảnh trong bộ nhớ.
+    """
+
+    def __init__(self, cache_dir: str, size: Tuple[int, int] = (75, 75), keep_aspect: bool = False):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.keep_aspect = keep_aspect
+        self.counters = {'hits': 0, 'created': 0}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, content: bytes) -> str:
+        digest = hashlib.sha256(content)
+        digest.update(f"\0{self.size[0]}x{self.size[1]}:{int(self.keep_aspect)}".encode())
+        key = digest.hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def get(self, source: Union[bytes, str]) -> str:
+        """Trả về đường dẫn thumbnail của ảnh (bytes hoặc đường dẫn), tạo mới nếu chưa có"""
+        if not isinstance(source, bytes):
+            with open(source, 'rb') as f:
+                source = f.read()
+        path = self.path_for(source)
+        if os.path.exists(path):
+            with self._lock:
+                self.counters['hits'] += 1
+            return path
+
+        thumbnail = make_thumbnail(source, self.size, self.keep_aspect)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Ghi ra file tạm rồi đổi tên để lần chạy song song không đọc phải file ghi dở
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(thumbnail)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.counters['created'] += 1
+        return path
+
+    def get_many(self, sources: Sequence[Optional[Union[bytes, str]]],
+                 executor: concurrent.futures.Executor) -> List[Optional[str]]:
+        """Tạo thumbnail song song; ảnh lỗi hoặc không có nguồn trả về None"""
+        def safe_get(source):
+            if source is None:
+                return None
+            try:
+                return self.get(source)
+            except Exception as e:
+                print(f"Failed to create thumbnail: {str(e)}")
+                return None
+        return list(executor.map(safe_get, sources))
+
+
+def format_coordinates(result: Dict) -> str:
+    """Tọa độ text block đầu tiên, hoặc khung ảnh nếu không có text"""
+    if result["text_blocks"]:
+        block = result["text_blocks"][0]
+        vertices = block["position"]["vertices"]
+        center = block["position"]["center"]
+        return (
+            f"Top-left: ({vertices[0][0]}, {vertices[0][1]})\n"
+            f"Top-right: ({vertices[1][0]}, {vertices[1][1]})\n"
+            f"Bottom-right: ({vertices[2][0]}, {vertices[2][1]})\n"
+            f"Bottom-left: ({vertices[3][0]}, {vertices[3][1]})\n"
+            f"Center: ({center['x']:.1f}, {center['y']:.1f})"
+        )
+    # Nếu không có text, lấy tọa độ từ kích thước ảnh
+    w = result["image_size"]["width"]
+    h = result["image_size"]["height"]
+    return (
+        f"Top-left: (0, 0)\n"
+        f"Top-right: ({w}, 0)\n"
+        f"Bottom-right: ({w}, {h})\n"
+        f"Bottom-left: (0, {h})\n"
+        f"Center: ({w/2:.1f}, {h/2:.1f})"
+    )
+
+
+def _chunks(items: Iterable, size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_ocr_report(results: Iterable[Dict], output_path: str, images_dir: str,
+                     crop_images: Optional[Dict[str, bytes]] = None, cache_dir: Optional[str] = None,
+                     max_workers: int = 4, chunk_size: int = 256) -> int:
+    """
+    Ghi báo cáo OCR (Image | Image Name | Text Content | Coordinates) bằng workbook write-only:
+    các dòng được stream ra file tạm, ảnh chỉ được tham chiếu qua đường dẫn thumbnail trong cache,
+    nên bộ nhớ chỉ phụ thuộc chunk_size chứ không phụ thuộc số dòng.
+    Trả về số dòng đã ghi.
+    """
+    from openpyxl import Workbook
+    from openpyxl.drawing.image import Image as XLImage
+
+    cache = ThumbnailCache(cache_dir or os.path.join(os.path.dirname(os.path.abspath(output_path)),
+                                                     THUMBNAIL_DIR_NAME))
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("OCR Results")
+    # Write-only: độ rộng cột phải đặt trước khi ghi dòng
+    for column, width in zip("ABCD", (12, 20, 40, 35)):
+        ws.column_dimensions[column].width = width
+    ws.append(["Image", "Image Name", "Text Content", "Coordinates"])
+
+    rows = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk in _chunks(results, chunk_size):
+            sources = []
+            for result in chunk:
+                source = crop_images.get(result["image_name"]) if crop_images else None
+                if source is None:
+                    image_path = os.path.join(images_dir, result["image_name"])
+                    source = image_path if os.path.exists(image_path) else None
+                sources.append(source)
+
+            for result, thumbnail_path in zip(chunk, cache.get_many(sources, executor)):
+                rows += 1
+                row_idx = rows + 1
+                if thumbnail_path is not None:
+                    xl_image = XLImage(thumbnail_path)
+                    xl_image.width = 75
+                    xl_image.height = 75
+                    ws.add_image(xl_image, f"A{row_idx}")
+                    ws.row_dimensions[row_idx].height = 60
+                else:
+                    print(f"Failed to add image: {result['image_name']}")
+                ws.append([None, result["image_name"], result.get("full_text", ""), format_coordinates(result)])
+
+    wb.save(output_path)
+    return rows
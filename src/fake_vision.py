@@ -0,0 +1,86 @@
+import hashlib
+import io
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud import vision
+from PIL import Image
+
+from OCR_img_ggvision import MAX_BATCH_IMAGES
+
+
+class FakeVisionClient:
+    """
+    Stub cục bộ thay cho vision.ImageAnnotatorClient, dùng khi không có mạng.
+    Trả về response Vision thật (protobuf) với nội dung xác định theo hash của ảnh:
+    full_text "text_<hash>" và một word box phủ gần hết ảnh.
+
+    - latency: số giây giả lập cho mỗi RPC
+    - error_every: ảnh thứ N (đếm toàn cục) trả về response.error với mã error_code
+      (mặc định 3 = INVALID_ARGUMENT; 8/14... là lỗi tạm thời, engine sẽ thử lại)
+    - raise_every: RPC thứ N ném ServiceUnavailable (lỗi có thể retry)
+    - timeout (tham số của RPC): latency lớn hơn timeout thì ném DeadlineExceeded sau timeout giây,
+      giống client thật hủy RPC theo deadline
+    """
+
+    def __init__(self, latency: float = 0.0, error_every: int = 0, raise_every: int = 0, error_code: int = 3):
+        self.latency = latency
+        self.error_every = error_every
+        self.error_code = error_code
+        self.raise_every = raise_every
+        self.counters = {'rpc_calls': 0, 'images': 0, 'raised': 0}
+        self._lock = threading.Lock()
+
+    def _next_call(self, timeout=None):
+        with self._lock:
+            self.counters['rpc_calls'] += 1
+            call_number = self.counters['rpc_calls']
+        if timeout is not None and self.latency > timeout:
+            time.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded("Fake Vision: deadline exceeded")
+        if self.latency:
+            time.sleep(self.latency)
+        if self.raise_every and call_number % self.raise_every == 0:
+            with self._lock:
+                self.counters['raised'] += 1
+            raise google_exceptions.ServiceUnavailable("Fake Vision: service unavailable")
+
+    def _annotate(self, content: bytes) -> vision.AnnotateImageResponse:
+        with self._lock:
+            self.counters['images'] += 1
+            image_number = self.counters['images']
+
+        response = vision.AnnotateImageResponse()
+        if self.error_every and image_number % self.error_every == 0:
+            response.error.code = self.error_code
+            response.error.message = f"Fake Vision: error {self.error_code}"
+            return response
+
+        width, height = Image.open(io.BytesIO(content)).size
+        text = f"text_{hashlib.sha1(content).hexdigest()[:8]}"
+        margin_x, margin_y = min(2, width // 4), min(2, height // 4)
+        vertices = [
+            vision.Vertex(x=margin_x, y=margin_y),
+            vision.Vertex(x=width - margin_x, y=margin_y),
+            vision.Vertex(x=width - margin_x, y=height - margin_y),
+            vision.Vertex(x=margin_x, y=height - margin_y),
+        ]
+        poly = vision.BoundingPoly(vertices=vertices)
+        response.text_annotations.extend([
+            vision.EntityAnnotation(description=text, bounding_poly=poly),
+            vision.EntityAnnotation(description=text, bounding_poly=poly),
+        ])
+        return response
+
+    def text_detection(self, image, image_context=None, timeout=None, **kwargs):
+        self._next_call(timeout)
+        return self._annotate(image.content)
+
+    def batch_annotate_images(self, requests, timeout=None, **kwargs):
+        if len(requests) > MAX_BATCH_IMAGES:
+            raise google_exceptions.InvalidArgument(
+                f"Fake Vision: at most {MAX_BATCH_IMAGES} images per request")
+        self._next_call(timeout)
+        return vision.BatchAnnotateImagesResponse(
+            responses=[self._annotate(request.image.content) for request in requests])
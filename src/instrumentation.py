@@ -0,0 +1,274 @@
+"""
+Đo thời gian từng bước (span), đếm sự kiện (counter) và phân bố thời gian (histogram) dùng chung
+cho các script. Mặc định tắt: span() trả về một context manager rỗng dùng chung, count()/observe()
+return ngay, nên gần như không tốn gì khi không bật.
+
+    import instrumentation as metrics
+    metrics.enable(trace=True)
+    with metrics.span('infer'):
+        ...
+    metrics.count('crops', len(crops))
+    metrics.write_prometheus('ocr.prom'); metrics.write_trace('trace.json')
+
+Tên span dùng trong repo: load, decode, infer, nms, crop, encode, rpc, write.
+Counter: pages, crops, api_calls, retries, cache_hits, cache_misses, errors.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+# Bucket (giây) cho histogram, giống mặc định của client Prometheus
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_PREFIX = "ocr"
+
+_enabled = False
+_tracing = False
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_histograms: Dict[str, 'Histogram'] = {}
+_events = []
+_origin = time.perf_counter()
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # phần tử cuối là +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def summary(self) -> Dict:
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else 0.0,
+                'buckets': dict(zip([*map(str, self.buckets), '+Inf'], self.counts))}
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'attrs', 'start')
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        observe(self.name, end - self.start)
+        if _tracing:
+            event = {'name': self.name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                     'ts': (self.start - _origin) * 1e6, 'dur': (end - self.start) * 1e6}
+            if self.attrs or exc_type is not None:
+                event['args'] = dict(self.attrs, error=exc_type.__name__) if exc_type else self.attrs
+            with _lock:
+                _events.append(event)
+        return False
+
+
+def enable(trace: bool = False) -> None:
+    """Bật thu thập metrics; trace=True giữ thêm từng span để ghi JSON trace (tốn bộ nhớ theo số span)"""
+    global _enabled, _tracing
+    _enabled = True
+    _tracing = trace
+
+
+def disable() -> None:
+    global _enabled, _tracing
+    _enabled = False
+    _tracing = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def is_tracing() -> bool:
+    return _tracing
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _events.clear()
+
+
+def span(name: str, **attrs):
+    """Context manager đo thời gian một bước, kết quả vào histogram <name> (và trace nếu bật)"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, attrs)
+
+
+def count(name: str, value: float = 1) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float) -> None:
+    """Ghi một giá trị thời gian (giây) vào histogram name, vd: thời gian NMS do ultralytics báo"""
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(value)
+
+
+def snapshot() -> Dict:
+    with _lock:
+        return {'counters': dict(_counters),
+                'spans': {name: histogram.summary() for name, histogram in _histograms.items()}}
+
+
+def drain() -> Dict:
+    """
+    Lấy toàn bộ metrics đã thu rồi xóa, để worker process gửi về process cha (xem merge()).
+    Histogram giữ nguyên số đếm từng bucket thay vì summary để cộng được.
+    """
+    with _lock:
+        data = {'counters': dict(_counters), 'origin': _origin, 'events': list(_events),
+                'histograms': {name: {'buckets': histogram.buckets, 'counts': list(histogram.counts),
+                                      'sum': histogram.sum, 'count': histogram.count}
+                               for name, histogram in _histograms.items()}}
+        _counters.clear()
+        _histograms.clear()
+        _events.clear()
+    return data
+
+
+def merge(data: Dict) -> None:
+    """Cộng metrics do drain() trả về (từ process khác) vào registry của process này"""
+    if not _enabled or not data:
+        return
+    # perf_counter dùng chung đồng hồ monotonic giữa các process: chỉ cần dời gốc thời gian của trace
+    shift = (data['origin'] - _origin) * 1e6
+    with _lock:
+        for name, value in data['counters'].items():
+            _counters[name] = _counters.get(name, 0) + value
+        for name, other in data['histograms'].items():
+            histogram = _histograms.get(name)
+            if histogram is None:
+                histogram = _histograms[name] = Histogram(other['buckets'])
+            if histogram.buckets != tuple(other['buckets']):
+                raise ValueError(f"Histogram {name}: bucket không khớp, không gộp được")
+            histogram.counts = [a + b for a, b in zip(histogram.counts, other['counts'])]
+            histogram.sum += other['sum']
+            histogram.count += other['count']
+        if _tracing:
+            _events.extend(dict(event, ts=event['ts'] + shift) for event in data['events'])
+
+
+def _atomic_write(path: str, text: str) -> None:
+    # node_exporter đọc textfile bất kỳ lúc nào: ghi file tạm rồi đổi tên
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def format_prometheus(labels: Optional[Dict[str, str]] = None) -> str:
+    """Metrics theo định dạng text exposition của Prometheus (cho node_exporter textfile collector)"""
+    extra = "".join(f',{k}="{v}"' for k, v in (labels or {}).items())
+    base = extra.lstrip(',')
+    lines = []
+    with _lock:
+        for name, value in sorted(_counters.items()):
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{{{base}}} {value}" if base else f"{metric} {value}")
+
+        metric = f"{METRIC_PREFIX}_span_seconds"
+        if _histograms:
+            lines.append(f"# TYPE {metric} histogram")
+        for name, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip([*map(str, histogram.buckets), '+Inf'], histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{span="{name}",le="{bound}"{extra}}} {cumulative}')
+            lines.append(f'{metric}_sum{{span="{name}"{extra}}} {histogram.sum}')
+            lines.append(f'{metric}_count{{span="{name}"{extra}}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str, labels: Optional[Dict[str, str]] = None) -> None:
+    _atomic_write(path, format_prometheus(labels))
+
+
+def write_trace(path: str) -> None:
+    """
+    Ghi span theo Trace Event Format (mở bằng chrome://tracing hoặc ui.perfetto.dev),
+    kèm counters/histogram trong "metadata".
+    """
+    with _lock:
+        events = list(_events)
+    _atomic_write(path, json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms', 'metadata': snapshot()},
+                                   ensure_ascii=False))
+
+
+def write_json(path: str) -> None:
+    _atomic_write(path, json.dumps(snapshot(), ensure_ascii=False, indent=2))
+
+
+def export(prometheus_path: Optional[str] = None, trace_path: Optional[str] = None,
+           labels: Optional[Dict[str, str]] = None) -> None:
+    if prometheus_path:
+        write_prometheus(prometheus_path, labels)
+    if trace_path:
+        write_trace(trace_path)
+
+
+def add_arguments(parser) -> None:
+    """Tham số --metrics-prom / --trace dùng chung cho các script"""
+    parser.add_argument('--metrics-prom', help="Ghi metrics ra file textfile Prometheus (vd: ocr.prom)")
+    parser.add_argument('--trace', help="Ghi từng span ra file JSON trace (mở bằng chrome://tracing)")
+
+
+def enable_from_args(args) -> None:
+    if args.metrics_prom or args.trace:
+        enable(trace=bool(args.trace))
+
+
+def finish(args, job: str) -> None:
+    """In tóm tắt và ghi các file metrics được yêu cầu từ CLI, job là nhãn của script"""
+    if _enabled:
+        print_summary()
+        export(args.metrics_prom, args.trace, labels={'job': job})
+
+
+def print_summary() -> None:
+    data = snapshot()
+    if data['spans']:
+        print(f"\n{'span':<10} {'số lần':>8} {'tổng (s)':>10} {'tb (ms)':>9}")
+        for name, s in sorted(data['spans'].items(), key=lambda item: -item[1]['sum']):
+            print(f"{name:<10} {s['count']:>8} {s['sum']:>10.3f} {s['mean']*1000:>9.2f}")
+    for name, value in sorted(data['counters'].items()):
+        print(f"{name}: {value:g}")
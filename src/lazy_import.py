@@ -0,0 +1,32 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module chỉ được import thật khi truy cập thuộc tính đầu tiên (vd: vision.Image).
+    Dùng cho thư viện nặng (google-cloud, openpyxl...) để import script / chạy --help nhanh.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_name = name
+        self._lazy_module = None
+
+    def _load(self) -> types.ModuleType:
+        if self._lazy_module is None:
+            self._lazy_module = importlib.import_module(self._lazy_name)
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        # Chỉ được gọi khi thuộc tính không có sẵn trên proxy
+        if attr.startswith('_lazy_'):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+import instrumentation as metrics
+
+
+class OCRCache:
+    """
+    Cache kết quả OCR theo nội dung ảnh.
+    Key là SHA-256 của bytes ảnh + language hints, value là response Vision đã serialize.
+    Gồm một LRU trong bộ nhớ phía trước và một bảng SQLite trên đĩa, có giới hạn
+    dung lượng (max_size_mb) và tuổi (max_age_days).
+    """
+
+    def __init__(self, db_path: str, max_size_mb: float = 512, max_age_days: float = 30,
+                 memory_entries: int = 1024):
+        self.db_path = db_path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.memory_entries = memory_entries
+
+        self._memory = OrderedDict()  # key -> (value, created)
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_accessed ON ocr_cache(accessed)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(content: bytes, language_hints: Iterable[str] = ()) -> str:
+        """Key theo nội dung: cùng ảnh + cùng language hints => cùng kết quả OCR"""
+        digest = hashlib.sha256(content)
+        digest.update(b"\0" + ",".join(language_hints).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return bool(self.max_age_seconds) and now - created > self.max_age_seconds
+
+    def _remember(self, key: str, value: bytes, created: float) -> None:
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            now = time.time()
+            entry = self._memory.get(key)
+            if entry is not None:
+                # Cùng hạn tuổi với bảng SQLite: process chạy lâu không được trả kết quả đã hết hạn
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    metrics.count('cache_hits')
+                    return entry[0]
+                del self._memory[key]
+
+            row = self._conn.execute("SELECT value, created FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1], now):
+                self.counters['misses'] += 1
+                metrics.count('cache_misses')
+                return None
+
+            self._conn.execute("UPDATE ocr_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.counters['disk_hits'] += 1
+            metrics.count('cache_hits')
+            self._remember(key, row[0], row[1])
+            return row[0]
+
+    def put(self, key: str, value: bytes) -> None:
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now)
+            )
+            self._conn.commit()
+            self._remember(key, value, now)
+            self.counters['writes'] += 1
+            self._puts_since_evict += 1
+            run_evict = self._puts_since_evict >= 100
+        if run_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Xóa entry quá hạn, sau đó xóa entry ít dùng nhất cho tới khi dưới giới hạn dung lượng"""
+        with self._lock:
+            self._puts_since_evict = 0
+            removed = 0
+            if self.max_age_seconds:
+                cursor = self._conn.execute("DELETE FROM ocr_cache WHERE created < ?",
+                                            (time.time() - self.max_age_seconds,))
+                removed += cursor.rowcount
+
+            if self.max_size_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+                if total > self.max_size_bytes:
+                    # Duyệt theo thứ tự truy cập cũ nhất và xóa đến khi đủ chỗ
+                    to_free = total - self.max_size_bytes
+                    stale = []
+                    for key, size in self._conn.execute("SELECT key, size FROM ocr_cache ORDER BY accessed"):
+                        stale.append((key,))
+                        to_free -= size
+                        if to_free <= 0:
+                            break
+                    self._conn.executemany("DELETE FROM ocr_cache WHERE key = ?", stale)
+                    for (key,) in stale:
+                        self._memory.pop(key, None)
+                    removed += len(stale)
+
+            self._conn.commit()
+            self.counters['evictions'] += removed
+            return removed
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+            stats['entries'], stats['size_bytes'] = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()
+            return stats
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
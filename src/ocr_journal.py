@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+
+JOURNAL_NAME = "ocr_journal.jsonl"
+JOURNAL_STATUSES = ('pending', 'done', 'failed')
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class OCRJournal:
+    """
+    Nhật ký checkpoint của process_directory: mỗi dòng {"name", "hash", "status", "error"?},
+    dòng sau ghi đè trạng thái của dòng trước cùng name. Ghi nối + flush từng dòng nên
+    chương trình dừng ở đâu thì lần chạy --resume tiếp tục từ đó.
+    """
+
+    def __init__(self, path: str, resume: bool = False, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.entries = self._load(path) if resume else {}
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    @staticmethod
+    def _load(path: str) -> Dict[str, Dict]:
+        entries = {}
+        if not os.path.exists(path):
+            return entries
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Dòng cuối ghi dở: coi như crop đó chưa xong
+                    logging.warning(f"Bỏ qua dòng ghi dở trong {path}")
+                    continue
+                entries[entry['name']] = entry
+        return entries
+
+    def record(self, name: str, digest: str, status: str, error: Optional[str] = None, **fields) -> None:
+        """fields: thông tin thêm lưu cùng dòng, vd: model=... của make_lable_CNN"""
+        entry = {'name': name, 'hash': digest, 'status': status, **fields}
+        if error is not None:
+            entry['error'] = error
+        self.entries[name] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def record_errors(self, errors: List[Dict], digests: Dict[str, str]) -> None:
+        """Ghi các lỗi (image_name, error) do process_items/process_batched/process_packed trả về"""
+        for error in errors:
+            name = error['image_name']
+            self.record(name, digests[name], 'failed', error=error['error'])
+
+    def is_done(self, name: str, digest: str, **fields) -> bool:
+        """Crop đã OCR xong và nội dung (cùng các fields, vd: phiên bản mô hình) không đổi kể từ lần đó"""
+        entry = self.entries.get(name)
+        return (entry is not None and entry['status'] == 'done' and entry['hash'] == digest
+                and all(entry.get(key) == value for key, value in fields.items()))
+
+    def summary(self) -> Dict[str, int]:
+        counts = {status: 0 for status in JOURNAL_STATUSES}
+        for entry in self.entries.values():
+            counts[entry['status']] += 1
+        return counts
+
+    def compact(self, names: Iterable[str]) -> None:
+        """Viết lại journal chỉ còn trạng thái cuối của các crop hiện có (ghi file tạm rồi đổi tên)"""
+        self._file.close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for name in names:
+                if name in self.entries:
+                    f.write(json.dumps(self.entries[name], ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class JournaledSink:
+    """Sink cho OCRProcessor: ghi kết quả vào ResultsWriter trước, rồi mới đánh dấu done trong journal"""
+
+    def __init__(self, writer, journal: OCRJournal, digests: Dict[str, str]):
+        self.writer = writer
+        self.journal = journal
+        self.digests = digests
+
+    @property
+    def count(self) -> int:
+        return self.writer.count
+
+    def write(self, result: Dict) -> None:
+        self.writer.write(result)
+        name = result['image_name']
+        self.journal.record(name, self.digests[name], 'done')
+
+    def write_many(self, results: Iterable[Dict]) -> None:
+        for result in results:
+            self.write(result)
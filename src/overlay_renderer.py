@@ -0,0 +1,196 @@
+import argparse
+import concurrent.futures
+import functools
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from results_store import find_results, read_results
+
+# Màu (BGR) như z_draw_boxes: xanh cho box có text, cam cho box không có text
+TEXT_FILL, TEXT_BORDER = (144, 238, 144), (0, 255, 0)
+EMPTY_FILL, EMPTY_BORDER = (71, 130, 255), (0, 165, 255)
+BLEND_MODES = ('roi', 'mask')
+# Font TrueType có đủ dấu tiếng Việt; Pillow tự tìm theo tên trong thư mục font của hệ thống
+FONT_CANDIDATES = ("arial.ttf", "segoeui.ttf", "tahoma.ttf", "DejaVuSans.ttf", "NotoSans-Regular.ttf",
+                   "LiberationSans-Regular.ttf")
+MIN_FONT_SIZE = 10
+
+
+@functools.lru_cache(maxsize=64)
+def load_font(size: int = 20, font_path: Optional[str] = None) -> ImageFont.FreeTypeFont:
+    """Font cho nhãn text (cache theo kích thước); cv2.putText không vẽ được dấu tiếng Việt"""
+    for candidate in ((font_path,) if font_path else FONT_CANDIDATES):
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    if font_path:
+        raise FileNotFoundError(f"Không đọc được font: {font_path}")
+    logging.warning("Không tìm thấy font hệ thống, dùng font mặc định của Pillow")
+    return ImageFont.load_default(size)
+
+
+def _boxes(results: Iterable[Dict]) -> List[Tuple[Tuple[int, int, int, int], str]]:
+    """(box, text) của các kết quả có tọa độ crop trên trang"""
+    return [(tuple(int(v) for v in result['original_crop_coords']), (result.get('full_text') or '').strip())
+            for result in results if result.get('original_crop_coords')]
+
+
+def _fit_font(draw: ImageDraw.ImageDraw, text: str, box_width: int, font_size: int,
+              font_path: Optional[str]):
+    """Thu nhỏ font (tối thiểu MIN_FONT_SIZE) để nhãn vừa chiều rộng box"""
+    font = load_font(font_size, font_path)
+    left, top, right, bottom = draw.multiline_textbbox((0, 0), text, font=font, align='center')
+    if right - left > box_width and font_size > MIN_FONT_SIZE:
+        font_size = max(MIN_FONT_SIZE, int(font_size * box_width / (right - left)))
+        font = load_font(font_size, font_path)
+        left, top, right, bottom = draw.multiline_textbbox((0, 0), text, font=font, align='center')
+    return font, (left, top, right, bottom)
+
+
+def render_overlay(img: np.ndarray, results: Iterable[Dict], alpha: float = 0.4, blend: str = 'roi',
+                   draw_text: bool = True, font_size: int = 20, font_path: Optional[str] = None) -> np.ndarray:
+    """
+    Vẽ box của các kết quả OCR lên bản sao của trang, chi phí theo diện tích box chứ không theo
+    (số box x diện tích trang) như vẽ overlay toàn trang cho từng box.
+    - blend='roi': trộn màu trong từng vùng box theo thứ tự, cho ảnh giống hệt cách vẽ cũ
+    - blend='mask': tô mọi box vào một overlay + mask rồi trộn một lần (vùng chồng nhau chỉ trộn một lần)
+    Nhãn text được vẽ bằng Pillow với font TrueType (có dấu tiếng Việt), căn giữa box.
+    """
+    if blend not in BLEND_MODES:
+        raise ValueError(f"Kiểu trộn không hỗ trợ: {blend}")
+    canvas = img.copy()
+    height, width = canvas.shape[:2]
+    boxes = _boxes(results)
+
+    def clip(box):
+        x1, y1, x2, y2 = box
+        return max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+
+    if blend == 'roi':
+        for box, text in boxes:
+            x1, y1, x2, y2 = clip(box)
+            if x2 > x1 and y2 > y1:
+                roi = canvas[y1:y2, x1:x2]
+                fill = np.empty_like(roi)
+                fill[...] = TEXT_FILL if text else EMPTY_FILL
+                cv2.addWeighted(fill, alpha, roi, 1 - alpha, 0, dst=roi)
+            cv2.rectangle(canvas, box[:2], box[2:], TEXT_BORDER if text else EMPTY_BORDER, 2)
+    else:
+        overlay = np.zeros_like(canvas)
+        mask = np.zeros((height, width), dtype=np.uint8)
+        for box, text in boxes:
+            cv2.rectangle(overlay, box[:2], box[2:], TEXT_FILL if text else EMPTY_FILL, -1)
+            cv2.rectangle(mask, box[:2], box[2:], 255, -1)
+        covered = mask > 0
+        if covered.any():
+            # Chỉ trộn các pixel nằm trong box
+            canvas[covered] = cv2.addWeighted(overlay[covered], alpha, canvas[covered], 1 - alpha, 0)
+        for box, text in boxes:
+            cv2.rectangle(canvas, box[:2], box[2:], TEXT_BORDER if text else EMPTY_BORDER, 2)
+
+    labels = [(box, text) for box, text in boxes if text] if draw_text else []
+    if labels:
+        # Chuyển sang Pillow một lần cho toàn bộ nhãn
+        page = Image.fromarray(cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB))
+        draw = ImageDraw.Draw(page)
+        for (x1, y1, x2, y2), text in labels:
+            font, (left, top, right, bottom) = _fit_font(draw, text, x2 - x1, font_size, font_path)
+            text_x = x1 + (x2 - x1 - (right - left)) // 2 - left
+            text_y = y1 + (y2 - y1 - (bottom - top)) // 2 - top
+            draw.multiline_text((text_x, text_y), text, font=font, fill=(0, 0, 0), align='center')
+        canvas = cv2.cvtColor(np.asarray(page), cv2.COLOR_RGB2BGR)
+    return canvas
+
+
+def render_results(image_path: str, results_file: str, output_path: str, **options) -> str:
+    """Đọc ảnh trang + file kết quả (results.jsonl/.parquet/json_results.json), ghi ảnh đã vẽ box"""
+    img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError(f"Không thể đọc hình ảnh từ {image_path}")
+    rendered = render_overlay(img, read_results(results_file), **options)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    if not cv2.imwrite(output_path, rendered):
+        raise ValueError(f"Không ghi được ảnh {output_path}")
+    return output_path
+
+
+def find_jobs(results_dir: str, images_dir: str, output_dir: str) -> List[Tuple[str, str, str]]:
+    """
+    Ghép file kết quả với ảnh trang theo tên: results_dir/<trang>/results.jsonl (cấu trúc theo trang
+    của CNN_img_to_text) với images_dir/<trang>.<ext>. Trả về (ảnh, kết quả, ảnh đầu ra).
+    """
+    pages = {}
+    for name in os.listdir(images_dir):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in ('.png', '.jpg', '.jpeg', '.tiff', '.bmp'):
+            pages[stem] = os.path.join(images_dir, name)
+
+    jobs = []
+    for page_name in sorted(os.listdir(results_dir)):
+        page_dir = os.path.join(results_dir, page_name)
+        results_file = find_results(page_dir) if os.path.isdir(page_dir) else None
+        if results_file is None:
+            continue
+        if page_name not in pages:
+            logging.warning(f"Không tìm thấy ảnh trang cho {page_dir}")
+            continue
+        jobs.append((pages[page_name], results_file, os.path.join(output_dir, f"{page_name}.png")))
+    return jobs
+
+
+def render_directory(results_dir: str, images_dir: str, output_dir: str, workers: Optional[int] = None,
+                     **options) -> Dict[str, int]:
+    """Vẽ song song mọi trang trong results_dir (mỗi process một trang)"""
+    jobs = find_jobs(results_dir, images_dir, output_dir)
+    stats = {'pages': 0, 'failed': 0}
+    if not jobs:
+        return stats
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_results, *job, **options): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+                stats['pages'] += 1
+            except Exception as e:
+                stats['failed'] += 1
+                logging.error(f"Lỗi khi vẽ {futures[future][0]}: {str(e)}")
+            print(f"\rĐã vẽ: {stats['pages'] + stats['failed']}/{len(jobs)} trang", end="", flush=True)
+    print()
+    return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Vẽ box + text OCR lên ảnh trang")
+    parser.add_argument('results', help="File kết quả của một trang, hoặc thư mục kết quả theo trang")
+    parser.add_argument('images', help="Ảnh trang (khi results là file) hoặc thư mục ảnh trang")
+    parser.add_argument('output', help="Ảnh đầu ra, hoặc thư mục đầu ra khi vẽ cả thư mục")
+    parser.add_argument('--workers', type=int, help="Số process vẽ song song (mặc định số core)")
+    parser.add_argument('--alpha', type=float, default=0.4, help="Độ đậm màu tô box")
+    parser.add_argument('--blend', choices=BLEND_MODES, default='roi')
+    parser.add_argument('--font', help="Đường dẫn font TrueType (mặc định tìm font hệ thống)")
+    parser.add_argument('--font-size', type=int, default=20)
+    parser.add_argument('--no-text', action='store_true', help="Chỉ vẽ box, không vẽ text")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    options = {'alpha': args.alpha, 'blend': args.blend, 'draw_text': not args.no_text,
+               'font_size': args.font_size, 'font_path': args.font}
+    if os.path.isdir(args.results):
+        stats = render_directory(args.results, args.images, args.output, workers=args.workers, **options)
+        print(f"Đã vẽ {stats['pages']} trang, {stats['failed']} lỗi -> {args.output}")
+    else:
+        render_results(args.images, args.results, args.output, **options)
+        print(f"Đã lưu ảnh kết quả tại: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+MANIFEST_NAME = "dataset.json"
+FORMAT_VERSION = 1
+DEFAULT_SHARD_BYTES = 512 << 20
+# Mỗi mẫu một bản ghi cố định trong shard_XXXXX.idx; dữ liệu nằm liền nhau trong shard_XXXXX.bin:
+# [ảnh đã mã hóa (bytes gốc)][nhãn UTF-8][metadata JSON]
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('image_size', '<u4'),
+    ('label_size', '<u4'),
+    ('meta_size', '<u4'),
+    ('digest', 'S16'),  # 16 byte đầu sha256 của ảnh, để bỏ trùng khi ghi thêm
+])
+
+
+def _shard_name(index: int) -> str:
+    return f"shard_{index:05d}"
+
+
+def image_digest(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()[:16]
+
+
+def read_labels(source_dir: str) -> Iterator[Tuple[str, str]]:
+    """(đường dẫn ảnh, nhãn) từ labels.txt của convert_excel_2_text.py (dòng "images/<file>\\t<text>")"""
+    with open(os.path.join(source_dir, 'labels.txt'), 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            relative_path, separator, label = line.partition('\t')
+            if not separator:
+                logging.warning(f"Bỏ qua dòng {line_no} không đúng định dạng trong labels.txt")
+                continue
+            yield relative_path, label
+
+
+class PackedDatasetWriter:
+    """
+    Ghi mẫu (ảnh đã mã hóa, nhãn, metadata) vào các shard nhị phân có index, ghi tiếp được vào dataset
+    đã có. dataset.json (số mẫu + số byte của từng shard) chỉ được cập nhật ở close() bằng ghi file tạm
+    rồi đổi tên: lần ghi bị dừng giữa chừng thì phần dư ở cuối shard bị cắt bỏ ở lần mở sau.
+    """
+
+    def __init__(self, root: str, shard_bytes: int = DEFAULT_SHARD_BYTES, dedupe: bool = True):
+        self.root = root
+        self.shard_bytes = max(1, shard_bytes)
+        self.dedupe = dedupe
+        self.added = 0
+        self.duplicates = 0
+        os.makedirs(root, exist_ok=True)
+        self.manifest = load_manifest(root) or {'version': FORMAT_VERSION, 'shards': []}
+
+        self._digests = set()
+        for shard in self.manifest['shards']:
+            # Cắt phần ghi dở của lần chạy trước (nếu có) về đúng kích thước trong manifest
+            for ext, size in (('.bin', shard['bytes']), ('.idx', shard['count'] * INDEX_DTYPE.itemsize)):
+                path = os.path.join(root, shard['name'] + ext)
+                if os.path.getsize(path) != size:
+                    logging.warning(f"Cắt {path} về {size} byte theo {MANIFEST_NAME}")
+                    with open(path, 'r+b') as f:
+                        f.truncate(size)
+            if dedupe and shard['count']:
+                index = np.fromfile(os.path.join(root, shard['name'] + '.idx'), dtype=INDEX_DTYPE)
+                self._digests.update(index['digest'].tolist())
+
+        self._bin = self._idx = None
+        if self.manifest['shards'] and self.manifest['shards'][-1]['bytes'] < self.shard_bytes:
+            self._open_shard(self.manifest['shards'][-1])
+
+    def _open_shard(self, shard: Dict, new: bool = False) -> None:
+        # Shard mới: ghi đè file còn sót của lần chạy bị dừng trước khi kịp ghi manifest
+        mode = 'wb' if new else 'ab'
+        self._shard = shard
+        self._bin = open(os.path.join(self.root, shard['name'] + '.bin'), mode)
+        self._idx = open(os.path.join(self.root, shard['name'] + '.idx'), mode)
+
+    def _close_shard(self) -> None:
+        if self._bin is not None:
+            self._bin.close()
+            self._idx.close()
+            self._bin = self._idx = None
+
+    def add(self, image: bytes, label: str, meta: Optional[Dict] = None) -> bool:
+        """Ghi một mẫu; trả về False nếu ảnh đã có trong dataset (dedupe=True)"""
+        digest = image_digest(image)
+        if self.dedupe:
+            if digest in self._digests:
+                self.duplicates += 1
+                return False
+            self._digests.add(digest)
+
+        if self._bin is None or self._shard['bytes'] >= self.shard_bytes:
+            self._close_shard()
+            shard = {'name': _shard_name(len(self.manifest['shards'])), 'count': 0, 'bytes': 0}
+            self.manifest['shards'].append(shard)
+            self._open_shard(shard, new=True)
+
+        label_bytes = label.encode('utf-8')
+        meta_bytes = json.dumps(meta or {}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        record = np.array([(self._shard['bytes'], len(image), len(label_bytes), len(meta_bytes), digest)],
+                          dtype=INDEX_DTYPE)
+        self._bin.write(image)
+        self._bin.write(label_bytes)
+        self._bin.write(meta_bytes)
+        self._idx.write(record.tobytes())
+        self._shard['bytes'] += len(image) + len(label_bytes) + len(meta_bytes)
+        self._shard['count'] += 1
+        self.added += 1
+        return True
+
+    def close(self) -> None:
+        self._close_shard()
+        self.manifest['count'] = sum(shard['count'] for shard in self.manifest['shards'])
+        path = os.path.join(self.root, MANIFEST_NAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def load_manifest(root: str) -> Optional[Dict]:
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Phiên bản dataset không hỗ trợ: {manifest.get('version')} ({path})")
+    return manifest
+
+
+class PackedDataset:
+    """
+    Đọc dataset do PackedDatasetWriter tạo, truy cập ngẫu nhiên O(1): shard .bin/.idx được memory-map
+    (mở khi truy cập lần đầu trong mỗi process), mỗi mẫu chỉ là một lần tra index + cắt slice.
+    Dùng trực tiếp làm Dataset của PyTorch (DataLoader chỉ cần __len__/__getitem__, pickle được
+    sang worker):
+
+        dataset = PackedDataset("packed/", transform=to_tensor)
+        loader = torch.utils.data.DataLoader(dataset, batch_size=64, shuffle=True, num_workers=4)
+
+    __getitem__ trả về (ảnh, nhãn): ảnh giải mã bằng cv2 (BGR, hoặc xám nếu grayscale=True) rồi qua
+    transform; decode=False trả về bytes ảnh gốc. record(i) trả về cả metadata.
+    """
+
+    def __init__(self, root: str, transform: Optional[Callable] = None, decode: bool = True,
+                 grayscale: bool = False):
+        self.root = root
+        self.transform = transform
+        self.decode = decode
+        self.grayscale = grayscale
+        manifest = load_manifest(root)
+        if manifest is None:
+            raise FileNotFoundError(f"Không có {MANIFEST_NAME} trong {root}")
+        self.shards = [shard for shard in manifest['shards'] if shard['count']]
+        self._starts = []
+        total = 0
+        for shard in self.shards:
+            self._starts.append(total)
+            total += shard['count']
+        self._length = total
+        self._maps = None
+
+    def __getstate__(self):
+        # Không pickle memory map, worker của DataLoader tự mở lại
+        state = self.__dict__.copy()
+        state['_maps'] = None
+        return state
+
+    def _shard_maps(self, shard_index: int):
+        if self._maps is None:
+            self._maps = [None] * len(self.shards)
+        if self._maps[shard_index] is None:
+            shard = self.shards[shard_index]
+            path = os.path.join(self.root, shard['name'])
+            # Chỉ map phần đã ghi trong manifest, phần đang được ghi thêm (nếu có) không bị đọc
+            index = np.memmap(path + '.idx', dtype=INDEX_DTYPE, mode='r', shape=(shard['count'],))
+            data = np.memmap(path + '.bin', dtype=np.uint8, mode='r', shape=(shard['bytes'],))
+            self._maps[shard_index] = (index, data)
+        return self._maps[shard_index]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _locate(self, index: int):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        # Số shard nhỏ (mỗi shard hàng trăm MB) nên bisect coi như hằng số
+        shard_index = bisect.bisect_right(self._starts, index) - 1
+        entry_index, data = self._shard_maps(shard_index)
+        return entry_index[index - self._starts[shard_index]], data
+
+    def record(self, index: int) -> Dict:
+        """{'image': bytes ảnh gốc, 'label': str, 'meta': dict} của mẫu index"""
+        entry, data = self._locate(index)
+        start = int(entry['offset'])
+        label_start = start + int(entry['image_size'])
+        meta_start = label_start + int(entry['label_size'])
+        return {
+            'image': data[start:label_start].tobytes(),
+            'label': data[label_start:meta_start].tobytes().decode('utf-8'),
+            'meta': json.loads(data[meta_start:meta_start + int(entry['meta_size'])].tobytes()),
+        }
+
+    def __getitem__(self, index: int):
+        entry, data = self._locate(index)
+        start = int(entry['offset'])
+        label_start = start + int(entry['image_size'])
+        label = data[label_start:label_start + int(entry['label_size'])].tobytes().decode('utf-8')
+        encoded = data[start:label_start]
+        if not self.decode:
+            image = encoded.tobytes()
+        else:
+            import cv2
+            image = cv2.imdecode(np.asarray(encoded), cv2.IMREAD_GRAYSCALE if self.grayscale else cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError(f"Không giải mã được ảnh của mẫu {index}")
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, label
+
+
+def pack_training_data(source_dir: str, dataset_dir: str, shard_bytes: int = DEFAULT_SHARD_BYTES,
+                       dedupe: bool = True, rebuild: bool = False) -> Dict[str, int]:
+    """
+    Đóng gói images/ + labels.txt của convert_excel_2_text.py vào dataset_dir. Mặc định ghi thêm vào
+    dataset đã có và bỏ ảnh trùng (cùng bytes), nên chạy lại sau mỗi đợt gán nhãn mới là đủ;
+    sửa nhãn của ảnh đã đóng gói cần rebuild=True.
+    """
+    if rebuild and os.path.exists(dataset_dir):
+        shutil.rmtree(dataset_dir)
+    stats = {'added': 0, 'duplicates': 0, 'missing': 0}
+    with PackedDatasetWriter(dataset_dir, shard_bytes=shard_bytes, dedupe=dedupe) as writer:
+        for relative_path, label in read_labels(source_dir):
+            image_path = os.path.join(source_dir, relative_path)
+            try:
+                with open(image_path, 'rb') as f:
+                    image = f.read()
+            except OSError as e:
+                logging.warning(f"Không đọc được {image_path}: {str(e)}")
+                stats['missing'] += 1
+                continue
+            writer.add(image, label, meta={'source': relative_path,
+                                           'format': os.path.splitext(relative_path)[1].lstrip('.').lower()})
+        stats['added'], stats['duplicates'] = writer.added, writer.duplicates
+        stats['total'] = sum(shard['count'] for shard in writer.manifest['shards'])
+    return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Đóng gói dữ liệu huấn luyện (images/ + labels.txt) thành shard có index")
+    parser.add_argument('source', help="Thư mục output của convert_excel_2_text.py")
+    parser.add_argument('dataset', help="Thư mục dataset đóng gói (ghi thêm nếu đã có)")
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_BYTES >> 20,
+                        help="Kích thước tối đa mỗi shard (MB)")
+    parser.add_argument('--no-dedupe', action='store_true', help="Giữ cả ảnh trùng bytes")
+    parser.add_argument('--rebuild', action='store_true', help="Xóa dataset cũ và đóng gói lại từ đầu")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stats = pack_training_data(args.source, args.dataset, shard_bytes=args.shard_size << 20,
+                               dedupe=not args.no_dedupe, rebuild=args.rebuild)
+    print(f"Đã thêm {stats['added']} mẫu, bỏ {stats['duplicates']} ảnh trùng, {stats['missing']} thiếu ảnh"
+          f" -> {args.dataset} ({stats['total']} mẫu)")
+
+
+if __name__ == "__main__":
+    main()
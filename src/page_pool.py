@@ -0,0 +1,199 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+import CNN_img_to_text as pipeline
+import instrumentation as metrics
+
+# Trạng thái riêng của mỗi worker process (mô hình + tham số detection)
+_worker = {}
+
+
+def share_array(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, Dict]:
+    """Chép ảnh vào một segment shared memory mới, trả về (segment, mô tả để process khác attach)"""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, {'name': shm.name, 'shape': array.shape, 'dtype': array.dtype.str}
+
+
+def read_shared_array(desc: Dict) -> np.ndarray:
+    """
+    Đọc ảnh từ shared memory và đóng segment ngay.
+    Phải chép ra vì ultralytics giữ tham chiếu tới batch cuối cùng, view trên segment sẽ không đóng được.
+    """
+    shm = shared_memory.SharedMemory(name=desc['name'])
+    try:
+        view = np.ndarray(desc['shape'], dtype=desc['dtype'], buffer=shm.buf)
+        array = view.copy()
+        del view
+    finally:
+        shm.close()
+    return array
+
+
+def _init_worker(model_path: str, num_threads: int, options: Dict) -> None:
+    # OpenCV không cần thread pool riêng trong worker, tránh tranh chấp core với torch
+    cv2.setNumThreads(1)
+    # Worker là process spawn mới: bật lại metrics như process cha, số liệu gửi về kèm kết quả từng trang
+    if options['metrics']:
+        metrics.enable(trace=options['trace'])
+    _worker['model'] = pipeline.load_model(model_path, num_threads=num_threads)
+    _worker['options'] = options
+
+
+def _process_page(page_desc: Dict) -> Dict:
+    """Chạy trong worker: detection -> thứ tự đọc -> crop + mã hóa PNG, crop trả về qua shared memory"""
+    img = read_shared_array(page_desc)
+    model, options = _worker['model'], _worker['options']
+
+    start = time.perf_counter()
+    if options['tile_size']:
+        detections = pipeline.detect_tiled(model, [img], tile_size=options['tile_size'],
+                                           overlap=options['tile_overlap'], conf=options['conf'],
+                                           iou=options['iou'], merge=options['tile_merge'])[0]
+    else:
+        detections = pipeline.detect_batch(model, [img], conf=options['conf'], iou=options['iou'])[0]
+    detect_time = time.perf_counter() - start
+
+    sorted_objects = pipeline.sort_reading_order(pipeline.build_objects(detections, img.shape),
+                                                 columns=options['columns'])
+    crops = pipeline.crop_objects(img, sorted_objects)
+
+    blob = b"".join(crop['content'] for crop in crops)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(blob)))
+    shm.buf[:len(blob)] = blob
+    blob_name = shm.name
+    shm.close()  # process cha đọc xong sẽ unlink
+
+    crop_meta = [dict({k: v for k, v in crop.items() if k not in ('image', 'content')}, size=len(crop['content']))
+                 for crop in crops]
+    return {'detections': detections, 'sorted_objects': sorted_objects, 'crops': crop_meta,
+            'blob': blob_name, 'detect_time': detect_time,
+            'metrics': metrics.drain() if options['metrics'] else None}
+
+
+def _unpack_crops(img: np.ndarray, result: Dict) -> List[Dict]:
+    """Ghép lại danh sách crop như crop_objects: 'image' là view trên trang, 'content' đọc từ shared memory"""
+    shm = shared_memory.SharedMemory(name=result['blob'])
+    try:
+        crops, offset = [], 0
+        for meta in result['crops']:
+            meta = dict(meta)
+            size = meta.pop('size')
+            x1, y1, x2, y2 = meta['coords']
+            meta['image'] = img[y1:y2, x1:x2]
+            meta['content'] = bytes(shm.buf[offset:offset + size])
+            crops.append(meta)
+            offset += size
+    finally:
+        shm.close()
+        shm.unlink()
+    return crops
+
+
+def default_workers(threads_per_worker: int) -> int:
+    return max(1, (os.cpu_count() or 1) // max(1, threads_per_worker))
+
+
+def process_pages_parallel(model_path: str, image_paths: Sequence[str], output_dir: str, result_dir: str,
+                           workers: Optional[int] = None, threads_per_worker: Optional[int] = None,
+                           conf: float = 0.3, iou: float = 0.45, per_page_dirs: bool = True,
+                           max_readers: int = 4, max_writers: int = 4, save_crops: bool = True,
+                           processor=None, columns: bool = False, tile_size: Optional[int] = None,
+                           tile_overlap: int = 128, tile_merge: str = 'nms') -> Dict:
+    """
+    Như CNN_img_to_text.process_pages nhưng detection chạy trên nhiều process, mỗi process một mô hình.
+    - Trang được giải mã ở process cha (thread pool đọc trước) và gửi sang worker qua shared memory,
+      crop đã mã hóa được gửi về cũng qua shared memory thay vì pickle mảng NumPy.
+    - Kết quả được nhận theo đúng thứ tự trang đầu vào.
+    - threads_per_worker: số luồng torch mỗi worker, mặc định chia đều số core cho các worker.
+    - Nếu metrics đang bật, span/counter của worker được gửi về cùng kết quả trang và gộp vào process cha.
+    """
+    cpu_count = os.cpu_count() or 1
+    if workers is None:
+        workers = default_workers(threads_per_worker or 2)
+    threads_per_worker = threads_per_worker or max(1, cpu_count // workers)
+
+    stats = {'pages': 0, 'failed': 0, 'objects': 0, 'detect_time': 0.0, 'total_time': 0.0}
+    if not image_paths:
+        return stats
+
+    options = {'conf': conf, 'iou': iou, 'columns': columns, 'tile_size': tile_size,
+               'tile_overlap': tile_overlap, 'tile_merge': tile_merge,
+               'metrics': metrics.is_enabled(), 'trace': metrics.is_tracing()}
+    max_in_flight = workers * 2
+    start_time = time.perf_counter()
+    print(f"Khởi động {workers} worker ({threads_per_worker} luồng torch mỗi worker)...")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_init_worker,
+                                                initargs=(model_path, threads_per_worker, options)) as pool, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max_readers) as reader, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max_writers) as writer:
+        paths = iter(image_paths)
+        reads = deque()      # (path, future đọc ảnh) theo thứ tự trang
+        submitted = deque()  # (path, ảnh, segment, future detection) theo thứ tự trang
+        write_futures = {}
+
+        def fill_reads():
+            while len(reads) < max_in_flight:
+                path = next(paths, None)
+                if path is None:
+                    return
+                reads.append((path, reader.submit(pipeline.read_image, path)))
+
+        fill_reads()
+        while reads or submitted:
+            while reads and len(submitted) < max_in_flight:
+                path, read_future = reads.popleft()
+                fill_reads()
+                img = read_future.result()
+                if img is None:
+                    stats['failed'] += 1
+                    continue
+                shm, desc = share_array(img)
+                submitted.append((path, img, shm, pool.submit(_process_page, desc)))
+            if not submitted:
+                continue
+
+            path, img, shm, future = submitted.popleft()
+            try:
+                result = future.result()
+            except Exception as e:
+                stats['failed'] += 1
+                logging.error(f"Lỗi khi detection {path}: {str(e)}")
+                continue
+            finally:
+                shm.close()
+                shm.unlink()
+
+            metrics.merge(result['metrics'])
+            crops = _unpack_crops(img, result)
+            page_output_dir, page_result_dir = pipeline.page_dirs(path, output_dir, result_dir, per_page_dirs)
+            write_future = writer.submit(pipeline.save_page_outputs, img, result['detections'],
+                                         result['sorted_objects'], page_output_dir, page_result_dir,
+                                         save_crops=save_crops, processor=processor, crops=crops)
+            write_futures[write_future] = path
+            stats['pages'] += 1
+            stats['objects'] += len(result['sorted_objects'])
+            stats['detect_time'] += result['detect_time']
+            print(f"\rĐã xử lý: {stats['pages'] + stats['failed']}/{len(image_paths)} trang", end="", flush=True)
+
+        for future in concurrent.futures.as_completed(write_futures):
+            try:
+                future.result()
+            except Exception as e:
+                stats['failed'] += 1
+                logging.error(f"Lỗi khi lưu kết quả cho {write_futures[future]}: {str(e)}")
+
+    stats['total_time'] = time.perf_counter() - start_time
+    return stats
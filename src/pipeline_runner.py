@@ -0,0 +1,290 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+import CNN_img_to_text as detection
+import instrumentation as metrics
+import tiling
+
+_DONE = object()
+
+
+class Stage:
+    """
+    Một stage của pipeline: fn(item) -> item cho stage sau (None = bỏ item).
+    Nếu batched, fn nhận danh sách item đang có sẵn trong hàng đợi (tối đa batch_size)
+    và trả về danh sách kết quả cùng độ dài.
+    """
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1, queue_size: int = 8, batched: bool = False,
+                 batch_size: int = 1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.batched = batched
+        self.batch_size = max(1, batch_size) if batched else 1
+
+
+class StageMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.latencies: List[float] = []
+        self.depths: List[int] = []
+
+    def record(self, count: int, latency: float, depth: int, error: bool = False) -> None:
+        with self._lock:
+            self.busy_time += latency
+            self.latencies.append(latency / count)
+            self.depths.append(depth)
+            if error:
+                self.errors += count
+            else:
+                self.items += count
+
+    def summary(self, wall_time: float, workers: int) -> Dict[str, float]:
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        depths = np.array(self.depths) if self.depths else np.zeros(1)
+        return {
+            'items': self.items,
+            'errors': self.errors,
+            'latency_ms_mean': float(latencies.mean()),
+            'latency_ms_p95': float(np.percentile(latencies, 95)),
+            'latency_ms_max': float(latencies.max()),
+            'queue_depth_mean': float(depths.mean()),
+            'queue_depth_max': int(depths.max()),
+            # Tỉ lệ thời gian các worker của stage bận; stage gần 1.0 là nút thắt cổ chai
+            'utilization': self.busy_time / (wall_time * workers) if wall_time > 0 else 0.0,
+        }
+
+
+class StagedPipeline:
+    """
+    Chạy các stage nối tiếp nhau bằng thread, giữa hai stage là một hàng đợi có giới hạn:
+    stage chậm làm đầy hàng đợi phía trước và chặn stage trước nó (backpressure), nên bộ nhớ
+    bị chặn trên và throughput tiến gần tới stage chậm nhất thay vì tổng thời gian các stage.
+    Item bị lỗi ở một stage được ghi log, đếm vào metrics và bỏ qua.
+    """
+
+    def __init__(self, stages: List[Stage], on_error: Optional[Callable[[str, Any, Exception], None]] = None):
+        self.stages = stages
+        self.on_error = on_error
+        self.metrics = {stage.name: StageMetrics() for stage in stages}
+
+    def _take(self, stage: Stage, inbox: queue.Queue) -> List[Any]:
+        """Lấy một item (chờ), rồi thêm các item đang có sẵn cho tới batch_size. Trả về [] khi hết dữ liệu"""
+        first = inbox.get()
+        if first is _DONE:
+            inbox.put(_DONE)  # để các worker khác của stage cũng dừng
+            return []
+        batch = [first]
+        while len(batch) < stage.batch_size:
+            try:
+                item = inbox.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                inbox.put(_DONE)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self, stage: Stage, inbox: queue.Queue, outbox: Optional[queue.Queue], finished: Dict) -> None:
+        metrics = self.metrics[stage.name]
+        while True:
+            depth = inbox.qsize()
+            batch = self._take(stage, inbox)
+            if not batch:
+                break
+            start = time.perf_counter()
+            try:
+                outputs = stage.fn(batch) if stage.batched else [stage.fn(batch[0])]
+            except Exception as e:
+                metrics.record(len(batch), time.perf_counter() - start, depth, error=True)
+                logging.error(f"[{stage.name}] Lỗi: {str(e)}")
+                if self.on_error is not None:
+                    for item in batch:
+                        self.on_error(stage.name, item, e)
+                continue
+            metrics.record(len(batch), time.perf_counter() - start, depth)
+            if outbox is not None:
+                for output in outputs:
+                    if output is not None:
+                        outbox.put(output)
+
+        # Worker cuối cùng của stage báo hết dữ liệu cho stage sau
+        with finished['lock']:
+            finished[stage.name] += 1
+            last = finished[stage.name] == stage.workers
+        if last and outbox is not None:
+            outbox.put(_DONE)
+
+    def run(self, items: Iterable[Any]) -> Dict[str, Dict[str, float]]:
+        """Đưa items qua toàn bộ pipeline, trả về metrics của từng stage"""
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        finished = {'lock': threading.Lock(), **{stage.name: 0 for stage in self.stages}}
+        threads = []
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(self.stages) else None
+            for w in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(stage, queues[i], outbox, finished),
+                                          name=f"{stage.name}-{w}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        start = time.perf_counter()
+        for item in items:
+            queues[0].put(item)  # chặn lại khi stage đầu chưa theo kịp
+        queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - start
+
+        report = {stage.name: self.metrics[stage.name].summary(wall_time, stage.workers) for stage in self.stages}
+        report['_total'] = {'wall_time': wall_time}
+        return report
+
+
+def build_page_stages(model, output_dir: str, result_dir: str, processor=None, per_page_dirs: bool = True,
+                      conf: float = 0.3, iou: float = 0.45, columns: bool = False, save_crops: bool = True,
+                      tile_size: Optional[int] = None, tile_overlap: int = 128, tile_merge: str = 'nms',
+                      batch_size: int = 4,
+                      decode_workers: int = 2, crop_workers: int = 2, ocr_workers: int = 2,
+                      write_workers: int = 2, queue_size: int = 8) -> List[Stage]:
+    """Các stage decode -> detect -> crop/sort -> recognize -> write cho ảnh trang"""
+
+    def decode(path):
+        img = detection.read_image(path)
+        if img is None:
+            raise ValueError(f"Không thể đọc hình ảnh từ {path}")
+        return {'path': path, 'img': img}
+
+    def detect(pages):
+        images = [page['img'] for page in pages]
+        if tile_size:
+            results = detection.detect_tiled(model, images, tile_size=tile_size, overlap=tile_overlap,
+                                             conf=conf, iou=iou, batch_size=batch_size, merge=tile_merge)
+        else:
+            results = detection.detect_batch(model, images, conf=conf, iou=iou)
+        return [dict(page, detections=detections) for page, detections in zip(pages, results)]
+
+    def crop(page):
+        sorted_objects = detection.sort_reading_order(
+            detection.build_objects(page['detections'], page['img'].shape), columns=columns)
+        return dict(page, sorted_objects=sorted_objects,
+                    crops=detection.crop_objects(page['img'], sorted_objects))
+
+    def recognize(page):
+        return dict(page, ocr_results=processor.process_crops(page['crops']))
+
+    def write(page):
+        page_output_dir, page_result_dir = detection.page_dirs(page['path'], output_dir, result_dir,
+                                                               per_page_dirs)
+        detection.save_page_outputs(page['img'], page['detections'], page['sorted_objects'],
+                                    page_output_dir, page_result_dir, save_crops=save_crops,
+                                    processor=processor, crops=page['crops'],
+                                    ocr_results=page.get('ocr_results'))
+
+    stages = [
+        Stage('decode', decode, workers=decode_workers, queue_size=queue_size),
+        # Mô hình không an toàn khi gọi từ nhiều thread: một worker, gom các trang đang chờ thành batch
+        Stage('detect', detect, workers=1, queue_size=queue_size, batched=True, batch_size=batch_size),
+        Stage('crop', crop, workers=crop_workers, queue_size=queue_size),
+    ]
+    if processor is not None:
+        stages.append(Stage('recognize', recognize, workers=ocr_workers, queue_size=queue_size))
+    stages.append(Stage('write', write, workers=write_workers, queue_size=queue_size))
+    return stages
+
+
+def print_metrics(report: Dict[str, Dict[str, float]]) -> None:
+    wall_time = report['_total']['wall_time']
+    print(f"\nPipeline: {wall_time:.2f}s")
+    print(f"{'stage':<10} {'items':>6} {'lỗi':>5} {'ms/item':>8} {'p95 ms':>8} {'queue':>6} {'max q':>6} {'bận':>6}")
+    for name, m in report.items():
+        if name.startswith('_'):
+            continue
+        print(f"{name:<10} {m['items']:>6} {m['errors']:>5} {m['latency_ms_mean']:>8.1f} "
+              f"{m['latency_ms_p95']:>8.1f} {m['queue_depth_mean']:>6.1f} {m['queue_depth_max']:>6} "
+              f"{m['utilization']:>6.0%}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pipeline detection + OCR chạy chồng lấp: decode -> detect -> crop -> recognize -> write")
+    parser.add_argument('input', nargs='?', default=detection.image_path,
+                        help="Ảnh, thư mục hoặc glob pattern (vd: 'data/test/*.png')")
+    parser.add_argument('--model', default=detection.model_path)
+    parser.add_argument('--server', help="URL detection server thay vì tải mô hình")
+    parser.add_argument('--output-dir', default=detection.output_dir)
+    parser.add_argument('--result-dir', default=detection.result_dir)
+    parser.add_argument('--credentials', help="File credentials Google Vision; không có thì bỏ stage recognize")
+    parser.add_argument('--threads', type=int, default=6, help="Số luồng torch trên CPU")
+    parser.add_argument('--conf', type=float, default=0.3)
+    parser.add_argument('--iou', type=float, default=0.45)
+    parser.add_argument('--columns', action='store_true', help="Trang nhiều cột: đọc hết từng cột")
+    parser.add_argument('--tile-size', type=int, help="Detection theo tile kích thước này (px)")
+    parser.add_argument('--tile-overlap', type=int, default=128,
+                        help="Phần chồng giữa các tile (px), nên lớn hơn ô chữ lớn nhất")
+    parser.add_argument('--tile-merge', choices=tiling.MERGE_METHODS, default='nms',
+                        help="Cách gộp box trùng ở đường nối tile")
+    parser.add_argument('--save-crops', action='store_true', help="Vẫn ghi ảnh crop ra đĩa khi OCR")
+    parser.add_argument('--batch-size', type=int, default=4, help="Số trang tối đa mỗi lần chạy YOLO")
+    parser.add_argument('--decode-workers', type=int, default=2)
+    parser.add_argument('--crop-workers', type=int, default=2)
+    parser.add_argument('--ocr-workers', type=int, default=2, help="Số trang OCR đồng thời")
+    parser.add_argument('--write-workers', type=int, default=2)
+    parser.add_argument('--queue-size', type=int, default=8, help="Kích thước hàng đợi giữa các stage")
+    parser.add_argument('--metrics', help="Ghi metrics từng stage ra file JSON")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    metrics.enable_from_args(args)
+    image_paths = detection.collect_image_paths(args.input)
+    detection.validate_paths(None if args.server else args.model, image_paths, args.output_dir)
+
+    if args.server:
+        model = detection.DetectionClient(args.server)
+    else:
+        model = detection.load_model(args.model, num_threads=args.threads)
+
+    processor = None
+    if args.credentials:
+        from OCR_img_ggvision import OCRProcessor
+        processor = OCRProcessor(args.credentials)
+
+    stages = build_page_stages(model, args.output_dir, args.result_dir, processor=processor,
+                               per_page_dirs=not os.path.isfile(args.input), conf=args.conf, iou=args.iou,
+                               columns=args.columns, save_crops=processor is None or args.save_crops,
+                               tile_size=args.tile_size, tile_overlap=args.tile_overlap,
+                               tile_merge=args.tile_merge, batch_size=args.batch_size,
+                               decode_workers=args.decode_workers, crop_workers=args.crop_workers,
+                               ocr_workers=args.ocr_workers, write_workers=args.write_workers,
+                               queue_size=args.queue_size)
+    print(f"Bắt đầu xử lý {len(image_paths)} trang qua {len(stages)} stage...")
+    report = StagedPipeline(stages).run(image_paths)
+    print_metrics(report)
+    if args.server:
+        model.close()
+
+    if args.metrics:
+        with open(args.metrics, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    metrics.finish(args, 'pipeline')
+
+
+if __name__ == "__main__":
+    main()
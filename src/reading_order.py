@@ -0,0 +1,100 @@
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+
+# Độ nghiêng tối đa được bù (tan ~ 6 độ), lớn hơn coi như không phải trang bị nghiêng nhẹ
+MAX_SKEW_SLOPE = 0.1
+# Trang thẳng có box lệch vài px vẫn có thể "nhọn" hơn ở một độ nghiêng nhỏ: chỉ nhận độ nghiêng
+# từ MIN_SKEW_SLOPE (tan ~ 0.9 độ) và khi điểm vượt hẳn trang thẳng (MIN_SKEW_GAIN lần)
+MIN_SKEW_SLOPE = 0.015
+MIN_SKEW_GAIN = 1.25
+
+
+def _group_lines(order: np.ndarray, y: np.ndarray, column: np.ndarray, threshold: float) -> np.ndarray:
+    """Gán id dòng theo thứ tự `order`: dòng mới khi đổi cột hoặc khoảng cách y vượt ngưỡng"""
+    y_sorted = y[order]
+    col_sorted = column[order]
+    breaks = (np.diff(y_sorted) > threshold) | (np.diff(col_sorted) != 0)
+    line_ids = np.empty(len(order), dtype=np.int64)
+    line_ids[order] = np.concatenate([[0], np.cumsum(breaks)])
+    return line_ids
+
+
+def estimate_skew(cx: np.ndarray, cy: np.ndarray, bin_size: float, steps: int = 81) -> float:
+    """
+    Ước lượng độ nghiêng (dy/dx) của trang bằng projection profile: thử các độ nghiêng trong
+    [-MAX_SKEW_SLOPE, MAX_SKEW_SLOPE], chiếu center_y đã bù nghiêng vào histogram và chọn độ
+    nghiêng cho histogram "nhọn" nhất (các dòng thẳng hàng). Mỗi lần thử là O(n).
+    Trả về 0 nếu độ nghiêng tốt nhất nhỏ hơn MIN_SKEW_SLOPE hoặc không hơn trang thẳng MIN_SKEW_GAIN lần.
+    """
+    def score(slope):
+        y = cy - slope * cx
+        hist = np.bincount(((y - y.min()) / bin_size).astype(np.int64))
+        return float(np.dot(hist, hist))
+
+    candidates = np.linspace(-MAX_SKEW_SLOPE, MAX_SKEW_SLOPE, steps)
+    candidates = candidates[np.abs(candidates) >= MIN_SKEW_SLOPE]
+    if not len(candidates):
+        return 0.0
+    scores = [score(slope) for slope in candidates]
+    best = int(np.argmax(scores))
+    if scores[best] < score(0.0) * MIN_SKEW_GAIN:
+        return 0.0
+    return float(candidates[best])
+
+
+def detect_columns(x1: np.ndarray, x2: np.ndarray, min_gap: float) -> np.ndarray:
+    """
+    Tách cột theo khe trắng dọc: sắp xếp theo x1, cột mới bắt đầu khi x1 vượt quá
+    x2 lớn nhất của mọi box bên trái một khoảng >= min_gap (không box nào vắt qua khe).
+    """
+    order = np.argsort(x1, kind='stable')
+    reach = np.maximum.accumulate(x2[order])
+    breaks = x1[order][1:] - reach[:-1] >= min_gap
+    column = np.empty(len(x1), dtype=np.int64)
+    column[order] = np.concatenate([[0], np.cumsum(breaks)])
+    return column
+
+
+def reading_order(boxes, line_tolerance: float = 0.5, deskew: bool = False, columns: bool = False,
+                  column_gap: Optional[float] = None) -> np.ndarray:
+    """
+    Trả về thứ tự đọc (mảng chỉ số) cho các box (N, 4) dạng [x1, y1, x2, y2]. Độ phức tạp O(n log n).
+
+    - Dòng được gom theo center_y; hai box liên tiếp cách nhau quá line_tolerance * chiều cao
+      box trung vị thì sang dòng mới (ngưỡng tự thích nghi với cỡ chữ thay vì cố định 30px).
+    - deskew: bù độ nghiêng nhẹ của trang trước khi gom dòng (tắt mặc định: chỉ bật cho ảnh
+      scan nghiêng, trang thẳng không cần).
+    - columns: đọc hết từng cột từ trái sang phải; khe giữa các cột tối thiểu column_gap
+      (mặc định 2 lần chiều cao box trung vị).
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    n = len(boxes)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    median_height = max(1.0, float(np.median(boxes[:, 3] - boxes[:, 1])))
+    threshold = line_tolerance * median_height
+
+    if columns:
+        gap = column_gap if column_gap is not None else 2 * median_height
+        column = detect_columns(boxes[:, 0], boxes[:, 2], gap)
+    else:
+        column = np.zeros(n, dtype=np.int64)
+
+    if deskew and n > 2:
+        slope = estimate_skew(cx, cy, bin_size=threshold)
+        if slope:
+            cy = cy - slope * cx
+
+    line_ids = _group_lines(np.lexsort((cy, column)), cy, column, threshold)
+    return np.lexsort((cx, line_ids))
+
+
+def sort_objects(objects: Sequence[Dict], coords_key: str = 'coords', **kwargs) -> List[Dict]:
+    """Sắp xếp danh sách dict (có key coords = [x1, y1, x2, y2]) theo thứ tự đọc"""
+    if not objects:
+        return []
+    order = reading_order([obj[coords_key] for obj in objects], **kwargs)
+    return [objects[i] for i in order]
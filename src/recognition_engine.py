@@ -0,0 +1,167 @@
+import asyncio
+import concurrent.futures
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import instrumentation as metrics
+
+_retryable_exceptions = None
+
+
+def retryable_exceptions() -> tuple:
+    """Exception tạm thời của google-api-core, chỉ import khi cần lần đầu (import module này vẫn nhanh)"""
+    global _retryable_exceptions
+    if _retryable_exceptions is None:
+        try:
+            from google.api_core import exceptions as google_exceptions
+            _retryable_exceptions = (
+                google_exceptions.ResourceExhausted,
+                google_exceptions.TooManyRequests,
+                google_exceptions.ServiceUnavailable,
+                google_exceptions.DeadlineExceeded,
+                google_exceptions.InternalServerError,
+            )
+        except ImportError:
+            _retryable_exceptions = ()
+    return _retryable_exceptions
+
+
+# Mã lỗi gRPC của response.error có thể thử lại: DEADLINE_EXCEEDED, RESOURCE_EXHAUSTED, INTERNAL, UNAVAILABLE
+RETRYABLE_STATUS_CODES = {4, 8, 13, 14}
+
+
+class RetryableError(Exception):
+    """Lỗi tạm thời (quota, mạng...) - engine sẽ thử lại với backoff"""
+
+
+class TokenBucket:
+    """
+    Giới hạn số request mỗi giây (QPS), cho phép burst tối đa capacity request.
+    Dùng threading.Lock nên một bucket có thể chia sẻ giữa nhiều event loop / thread.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Giữ chỗ một token, trả về số giây cần chờ trước khi được gửi request"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self) -> float:
+        """Chờ tới lượt, trả về thời gian đã phải chờ"""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class RecognitionEngine:
+    """
+    Engine gọi OCR bất đồng bộ dùng chung cho OCRProcessor và ImageTextExtractor.
+    - max_in_flight: số request chạy đồng thời tối đa (hàng đợi đầu vào cũng bị chặn theo)
+    - qps: giới hạn request mỗi giây (token bucket), None = không giới hạn
+    - max_retries / base_delay / max_delay: exponential backoff có jitter cho lỗi tạm thời
+    - deadline: thời gian tối đa (giây) cho mỗi lần gọi, truyền thẳng cho RPC Vision qua call_options()
+      (hủy được RPC thật, không chỉ bỏ chờ như asyncio.wait_for rồi gửi lại một request trả phí nữa)
+    Hàm gọi OCR là hàm đồng bộ (client Vision), được chạy trong thread pool riêng có đúng
+    max_in_flight thread: mỗi worker chờ lần gọi của nó xong mới gọi tiếp nên không bao giờ thiếu thread.
+    """
+
+    def __init__(self, max_in_flight: int = 4, qps: Optional[float] = 10.0, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 30.0, deadline: Optional[float] = 60.0):
+        self.max_in_flight = max_in_flight
+        self.qps = qps
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        # Bucket dùng chung cho mọi lần run() của engine này
+        self.bucket = TokenBucket(qps) if qps else None
+        self.counters = {'calls': 0, 'retries': 0, 'failures': 0, 'throttle_wait': 0.0}
+
+    def call_options(self) -> Dict[str, Any]:
+        """
+        Tham số cho client Vision (text_detection / batch_annotate_images): timeout theo deadline,
+        retry=None để tắt retry có sẵn của google-api-core vì engine đã tự thử lại có backoff.
+        """
+        return {'timeout': self.deadline, 'retry': None}
+
+    @staticmethod
+    def is_retryable(error: BaseException) -> bool:
+        return isinstance(error, (RetryableError, asyncio.TimeoutError, ConnectionError) + retryable_exceptions())
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full jitter: ngẫu nhiên trong [0, min(max_delay, base_delay * 2^attempt)]"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def _call(self, fn, item, executor) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                self.counters['throttle_wait'] += await self.bucket.acquire()
+            self.counters['calls'] += 1
+            try:
+                # Deadline do chính RPC áp dụng (call_options), không bỏ chờ thread đang chạy
+                value = await loop.run_in_executor(executor, fn, item)
+                return {'ok': True, 'value': value, 'error': None, 'attempts': attempt + 1}
+            except Exception as e:
+                if not self.is_retryable(e) or attempt >= self.max_retries:
+                    self.counters['failures'] += 1
+                    metrics.count('errors')
+                    error = str(e) or type(e).__name__
+                    return {'ok': False, 'value': None, 'error': error, 'attempts': attempt + 1}
+                self.counters['retries'] += 1
+                metrics.count('retries')
+                await asyncio.sleep(self.backoff_delay(attempt))
+                attempt += 1
+
+    async def run_async(self, fn: Callable[[Any], Any], items: Iterable[Any],
+                        max_in_flight: Optional[int] = None,
+                        on_complete: Optional[Callable[[int, Dict[str, Any]], None]] = None
+                        ) -> List[Dict[str, Any]]:
+        """
+        Gọi fn(item) cho từng item, trả về danh sách outcome theo đúng thứ tự đầu vào:
+        {'ok', 'value', 'error', 'attempts'}. Lỗi không bao giờ bị bỏ qua âm thầm.
+        on_complete(số item đã xong, outcome) được gọi sau mỗi item (vd: in tiến trình).
+        """
+        workers = max(1, max_in_flight or self.max_in_flight)
+        queue = asyncio.Queue(maxsize=workers * 2)
+        outcomes = {}
+
+        async def producer():
+            for index, item in enumerate(items):
+                await queue.put((index, item))  # chặn lại khi worker chưa theo kịp (backpressure)
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def worker(executor):
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    return
+                index, item = entry
+                outcomes[index] = await self._call(fn, item, executor)
+                if on_complete is not None:
+                    on_complete(len(outcomes), outcomes[index])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            await asyncio.gather(producer(), *(worker(executor) for _ in range(workers)))
+        return [outcomes[i] for i in range(len(outcomes))]
+
+    def run(self, fn: Callable[[Any], Any], items: Iterable[Any],
+            max_in_flight: Optional[int] = None,
+            on_complete: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """Phiên bản đồng bộ của run_async cho code không dùng asyncio"""
+        return asyncio.run(self.run_async(fn, items, max_in_flight=max_in_flight, on_complete=on_complete))
@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+RESULTS_FORMATS = ('jsonl', 'parquet')
+RESULTS_NAME = "results"
+# File kết quả cũ (một mảng JSON indent=2), vẫn đọc được qua read_results
+LEGACY_RESULTS_NAME = "json_results.json"
+
+
+def results_path(output_dir: str, fmt: str = 'jsonl') -> str:
+    if fmt not in RESULTS_FORMATS:
+        raise ValueError(f"Định dạng kết quả không hỗ trợ: {fmt}")
+    return os.path.join(output_dir, f"{RESULTS_NAME}.{fmt}")
+
+
+def _format_of(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.jsonl':
+        return 'jsonl'
+    if ext == '.parquet':
+        return 'parquet'
+    if ext == '.json':
+        return 'json'
+    raise ValueError(f"Không nhận ra định dạng file kết quả: {path}")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Ghi/đọc Parquet cần pyarrow: pip install pyarrow") from e
+    return pa, pq
+
+
+def compact_record(result: Dict) -> Dict:
+    """
+    Bản ghi gọn của một kết quả OCR (schema của OCRProcessor._build_result):
+    word box chỉ lưu tọa độ tương đối trong crop, dạng cột (words[i] ứng với boxes[i] = 4 đỉnh phẳng).
+    Tọa độ tuyệt đối và tâm box được dựng lại từ crop khi đọc (expand_record).
+    """
+    words, boxes = [], []
+    for block in result["text_blocks"]:
+        words.append(block["text"])
+        boxes.append([int(v) for point in block["position"]["relative_vertices"] for v in point])
+    crop = result.get("original_crop_coords")
+    return {
+        "image_name": result["image_name"],
+        "timestamp": result["timestamp"],
+        "width": result["image_size"]["width"],
+        "height": result["image_size"]["height"],
+        "crop": [int(v) for v in crop] if crop else None,
+        "text": result.get("full_text", ""),
+        "words": words,
+        "boxes": boxes,
+    }
+
+
+def expand_record(record: Dict) -> Dict:
+    """Dựng lại dict kết quả đầy đủ (vertices tuyệt đối, center, relative_vertices) từ bản ghi gọn"""
+    crop = record.get("crop")
+    offset_x, offset_y = (crop[0], crop[1]) if crop else (0, 0)
+    text_blocks = []
+    for text, box in zip(record["words"], record["boxes"]):
+        relative = [[box[i], box[i + 1]] for i in range(0, len(box), 2)]
+        vertices = [[x + offset_x, y + offset_y] for x, y in relative]
+        count = max(1, len(vertices))
+        text_blocks.append({
+            "text": text,
+            "position": {
+                "vertices": vertices,
+                "center": {"x": sum(v[0] for v in vertices) / count, "y": sum(v[1] for v in vertices) / count},
+                "relative_vertices": relative
+            }
+        })
+    return {
+        "image_name": record["image_name"],
+        "timestamp": record["timestamp"],
+        "image_size": {"width": record["width"], "height": record["height"]},
+        "original_crop_coords": list(crop) if crop else None,
+        "full_text": record.get("text") or "",
+        "text_blocks": text_blocks
+    }
+
+
+class ResultsWriter:
+    """
+    Ghi kết quả OCR ngay khi có, không giữ cả danh sách trong bộ nhớ.
+    - jsonl: mỗi kết quả một dòng JSON gọn, flush sau mỗi dòng; chương trình dừng giữa chừng thì
+      các dòng đã ghi vẫn đọc được (dòng cuối ghi dở bị read_results bỏ qua).
+      fsync=True để an toàn cả khi mất điện (chậm hơn).
+    - parquet (cần pyarrow): word box lưu dạng cột, ghi theo row group row_group_size bản ghi;
+      file chỉ đọc được sau close() nên không dùng cho chạy dài cần chịu crash.
+    """
+
+    def __init__(self, path: str, fmt: Optional[str] = None, append: bool = False, fsync: bool = False,
+                 row_group_size: int = 1024):
+        self.path = path
+        self.format = fmt or _format_of(path)
+        if self.format not in RESULTS_FORMATS:
+            raise ValueError(f"Định dạng kết quả không hỗ trợ: {self.format}")
+        self.fsync = fsync
+        self.row_group_size = max(1, row_group_size)
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        if self.format == 'jsonl':
+            self._file = open(path, 'a' if append else 'w', encoding='utf-8')
+        else:
+            if append:
+                raise ValueError("Parquet không hỗ trợ ghi nối, dùng jsonl")
+            self._pa, pq = _import_pyarrow()
+            self._schema = self._pa.schema([
+                ("image_name", self._pa.string()),
+                ("timestamp", self._pa.string()),
+                ("width", self._pa.int32()),
+                ("height", self._pa.int32()),
+                ("crop", self._pa.list_(self._pa.int32())),
+                ("text", self._pa.string()),
+                ("words", self._pa.list_(self._pa.string())),
+                ("boxes", self._pa.list_(self._pa.list_(self._pa.int32()))),
+            ])
+            self._writer = pq.ParquetWriter(path, self._schema)
+            self._buffer: List[Dict] = []
+
+    def write(self, result: Dict) -> None:
+        record = compact_record(result)
+        if self.format == 'jsonl':
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        else:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.row_group_size:
+                self._flush_row_group()
+        self.count += 1
+
+    def write_many(self, results: Iterable[Dict]) -> None:
+        for result in results:
+            self.write(result)
+
+    def _flush_row_group(self) -> None:
+        if self._buffer:
+            table = self._pa.Table.from_pylist(self._buffer, schema=self._schema)
+            self._writer.write_table(table)
+            self._buffer = []
+
+    def close(self) -> None:
+        if self.format == 'jsonl':
+            if not self._file.closed:
+                self._file.close()
+        elif self._writer is not None:
+            self._flush_row_group()
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _read_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                if line.endswith("\n"):
+                    raise
+                # Dòng cuối ghi dở do lần chạy trước bị dừng giữa chừng
+                logging.warning(f"Bỏ qua dòng {line_no} ghi dở trong {path}")
+
+
+def _read_parquet(path: str, batch_size: int) -> Iterator[Dict]:
+    _, pq = _import_pyarrow()
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def read_results(path: str, compact: bool = False, batch_size: int = 1024) -> Iterator[Dict]:
+    """
+    Đọc lần lượt từng kết quả từ results.jsonl / results.parquet (hoặc json_results.json cũ).
+    Mặc định trả về dict đầy đủ như OCRProcessor._build_result; compact=True trả về bản ghi gọn.
+    """
+    fmt = _format_of(path)
+    if fmt == 'json':
+        with open(path, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+        for result in legacy:
+            yield compact_record(result) if compact else result
+        return
+
+    records = _read_jsonl(path) if fmt == 'jsonl' else _read_parquet(path, batch_size)
+    for record in records:
+        yield record if compact else expand_record(record)
+
+
+def find_results(output_dir: str) -> Optional[str]:
+    """File kết quả trong thư mục output OCR: ưu tiên jsonl, rồi parquet, rồi json_results.json cũ"""
+    for name in (f"{RESULTS_NAME}.jsonl", f"{RESULTS_NAME}.parquet", LEGACY_RESULTS_NAME):
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def merge_results(path: str, order: Optional[Sequence[str]] = None) -> List[str]:
+    """
+    Gộp results.jsonl đã ghi nối qua nhiều lần chạy (--resume): mỗi image_name chỉ giữ bản ghi cuối,
+    dòng ghi dở bị bỏ. order: thứ tự image_name mong muốn, tên không có trong order bị loại;
+    None = giữ thứ tự xuất hiện. Chỉ giữ vị trí các dòng trong bộ nhớ, file mới được ghi ra file tạm
+    rồi đổi tên. Trả về danh sách image_name đã giữ.
+    """
+    offsets = {}
+    with open(path, 'rb') as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                try:
+                    offsets[json.loads(line)['image_name']] = offset
+                except json.JSONDecodeError:
+                    if line.endswith(b"\n"):
+                        raise
+                    logging.warning(f"Bỏ qua dòng ghi dở trong {path}")
+            offset += len(line)
+
+    names = [name for name in order if name in offsets] if order is not None else sorted(offsets, key=offsets.get)
+    tmp_path = f"{path}.tmp"
+    with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        for name in names:
+            src.seek(offsets[name])
+            dst.write(src.readline())
+    os.replace(tmp_path, path)
+    return names
+
+
+def convert_results(source: str, destination: str) -> int:
+    """Chuyển đổi giữa các định dạng (vd: results.jsonl -> results.parquet), trả về số bản ghi"""
+    with ResultsWriter(destination) as writer:
+        writer.write_many(read_results(source))
+        return writer.count
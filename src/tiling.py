@@ -0,0 +1,117 @@
+import numpy as np
+from typing import Dict, List, Sequence, Tuple
+
+MERGE_METHODS = ('nms', 'wbf')
+
+
+def tile_grid(width: int, height: int, tile_size: int = 640, overlap: int = 128) -> np.ndarray:
+    """
+    Chia trang thành các tile vuông chồng lên nhau, trả về mảng (T, 4) [x1, y1, x2, y2].
+    Tile cuối mỗi hàng/cột được kéo sát mép ảnh nên mọi tile có cùng kích thước (trừ khi ảnh nhỏ hơn tile).
+    """
+    stride = max(1, tile_size - overlap)
+
+    def starts(length):
+        if length <= tile_size:
+            return np.array([0])
+        positions = np.arange(0, length - tile_size, stride)
+        return np.append(positions, length - tile_size)
+
+    xs, ys = starts(width), starts(height)
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    x1, y1 = grid_x.ravel(), grid_y.ravel()
+    return np.stack([x1, y1, np.minimum(x1 + tile_size, width), np.minimum(y1 + tile_size, height)], axis=1)
+
+
+def overlap_matrix(boxes: np.ndarray) -> np.ndarray:
+    """
+    Ma trận intersection-over-smaller (N, N). Box bị tile cắt cụt nằm gần trọn trong box đầy đủ
+    ở tile bên cạnh nên IoS cao trong khi IoU có thể thấp.
+    """
+    top_left = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+    bottom_right = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)
+    return inter / np.maximum(np.minimum(area[:, None], area[None, :]), 1e-9)
+
+
+def _touches_seam(boxes: np.ndarray, tiles: np.ndarray, width: int, height: int, margin: float) -> np.ndarray:
+    """Box chạm cạnh tile mà cạnh đó không phải mép trang => có thể bị cắt cụt"""
+    left = (boxes[:, 0] - tiles[:, 0] <= margin) & (tiles[:, 0] > 0)
+    top = (boxes[:, 1] - tiles[:, 1] <= margin) & (tiles[:, 1] > 0)
+    right = (tiles[:, 2] - boxes[:, 2] <= margin) & (tiles[:, 2] < width)
+    bottom = (tiles[:, 3] - boxes[:, 3] <= margin) & (tiles[:, 3] < height)
+    return left | top | right | bottom
+
+
+def merge_tile_detections(tile_detections: Sequence[Sequence[Dict]], tiles: np.ndarray, width: int, height: int,
+                          method: str = 'nms', threshold: float = 0.5, seam_margin: float = 2.0) -> List[Dict]:
+    """
+    Gộp detection của các tile (tọa độ trong tile) thành detection trên toàn trang.
+    Chỉ gộp các box cùng lớp đến từ tile khác nhau (trong một tile YOLO đã NMS rồi).
+    Box đầy đủ được ưu tiên hơn box chạm đường nối tile, sau đó tới confidence.
+    - nms: giữ box đại diện của mỗi cụm
+    - wbf: tọa độ là trung bình có trọng số confidence của các box đầy đủ trong cụm
+    """
+    if method not in MERGE_METHODS:
+        raise ValueError(f"Phương pháp gộp không hỗ trợ: {method}")
+
+    flat = [(tile_idx, det) for tile_idx, dets in enumerate(tile_detections) for det in dets]
+    if not flat:
+        return []
+
+    tile_ids = np.array([tile_idx for tile_idx, _ in flat])
+    offsets = tiles[tile_ids, :2]
+    boxes = np.array([det['coords'] for _, det in flat], dtype=np.float64) + np.tile(offsets, 2)
+    scores = np.array([det['confidence'] for _, det in flat])
+    classes = np.array([det['class_id'] for _, det in flat])
+    truncated = _touches_seam(boxes, tiles[tile_ids], width, height, seam_margin)
+
+    order = np.lexsort((-scores, truncated))
+    boxes, scores, classes, tile_ids, truncated = (a[order] for a in (boxes, scores, classes, tile_ids, truncated))
+    names = [flat[i][1]['class_name'] for i in order]
+
+    match = ((overlap_matrix(boxes) >= threshold)
+             & (classes[:, None] == classes[None, :])
+             & (tile_ids[:, None] != tile_ids[None, :]))
+
+    n = len(boxes)
+    cluster = np.full(n, -1)
+    merged = []
+    for i in range(n):
+        if cluster[i] >= 0:
+            continue
+        members = match[i] & (cluster < 0)
+        members[i] = True
+        cluster[members] = i
+
+        box = boxes[i]
+        if method == 'wbf':
+            # Box bị cắt cụt làm lệch trung bình, chỉ dùng khi cả cụm đều bị cắt
+            fused = members & ~truncated if not truncated[i] else members
+            weights = scores[fused]
+            box = (boxes[fused] * weights[:, None]).sum(axis=0) / weights.sum()
+        x1, y1, x2, y2 = np.round(box).astype(int).tolist()
+        merged.append({
+            'class_id': int(classes[i]),
+            'class_name': names[i],
+            'confidence': float(scores[i]),
+            'coords': (x1, y1, x2, y2)
+        })
+    return merged
+
+
+def cut_tiles(img: np.ndarray, tiles: np.ndarray) -> List[np.ndarray]:
+    """Các tile là view trên ảnh gốc (không copy)"""
+    return [img[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles.tolist()]
+
+
+def page_tiles(images: Sequence[np.ndarray], tile_size: int, overlap: int) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """Trả về (grids, tiles): lưới tile của từng trang và danh sách phẳng mọi tile của mọi trang"""
+    grids, tiles = [], []
+    for img in images:
+        height, width = img.shape[:2]
+        grid = tile_grid(width, height, tile_size, overlap)
+        grids.append(grid)
+        tiles.extend(cut_tiles(img, grid))
+    return grids, tiles
@@ -0,0 +1,167 @@
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Namespace của các phần trong gói xlsx (Office Open XML)
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_XDR = "http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing"
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+
+_CELL_REF = re.compile(r"([A-Z]+)(\d*)")
+
+
+def column_letter(index: int) -> str:
+    """Chỉ số cột (0 = A) sang chữ cái như trong Excel"""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def _rels_path(part: str) -> str:
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, "_rels", f"{name}.rels")
+
+
+def _resolve(part: str, target: str) -> str:
+    """Đường dẫn trong gói của target (tương đối theo part chứa relationship)"""
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(part), target))
+
+
+def _cell_value(cell, cell_type: Optional[str], shared_strings: List[str]) -> Any:
+    if cell_type == 'inlineStr':
+        return "".join(t.text or "" for t in cell.iter(f"{{{NS_MAIN}}}t"))
+    value = cell.findtext(f"{{{NS_MAIN}}}v")
+    if value is None:
+        return None
+    if cell_type == 's':
+        return shared_strings[int(value)]
+    if cell_type == 'b':
+        return value == '1'
+    if cell_type in ('str', 'e'):
+        return value
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+class XlsxReader:
+    """
+    Đọc trực tiếp gói xlsx (zip) của sheet đang active: giá trị cell đọc tuần tự từng dòng,
+    ảnh lấy theo anchor trong drawing + bytes gốc trong xl/media, không dựng workbook/ảnh PIL
+    như openpyxl. Chỉ đọc, dùng cho file do openpyxl/Excel tạo.
+
+        with XlsxReader(path) as reader:
+            images = reader.image_anchors()           # {(dòng, cột): part ảnh}
+            for row, values in reader.rows():         # dòng tính từ 1, values: {cột: giá trị}
+                ...
+            data = reader.read(images[(2, 'B')])
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        self.workbook_part = next((target for kind, target in self._relationships("").values()
+                                   if kind == 'officeDocument'), "xl/workbook.xml")
+        self.sheet_part = self._active_sheet_part()
+        self._shared_strings = None
+
+    def _relationships(self, part: str) -> Dict[str, Tuple[str, str]]:
+        """rId -> (loại, part đích) của một part, rỗng nếu part không có relationship"""
+        try:
+            root = ET.fromstring(self._zip.read(_rels_path(part)))
+        except KeyError:
+            return {}
+        return {rel.get('Id'): (rel.get('Type', '').rsplit('/', 1)[-1], _resolve(part, rel.get('Target', '')))
+                for rel in root.iter(f"{{{NS_PKG_REL}}}Relationship") if rel.get('TargetMode') != 'External'}
+
+    def _active_sheet_part(self) -> str:
+        root = ET.fromstring(self._zip.read(self.workbook_part))
+        sheets = root.findall(f"{{{NS_MAIN}}}sheets/{{{NS_MAIN}}}sheet")
+        if not sheets:
+            raise ValueError(f"Workbook không có sheet: {self.path}")
+        view = root.find(f"{{{NS_MAIN}}}bookViews/{{{NS_MAIN}}}workbookView")
+        active = int(view.get('activeTab', 0)) if view is not None else 0
+        sheet = sheets[active if active < len(sheets) else 0]
+        return self._relationships(self.workbook_part)[sheet.get(f"{{{NS_REL}}}id")][1]
+
+    @property
+    def shared_strings(self) -> List[str]:
+        if self._shared_strings is None:
+            self._shared_strings = []
+            parts = [target for kind, target in self._relationships(self.workbook_part).values()
+                     if kind == 'sharedStrings']
+            if parts:
+                for _, element in ET.iterparse(self._zip.open(parts[0])):
+                    if element.tag == f"{{{NS_MAIN}}}si":
+                        # Text thường (<t>) hoặc ghép các run (<r><t>), bỏ phần phiên âm (rPh)
+                        self._shared_strings.append("".join(
+                            t.text or "" for t in (*element.findall(f"{{{NS_MAIN}}}t"),
+                                                   *element.findall(f"{{{NS_MAIN}}}r/{{{NS_MAIN}}}t"))))
+                        element.clear()
+        return self._shared_strings
+
+    def rows(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """(số dòng từ 1, {chữ cái cột: giá trị}) theo thứ tự trong file, bỏ cell rỗng"""
+        shared_strings = self.shared_strings
+        row_tag, cell_tag = f"{{{NS_MAIN}}}row", f"{{{NS_MAIN}}}c"
+        row_number = 0
+        for _, element in ET.iterparse(self._zip.open(self.sheet_part)):
+            if element.tag != row_tag:
+                continue
+            row_number = int(element.get('r', row_number + 1))
+            values = {}
+            for position, cell in enumerate(element.iter(cell_tag)):
+                match = _CELL_REF.match(cell.get('r', ''))
+                column = match.group(1) if match else column_letter(position)
+                value = _cell_value(cell, cell.get('t'), shared_strings)
+                if value is not None:
+                    values[column] = value
+            element.clear()
+            yield row_number, values
+
+    def image_anchors(self) -> Dict[Tuple[int, str], str]:
+        """
+        {(dòng từ 1, chữ cái cột): part ảnh trong xl/media} theo ô góc trên trái của anchor.
+        Ảnh neo tuyệt đối (absoluteAnchor) không gắn với ô nào nên bị bỏ qua.
+        """
+        anchors = {}
+        for kind, drawing_part in self._relationships(self.sheet_part).values():
+            if kind != 'drawing':
+                continue
+            media = {rel_id: target for rel_id, (kind, target) in self._relationships(drawing_part).items()
+                     if kind == 'image'}
+            root = ET.fromstring(self._zip.read(drawing_part))
+            for anchor in root:
+                start = anchor.find(f"{{{NS_XDR}}}from")
+                blip = anchor.find(f".//{{{NS_A}}}blip")
+                if start is None or blip is None:
+                    continue
+                part = media.get(blip.get(f"{{{NS_REL}}}embed"))
+                if part is None:
+                    continue
+                row = int(start.findtext(f"{{{NS_XDR}}}row")) + 1
+                column = column_letter(int(start.findtext(f"{{{NS_XDR}}}col")))
+                # Nhiều ảnh cùng một ô: giữ ảnh đầu tiên như thứ tự trong drawing
+                anchors.setdefault((row, column), part)
+        return anchors
+
+    def read(self, part: str) -> bytes:
+        """Bytes gốc của một part (vd: ảnh trong xl/media), không giải mã"""
+        return self._zip.read(part)
+
+    def close(self) -> None:
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,33 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import detector_backends
+
+
+def test_export_reused_only_with_same_imgsz(tmp_path, monkeypatch):
+    model_path = tmp_path / "model.pt"
+    model_path.write_bytes(b"weights")
+    target = tmp_path / "model.onnx"
+    target.write_bytes(b"onnx")
+    os.utime(target, (os.path.getmtime(model_path) + 10,) * 2)
+
+    exports = []
+
+    class FakeYOLO:
+        def __init__(self, path):
+            pass
+
+        def export(self, **kwargs):
+            exports.append(kwargs['imgsz'])
+            return str(target)
+
+    monkeypatch.setitem(sys.modules, 'ultralytics', type(sys)('ultralytics'))
+    monkeypatch.setattr(sys.modules['ultralytics'], 'YOLO', FakeYOLO, raising=False)
+
+    # Bản export không có ghi chép tham số: không biết imgsz nên export lại
+    detector_backends.export_model(str(model_path), 'onnx', imgsz=640)
+    detector_backends.export_model(str(model_path), 'onnx', imgsz=640)
+    detector_backends.export_model(str(model_path), 'onnx', imgsz=1280)
+    assert exports == [640, 1280]
+    assert detector_backends.export_info(str(target))['imgsz'] == 1280
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import instrumentation as metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    metrics.reset()
+    metrics.enable(trace=True)
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+def test_drain_clears_registry():
+    metrics.count('crops', 3)
+    with metrics.span('infer'):
+        pass
+
+    data = metrics.drain()
+    assert data['counters'] == {'crops': 3}
+    assert data['histograms']['infer']['count'] == 1
+    assert len(data['events']) == 1
+    assert metrics.snapshot() == {'counters': {}, 'spans': {}}
+
+
+def test_merge_adds_worker_metrics():
+    # Giả lập metrics của một worker process
+    metrics.count('crops', 2)
+    metrics.observe('infer', 0.02)
+    metrics.observe('infer', 3.0)
+    worker = metrics.drain()
+
+    metrics.count('crops', 1)
+    metrics.count('pages')
+    metrics.observe('infer', 0.02)
+    metrics.merge(worker)
+
+    snap = metrics.snapshot()
+    assert snap['counters'] == {'crops': 3, 'pages': 1}
+    infer = snap['spans']['infer']
+    assert infer['count'] == 3
+    assert infer['sum'] == pytest.approx(3.04)
+    assert infer['buckets']['0.025'] == 2 and infer['buckets']['5.0'] == 1
+
+
+def test_merge_is_noop_when_disabled():
+    metrics.count('crops', 2)
+    worker = metrics.drain()
+    metrics.disable()
+    metrics.merge(worker)
+    assert metrics.snapshot()['counters'] == {}
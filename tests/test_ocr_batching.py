@@ -0,0 +1,110 @@
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from fake_vision import FakeVisionClient
+from OCR_img_ggvision import MAX_BATCH_IMAGES, OCRProcessor
+from recognition_engine import RecognitionEngine
+from results_store import read_results
+
+
+def make_items(count):
+    items = []
+    for i in range(count):
+        img = np.full((20, 30 + i, 3), i % 256, dtype=np.uint8)
+        items.append({'name': f"crop_{i:03d}_text.png", 'content': cv2.imencode('.png', img)[1].tobytes(),
+                      'size': (30 + i, 20), 'crop_info': None})
+    return items
+
+
+def make_processor(client, **engine_options):
+    engine_options.setdefault('base_delay', 0.0)
+    return OCRProcessor(client=client, engine=RecognitionEngine(qps=None, **engine_options))
+
+
+def test_batches_larger_than_limit_are_split():
+    client = FakeVisionClient()
+    items = make_items(40)
+    results, errors = make_processor(client).process_batched(items, batch_size=64)
+
+    assert errors == []
+    assert [r['image_name'] for r in results] == [item['name'] for item in items]
+    # batch_size bị giới hạn về MAX_BATCH_IMAGES ảnh mỗi RPC
+    assert client.counters['rpc_calls'] == -(-40 // MAX_BATCH_IMAGES)
+    assert client.counters['images'] == 40
+
+
+def test_per_image_errors_are_split_from_batch():
+    client = FakeVisionClient(error_every=5)
+    items = make_items(20)
+    results, errors = make_processor(client).process_batched(items, batch_size=16, max_workers=1)
+
+    failed = {item['name'] for i, item in enumerate(items, 1) if i % 5 == 0}
+    assert {e['image_name'] for e in errors} == failed
+    assert [r['image_name'] for r in results] == [item['name'] for item in items if item['name'] not in failed]
+    # Lỗi không thử lại được: không gửi lại RPC nào
+    assert client.counters['rpc_calls'] == 2
+
+
+def test_retryable_image_error_resends_only_that_image():
+    client = FakeVisionClient(error_every=3, error_code=8)
+    items = make_items(5)
+    results, errors = make_processor(client).process_batched(items, max_workers=1)
+
+    assert errors == []
+    assert len(results) == 5
+    # Lần 1 gửi 5 ảnh (ảnh 3 lỗi), mỗi lần thử lại chỉ gửi lại đúng một ảnh lỗi
+    assert client.counters['images'] == 5 + client.counters['rpc_calls'] - 1
+
+
+def test_retries_exhausted_keeps_successful_images():
+    client = FakeVisionClient(error_every=3, error_code=8)
+    items = make_items(5)
+    results, errors = make_processor(client, max_retries=0).process_batched(items, max_workers=1)
+
+    assert [e['image_name'] for e in errors] == [items[2]['name']]
+    assert errors[0]['attempts'] == 1
+    assert len(results) == 4
+
+
+def test_raised_rpc_errors_are_retried():
+    client = FakeVisionClient(raise_every=2)
+    items = make_items(40)
+    results, errors = make_processor(client).process_batched(items, max_workers=1)
+
+    assert errors == []
+    assert len(results) == 40
+    assert client.counters['raised'] > 0
+
+
+def test_raised_rpc_errors_fail_whole_batch_after_retries():
+    client = FakeVisionClient(raise_every=1)
+    results, errors = make_processor(client, max_retries=1).process_batched(make_items(20), max_workers=1)
+
+    assert results == []
+    assert len(errors) == 20
+    assert all(e['attempts'] == 2 for e in errors)
+
+
+@pytest.mark.parametrize('batch_size', [None, 16])
+def test_process_directory_with_fake_vision(tmp_path, batch_size):
+    input_dir, output_dir = tmp_path / "imgs", tmp_path / "out"
+    input_dir.mkdir()
+    items = make_items(35)
+    for item in items:
+        (input_dir / item['name']).write_bytes(item['content'])
+
+    client = FakeVisionClient(error_every=7)
+    processed = make_processor(client).process_directory(str(input_dir), str(output_dir), batch_size=batch_size)
+
+    assert processed == 30
+    stored = [r['image_name'] for r in read_results(str(output_dir / "results.jsonl"))]
+    assert stored == sorted(stored) and len(stored) == 30
+    with open(output_dir / "ocr_errors.json", encoding='utf-8') as f:
+        assert len(json.load(f)) == 5
+    assert (output_dir / "ocr_summary.xlsx").exists()
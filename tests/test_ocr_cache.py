@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import ocr_cache
+from ocr_cache import OCRCache
+
+
+def test_memory_hit_respects_max_age(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ocr_cache.time, 'time', lambda: now[0])
+    cache = OCRCache(str(tmp_path / "cache.db"), max_age_days=1)
+    cache.put("k", b"value")
+
+    assert cache.get("k") == b"value"
+    assert cache.counters['memory_hits'] == 1
+
+    now[0] += 86400 + 1
+    assert cache.get("k") is None
+    assert cache.counters['misses'] == 1
+    cache.close()
+
+
+def test_disk_hit_keeps_original_age(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ocr_cache.time, 'time', lambda: now[0])
+    db_path = str(tmp_path / "cache.db")
+    cache = OCRCache(db_path, max_age_days=1)
+    cache.put("k", b"value")
+    cache.close()
+
+    # Process mới: lần đầu đọc từ đĩa, sau đó từ LRU nhưng vẫn theo thời điểm ghi ban đầu
+    now[0] += 86000
+    cache = OCRCache(db_path, max_age_days=1)
+    assert cache.get("k") == b"value"
+    now[0] += 1000
+    assert cache.get("k") is None
+    assert (cache.counters['disk_hits'], cache.counters['memory_hits'], cache.counters['misses']) == (1, 0, 1)
+    cache.close()
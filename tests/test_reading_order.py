@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from reading_order import estimate_skew, reading_order, sort_objects
+
+
+def straight_form(seed, skew=0.0):
+    """Biểu mẫu thẳng: 1-3 box mỗi dòng, lệch dọc ±5px, cao 30-50px. Trả về (boxes xáo trộn, thứ tự đúng)"""
+    rng = np.random.default_rng(seed)
+    boxes, y = [], 100.0
+    for _ in range(int(rng.integers(10, 30))):
+        x = rng.uniform(50, 300)
+        for _ in range(int(rng.integers(1, 4))):
+            w, h = rng.uniform(150, 600), rng.uniform(30, 50)
+            cy = y + rng.uniform(-5, 5)
+            boxes.append([x, cy - h / 2, x + w, cy + h / 2])
+            x += w + rng.uniform(40, 400)
+        y += rng.uniform(60, 90)
+    boxes = np.array(boxes)
+    if skew:
+        boxes[:, [1, 3]] += (skew * (boxes[:, 0] + boxes[:, 2]) / 2)[:, None]
+    shuffle = rng.permutation(len(boxes))
+    return boxes[shuffle], np.argsort(shuffle)
+
+
+@pytest.mark.parametrize('deskew', [False, True])
+def test_straight_pages_with_jitter(deskew):
+    wrong = [seed for seed in range(100)
+             if not np.array_equal(reading_order(*straight_form(seed)[:1], deskew=deskew), straight_form(seed)[1])]
+    assert wrong == []
+
+
+def test_straight_pages_are_not_deskewed():
+    slopes = []
+    for seed in range(100):
+        boxes, _ = straight_form(seed)
+        cx, cy = (boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2
+        slopes.append(estimate_skew(cx, cy, bin_size=0.5 * np.median(boxes[:, 3] - boxes[:, 1])))
+    assert slopes.count(0.0) >= 98
+
+
+def test_deskew_is_opt_in():
+    boxes, truth = straight_form(0, skew=0.04)
+    assert not np.array_equal(reading_order(boxes), truth)
+    assert np.array_equal(reading_order(boxes, deskew=True), truth)
+
+
+def test_columns_read_top_to_bottom():
+    # Hai cột, mỗi cột 3 dòng: đọc hết cột trái rồi mới sang cột phải
+    boxes = [[x, y, x + 100, y + 40] for x in (0, 600) for y in (0, 100, 200)]
+    objects = [{'coords': box, 'id': i} for i, box in enumerate(boxes)]
+    assert [o['id'] for o in sort_objects(objects[::-1], columns=True)] == list(range(6))
+    assert [o['id'] for o in sort_objects(objects[::-1])] == [0, 3, 1, 4, 2, 5]